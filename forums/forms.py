@@ -5,7 +5,7 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import RegexValidator, MaxLengthValidator, MinLengthValidator
-from website.models import Profile
+from website.models import EMAIL_DIGEST_CHOICES, Profile
 
 
 class UserLoginForm(forms.Form):
@@ -55,6 +55,12 @@ class ProfileForm(forms.ModelForm):
         ],
     )
 
+    email_digest = forms.ChoiceField(
+        label = _("Thread emails"),
+        choices = EMAIL_DIGEST_CHOICES,
+        required = False,
+    )
+
     def clean_last_name(self):
 
         last_name = self.cleaned_data['last_name']
@@ -30,9 +30,13 @@ TEMPLATES = [
                     'django.template.context_processors.tz',
                     'django.contrib.messages.context_processors.messages',
             ],
+            # The HTML templates are stripped of their whitespace when
+            # loaded, see website/loaders.py
             'loaders':[
-                    'django.template.loaders.filesystem.Loader',
-                    'django.template.loaders.app_directories.Loader',
+                    ('website.loaders.Loader', [
+                        'django.template.loaders.filesystem.Loader',
+                        'django.template.loaders.app_directories.Loader',
+                    ]),
             ]
         },
     },
@@ -44,6 +48,14 @@ FORM_RENDERER = 'django.forms.renderers.TemplatesSetting'
 
 DEBUG = True
 
+if not DEBUG:
+    # Keep the compiled templates in memory instead of parsing them again on
+    # every request. See website/warmup.py for compiling them at startup.
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader',
+         TEMPLATES[0]['OPTIONS']['loaders']),
+    ]
+
 SITE_ID = SET_SITE_ID
 
 ADMINS = (
@@ -129,17 +141,43 @@ SECRET_KEY = SECRET_KEY_CODE
 # List of callables that know how to import templates from various sources.
 
 MIDDLEWARE = [
+    'website.middleware.metrics_middleware',
+    'website.middleware.query_stats_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'website.middleware.profiler_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'htmlmin.middleware.HtmlMinifyMiddleware',
-    'htmlmin.middleware.MarkRequestMiddleware',
 ]
 
+# SQL budgets of a request, over which website.middleware logs a warning:
+# number of queries, seconds spent in the database, and number of times the
+# same query may run (more means a query per row, see QueryStats.repeated)
+SQL_QUERY_BUDGET = 50
+SQL_TIME_BUDGET = 0.5
+SQL_REPEATED_QUERY_BUDGET = 5
+# Send the SQL summary of every request in the X-SQL-Stats header
+SQL_STATS_HEADER = DEBUG
+
+# Directory where every process writes its metrics for /metrics (see
+# website.metrics), at most every METRICS_FLUSH_INTERVAL seconds. Empty it
+# when the server is (re)started.
+METRICS_DIR = '/tmp/forums-metrics'
+METRICS_FLUSH_INTERVAL = 1
+# Addresses allowed to read /metrics
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Query parameter with which a superuser gets the profile of a request
+# instead of the page (see website.profiler), the number of functions listed
+# in the text profile, and the seconds between two samples of a flame graph
+# (the interpreter switches threads every 5ms)
+PROFILER_PARAMETER = 'profile'
+PROFILER_TOP = 40
+PROFILER_SAMPLE_INTERVAL = 0.005
+
 ROOT_URLCONF = 'forums.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -198,9 +236,9 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 COMPRESS_ROOT = BASE_DIR + "/static/"
 COMPRESS_ENABLED = True 	# disable in production Env
-HTML_MINIFY = True 		# disable in production Env
-
-HTML_MINIFY = HTML_MINIFY
+# Templates whose whitespace is kept by website.loaders (regular expressions
+# searched in the template names): the plain text emails
+TEMPLATE_MINIFY_EXCLUDE = [r'(^|/)emails/', r'_email\.html$', r'\.txt$']
 #RECAPTCHA_PROXY = 'http://127.0.0.1:8000'
 #NOCAPTCHA = True
 RECAPTCHA_PUBLIC_KEY = PUB_KEY
@@ -211,6 +249,15 @@ GOOGLE_RECAPTCHA_SECRET_KEY = FORUM_GOOGLE_RECAPTCHA_SECRET_KEY
 GOOGLE_RECAPTCHA_SITE_KEY = FORUM_GOOGLE_RECAPTCHA_SITE_KEY
 
 RECAPTCHA_USE_SSL = True
+
+# Verification of the reCAPTCHA responses of the forum (website/recaptcha.py).
+# 'website.recaptcha.LocalBackend' verifies them without any network access.
+RECAPTCHA_BACKEND = 'website.recaptcha.SiteVerifyBackend'
+RECAPTCHA_VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+# Seconds to wait for the answer of RECAPTCHA_VERIFY_URL
+RECAPTCHA_TIMEOUT = 3
+# Accept the responses which could not be verified (True), or reject them
+RECAPTCHA_FAIL_OPEN = False
 DEBUG_TOOLBAR_PATCH_SETTINGS = False
 
 EMAIL_URL = EMAIL_URL
@@ -239,6 +286,86 @@ EMAIL_PORT = EMAIL_PORT_SERVER
 # Maximum file size limit in bytes
 MAXIMUM_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
 
+# Number of notifications shown per page
+NOTIFICATIONS_PER_PAGE = 20
+
+# Seconds for which the unread notification count of a user is cached
+NOTIFICATION_COUNT_TIMEOUT = 60 * 60
+
+# Warm up the worker when forums/wsgi.py is loaded: load the views, compile
+# the templates and train the spam filter before serving the first request.
+# With a pre-fork server loading the application in the master (e.g.
+# gunicorn --preload) this is done once and shared by all the workers.
+WSGI_WARM_UP = False
+
+# File the trained spam filter is published to, so that a model trained in one
+# process is loaded by all the others
+SPAM_FILTER_MODEL_PATH = BASE_DIR + '/Spam_Filter_Data/model.pickle'
+# The tests publish the spam filter they train to a temporary file instead
+TEST_RUNNER = 'website.test_runner.TestRunner'
+# Seconds after which an unfinished spam filter training is considered dead
+SPAM_FILTER_TRAINING_TIMEOUT = 60 * 60
+
+# Maximum number of posts of each kind listed in the moderators' review queue
+REVIEW_QUEUE_SIZE = 100
+
+# Maximum number of posts of a user (moderators excepted) over a sliding
+# window: action -> (number of posts, window in seconds)
+RATE_LIMITS = {
+    'question': (5, 60 * 60),
+    'answer': (20, 60 * 60),
+    'comment': (30, 60 * 60),
+}
+
+# Checks done before scoring a post with the spam filter: a post of at least
+# SPAM_REPEATED_CHARACTERS_MIN_LENGTH characters is spam if more than this
+# part of them are in runs of a repeated character. The authors posting more
+# than SPAM_VELOCITY_LIMIT times within SPAM_VELOCITY_WINDOW seconds are
+# logged, their posts are still scored by the model.
+SPAM_REPEATED_CHARACTERS_RATIO = 0.5
+SPAM_REPEATED_CHARACTERS_MIN_LENGTH = 40
+SPAM_VELOCITY_LIMIT = 10
+SPAM_VELOCITY_WINDOW = 10 * 60
+# Seconds for which it is cached whether the posts with a given content
+# (fingerprint) are spam
+SPAM_FINGERPRINT_TIMEOUT = 30 * 24 * 60 * 60
+# Posts whose normalized text is shorter get no fingerprint: they are neither
+# recognized as known spam nor listed together in the moderator panel
+SPAM_FINGERPRINT_MIN_LENGTH = 20
+
+# Unix socket of the spam scoring server shared by the workers, started with
+# "python manage.py spam_server". When None, or when the server cannot be
+# reached, every worker scores with its own copy of the spam filter.
+SPAM_SERVER_SOCKET = None
+# Seconds a worker waits for the server before scoring by itself
+SPAM_SERVER_TIMEOUT = 2
+# Seconds the server waits for more texts to score in the same batch, and
+# the maximum number of texts in a batch
+SPAM_SERVER_BATCH_WAIT = 0.005
+SPAM_SERVER_BATCH_SIZE = 64
+
+# Seconds for which the pages of the anonymous users are cached (see
+# decorators.anonymous_page_cache). A change of the posts of a page makes
+# a new entry, the old one expires.
+PAGE_CACHE_TIMEOUT = 10 * 60
+
+# Seconds for which the rows of the tables of questions are cached (see
+# views.question_row_html), and the number of rows rendered from a query of
+# their ids rather than the query of the whole table
+QUESTION_ROW_TIMEOUT = 24 * 60 * 60
+QUESTION_ROW_BATCH_SIZE = 500
+
+# Cache used for counters and other per-user data. The default local-memory
+# cache is private to each worker process, use a shared backend such as
+# memcached when running several workers. It keeps a row for every question
+# listed (see QUESTION_ROW_TIMEOUT), past the 300 entries of the default.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
 ####################################
     ##  CKEDITOR CONFIGURATION ##
 ####################################
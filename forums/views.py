@@ -1,10 +1,6 @@
 # standard library
-import json
 import random
-import ssl
 import string
-import urllib.parse
-import urllib.request
 from builtins import range, str
 
 # Django
@@ -22,7 +18,10 @@ from django.urls import Resolver404, resolve
 from django.utils.html import strip_tags
 
 # local Django
-from website.models import Answer, ModeratorGroup, Profile, Question
+from website.digest import flush_digest
+from website.models import Answer, Profile, Question
+from website.permissions import get_permissions
+from website.recaptcha import verify_request
 from .forms import ProfileForm, RegisterForm, UserLoginForm
 
 
@@ -110,18 +109,7 @@ def account_register(request):
     if request.method == 'POST':
         form = RegisterForm(request.POST)
         if form.is_valid():
-            ''' Begin reCAPTCHA validation '''
-            recaptcha_response = request.POST.get('g-recaptcha-response')
-            url = 'https://www.google.com/recaptcha/api/siteverify'
-            values = {
-                'secret': settings.GOOGLE_RECAPTCHA_SECRET_KEY,
-                'response': recaptcha_response
-            }
-            data = urllib.parse.urlencode(values).encode('utf-8')
-            req = urllib.request.Request(url, data)
-            response = urllib.request.urlopen(req)
-            result = json.load(response)
-            ''' End reCAPTCHA validation '''
+            recaptcha_is_valid = verify_request(request)
 
             username = request.POST['username']
             password = request.POST['password']
@@ -129,7 +117,7 @@ def account_register(request):
             user = User.objects.create_user(username, email, password)
             user.is_active = False
 
-            if result['success']:
+            if recaptcha_is_valid:
                 user.save()
             else:
                 messages.error(request, 'Invalid reCAPTCHA. Please try again.')
@@ -203,10 +191,16 @@ def account_profile(request):
             user.last_name = request.POST['last_name']
             profile.address = request.POST['address']
             profile.phone = request.POST['phone']
+            digest = profile.email_digest
+            profile.email_digest = (form.cleaned_data['email_digest'] or
+                                    'immediate')
             user.save()
             form_data = form.save(commit=False)
             form_data.user_id = user.id
             profile.save()
+            # The notifications waiting for the next digest are sent now
+            if digest != 'immediate' and profile.email_digest == 'immediate':
+                flush_digest(user.id)
 
             messages.success(request, "Your profile has been updated!")
 
@@ -246,32 +240,21 @@ def account_view_profile(request, user_id=None):
     if request.session.get('MODERATOR_ACTIVATED', False):
         # Moderators other than super moderator (forum_moderator)
         # should be able to view Ques/Ans of only their Categories.
-        if request.user.groups.filter(name="forum_moderator").exists():
+        if get_permissions(request.user).is_super_moderator:
             questions = Question.objects.filter(
                 user_id=user_id, category__hidden=False).order_by('-date_created')
             answers = Answer.objects.filter(
                 uid=user_id,
                 question__category__hidden=False).order_by('-date_created')
         else:
-            questions = []
-            answers = []
-            for group in request.user.groups.all():
-                category = ModeratorGroup.objects.get(group=group).category
-                # Don't include hidden categories
-                if category.hidden:
-                    continue
-                questions.extend(Question.objects.filter(
-                    user_id=user_id, category__name=category.name))
-                answers.extend(Answer.objects.filter(
-                    uid=user_id, question__category__name=category.name))
-            questions.sort(
-                key=lambda question: question.date_created,
-                reverse=True,
-            )
-            answers.sort(
-                key=lambda answer: answer.date_created,
-                reverse=True,
-            )
+            # Don't include hidden categories
+            category_ids = get_permissions(request.user).category_ids
+            questions = Question.objects.filter(
+                user_id=user_id, category_id__in=category_ids,
+                category__hidden=False).order_by('-date_created')
+            answers = Answer.objects.filter(
+                uid=user_id, question__category_id__in=category_ids,
+                question__category__hidden=False).order_by('-date_created')
     else:
         # Spammed questions should be visible if flag=True
         if flag:
@@ -294,7 +277,7 @@ def account_view_profile(request, user_id=None):
         'show': flag,
         'profile' : profile,
         'questions' : questions,
-        'answers' : answers,
+        'answers' : answers.select_related('question'),
         'form' : form,
     }
     return render(request, 'forums/templates/view-profile.html', context)
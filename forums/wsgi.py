@@ -37,6 +37,11 @@ activate_this = '/Sites/newforums_fossee_in/django/bin/activate_this.py'
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+from django.conf import settings
+if settings.WSGI_WARM_UP:
+    from website.warmup import warm_up
+    warm_up()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
@@ -1,9 +1,13 @@
 from django.conf import settings
-from .views import admins
+from .permissions import get_admin_ids
 
 
 def admin_processor(request):
-    return {'admins': admins}
+    """
+    Return the ids of the superusers. The ids are looked up only if a template
+    uses them.
+    """
+    return {'admins': get_admin_ids}
 
 
 def booleans():
@@ -1,9 +1,23 @@
-from functools import wraps
+import datetime
+import hashlib
+import math
+import os
+import time
+from functools import lru_cache, wraps
 
 from django.conf import settings
 from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.context_processors import csrf
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
-import requests
+from . import metrics
+from .notifications import notification_count
+from .permissions import get_permissions
+from .recaptcha import verify_request
 
 
 def check_recaptcha(view_func):
@@ -11,19 +25,225 @@ def check_recaptcha(view_func):
     def _wrapped_view(request, *args, **kwargs):
         request.recaptcha_is_valid = None
         if request.method == 'POST':
-            recaptcha_response = request.POST.get('g-recaptcha-response')
-            data = {
-                'secret': settings.GOOGLE_RECAPTCHA_SECRET_KEY,
-                'response': recaptcha_response
-            }
-            r = requests.post(
-                'https://www.google.com/recaptcha/api/siteverify',
-                data=data)
-            result = r.json()
-            if result['success']:
+            if verify_request(request):
                 request.recaptcha_is_valid = True
             else:
                 request.recaptcha_is_valid = False
                 messages.error(request, 'Invalid reCAPTCHA. Please try again.')
         return view_func(request, *args, **kwargs)
     return _wrapped_view
+
+
+def rate_limit_key(action, uid, window):
+    return 'rate_limit_{0}_{1}_{2}'.format(action, uid, window)
+
+
+def rate_limit_count(action, uid, period, now):
+    """
+    Return the approximate number of the user's requests for the action in
+    the last period seconds: the count of the current fixed window plus the
+    count of the previous one, weighted by how much of it is still within
+    the period.
+    """
+    window = int(now // period)
+    counts = cache.get_many([rate_limit_key(action, uid, window - 1),
+                             rate_limit_key(action, uid, window)])
+    previous = counts.get(rate_limit_key(action, uid, window - 1), 0)
+    current = counts.get(rate_limit_key(action, uid, window), 0)
+    elapsed = now / period - window
+    return previous * (1 - elapsed) + current
+
+
+def rate_limit(action):
+    """
+    Limit the POST requests of a user for the action to the number allowed
+    by settings.RATE_LIMITS[action] = (requests, period in seconds) over a
+    sliding window. Moderators are not limited. The request is rejected
+    before the view does any work, with a 429 response.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view_func(request, *args, **kwargs)
+
+            limit, period = settings.RATE_LIMITS[action]
+            uid = request.user.id
+            now = time.time()
+            # Only over the limit is it worth looking up the permissions
+            if (rate_limit_count(action, uid, period, now) >= limit
+                    and not get_permissions(request.user).is_moderator):
+                retry_after = math.ceil(period / limit)
+                response = HttpResponse(
+                    'You are posting too fast. Please try again in {0} '
+                    'minutes.'.format(math.ceil(retry_after / 60)),
+                    status=429, content_type='text/plain')
+                response['Retry-After'] = retry_after
+                return response
+
+            # The count expires once it is out of the next window too
+            key = rate_limit_key(action, uid, int(now // period))
+            cache.add(key, 0, 2 * period)
+            try:
+                cache.incr(key)
+            except ValueError:
+                pass
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def code_stamp():
+    """
+    Latest modification time of the code and the templates of the forum, so
+    that the pages cached by the browsers are revalidated after a deploy.
+    """
+    latest = 0
+    root = os.path.dirname(os.path.abspath(__file__))
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(('.py', '.html')):
+                latest = max(latest, os.path.getmtime(
+                    os.path.join(directory, filename)))
+    return datetime.datetime.fromtimestamp(latest, datetime.timezone.utc)
+
+
+page_cache_requests = metrics.counter(
+    'forum_page_cache_requests',
+    'Pages of anonymous users served from the page cache or rendered.',
+    ['view', 'result'])
+
+# Stands for the CSRF token in the cached pages, replaced with a token of
+# each request
+CSRF_TOKEN_PLACEHOLDER = 'PAGE_CACHE_CSRF_TOKEN'
+
+
+def page_version(request, version_func, *args, **kwargs):
+    """
+    Return the version stamp of the page, computed once per request, or None
+    if it must be rendered (not a GET, or messages to show).
+    """
+    if not hasattr(request, '_page_version'):
+        request._page_version = None
+        if (request.method in ('GET', 'HEAD') and
+                not len(messages.get_messages(request))):
+            request._page_version = version_func(request, *args, **kwargs)
+    return request._page_version
+
+
+def page_csrf(request):
+    """
+    Context of the CSRF token of a page, like csrf(request), with the
+    placeholder of the token when the page is rendered for the page cache.
+    """
+    if getattr(request, '_page_cached', False):
+        return {'csrf_token': CSRF_TOKEN_PLACEHOLDER}
+    return csrf(request)
+
+
+def conditional_page(version_func, not_modified=None):
+    """
+    Answer the GET requests of a page with 304 Not Modified, before the view
+    runs, when the browser has the current version of the page.
+    version_func(request, *args, **kwargs) returns the version stamp (a
+    datetime) of the posts shown by the page, or None to always render it.
+    The ETag also depends on the user, their unread notifications, the
+    moderator panel and the CSRF cookie, which are on every page; the pages
+    with messages to show are always rendered. Anonymous users also get a
+    Last-Modified. not_modified(request, *args, **kwargs) is called instead
+    of the view for the 304 responses.
+    """
+    def version(request, *args, **kwargs):
+        return page_version(request, version_func, *args, **kwargs)
+
+    def etag(request, *args, **kwargs):
+        stamp = version(request, *args, **kwargs)
+        if stamp is None:
+            return None
+        user = request.user
+        parts = [code_stamp().isoformat(), stamp.isoformat(),
+                 request.get_full_path(), str(user.id)]
+        if user.is_authenticated:
+            parts += [str(notification_count(user.id)),
+                      str(request.session.get('MODERATOR_ACTIVATED', False))]
+        parts.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        stamp = version(request, *args, **kwargs)
+        if stamp is None or request.user.is_authenticated:
+            return None
+        return max(stamp, code_stamp())
+
+    def decorator(view_func):
+        conditional_view = condition(etag, last_modified)(view_func)
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code == 304 and not_modified is not None:
+                not_modified(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                # Revalidated every time, and kept by the browser only for
+                # the logged in users
+                if request.user.is_authenticated:
+                    patch_cache_control(response, no_cache=True, private=True)
+                else:
+                    patch_cache_control(response, no_cache=True)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def anonymous_page_cache(version_func, cached=None):
+    """
+    Cache the pages rendered for the anonymous users, under the
+    version stamp given by version_func (see conditional_page), so that a
+    change of the posts makes a new entry and no page has to be deleted. The
+    view must take the CSRF token from page_csrf(): it is replaced with a
+    token of every request. cached(request, *args, **kwargs) is called
+    instead of the view for the pages served from the cache.
+    """
+    def decorator(view_func):
+        name = view_func.__name__
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.user.is_authenticated or request.session.get(
+                    'MODERATOR_ACTIVATED', False):
+                return view_func(request, *args, **kwargs)
+            stamp = page_version(request, version_func, *args, **kwargs)
+            if stamp is None:
+                return view_func(request, *args, **kwargs)
+
+            key = 'page_{0}'.format(hashlib.sha1('\n'.join([
+                code_stamp().isoformat(), stamp.isoformat(),
+                request.get_full_path()]).encode('utf-8')).hexdigest())
+            page = cache.get(key)
+            if page is not None:
+                page_cache_requests.inc(view=name, result='hit')
+                if cached is not None:
+                    cached(request, *args, **kwargs)
+                content, content_type = page
+                return HttpResponse(content.replace(
+                    CSRF_TOKEN_PLACEHOLDER.encode('ascii'),
+                    get_token(request).encode('ascii')),
+                    content_type=content_type)
+
+            page_cache_requests.inc(view=name, result='miss')
+            request._page_cached = True
+            try:
+                response = view_func(request, *args, **kwargs)
+            finally:
+                request._page_cached = False
+            if response.status_code != 200 or response.streaming:
+                return response
+            cache.set(key, (response.content, response['Content-Type']),
+                      settings.PAGE_CACHE_TIMEOUT)
+            response.content = response.content.replace(
+                CSRF_TOKEN_PLACEHOLDER.encode('ascii'),
+                get_token(request).encode('ascii'))
+            return response
+        return _wrapped_view
+    return decorator
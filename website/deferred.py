@@ -0,0 +1,67 @@
+import logging
+import threading
+from functools import partial
+
+from django.core.signals import request_finished, request_started
+from django.db import connections, transaction
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Functions waiting for the response of the current request to be sent.
+# Every thread serves one request at a time, so the queue is thread-local.
+_local = threading.local()
+
+
+@receiver(request_started)
+def start_deferred_queue(sender, **kwargs):
+    _local.queue = []
+
+
+@receiver(request_finished)
+def run_deferred_queue(sender, **kwargs):
+    queue = getattr(_local, 'queue', None)
+    _local.queue = None
+    if not queue:
+        return
+    for func in queue:
+        try:
+            func()
+        except Exception:
+            logger.exception('Deferred call %r failed', func)
+    close_old_connections()
+
+
+def close_old_connections():
+    """
+    Close the database connections reopened by the deferred calls after
+    Django closed them at the end of the request (as its own
+    close_old_connections does, honouring CONN_MAX_AGE), so that they do not
+    linger until the next request of the thread. The connections inside a
+    transaction, as in the tests, are left open.
+    """
+    for conn in connections.all():
+        if not conn.in_atomic_block:
+            conn.close_if_unusable_or_obsolete()
+
+
+def run_after_response(func):
+    """
+    Call func once the response of the current request has been sent, or
+    right away when there is no request being served.
+    """
+    queue = getattr(_local, 'queue', None)
+    if queue is None:
+        func()
+    else:
+        queue.append(func)
+
+
+def on_commit(func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) after the current transaction is committed and
+    the response has been sent. Nothing is called if the transaction is
+    rolled back.
+    """
+    transaction.on_commit(
+        lambda: run_after_response(partial(func, *args, **kwargs)))
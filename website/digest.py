@@ -0,0 +1,157 @@
+import logging
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from . import metrics
+from .models import DigestEvent, Profile
+
+logger = logging.getLogger(__name__)
+
+# Emails of the current batch_emails() block, per thread
+_local = threading.local()
+
+emails_sent = metrics.counter(
+    'forum_emails_sent_total', 'Emails accepted by the email backend.')
+email_failures = metrics.counter(
+    'forum_email_failures_total', 'Emails which could not be sent.')
+email_send_duration = metrics.histogram(
+    'forum_email_send_duration_seconds',
+    'Time taken to send a batch of emails over one connection.')
+
+
+@contextmanager
+def batch_emails():
+    """
+    Collect the emails passed to deliver() inside the block, and send them
+    all at its end over a single connection.
+    """
+    outer = getattr(_local, 'batch', None)
+    if outer is not None:
+        yield
+        return
+    _local.batch = []
+    try:
+        yield
+    finally:
+        messages, _local.batch = _local.batch, None
+        deliver(messages)
+
+
+def deliver(messages, connection=None):
+    """
+    Send the emails over a single connection (a new one unless given). The
+    emails which cannot be sent are logged and counted, never raised to the
+    caller. Return the number of emails sent, or queued inside a
+    batch_emails() block.
+    """
+    if not messages:
+        return 0
+    batch = getattr(_local, 'batch', None)
+    if batch is not None and connection is None:
+        batch.extend(messages)
+        return len(messages)
+    with email_send_duration.time():
+        try:
+            connection = connection or mail.get_connection()
+            sent = connection.send_messages(messages) or 0
+        except Exception:
+            logger.exception('%d emails could not be sent', len(messages))
+            sent = 0
+    emails_sent.inc(sent)
+    email_failures.inc(len(messages) - sent)
+    return sent
+
+
+def queue_digest(subject, html_message, uids):
+    """
+    Record the email as a DigestEvent for every user in uids who opted into
+    an email digest.
+    Return the ids of the users who should still be mailed immediately.
+    """
+    uids = set(uids)
+    digest_uids = set(Profile.objects.filter(user_id__in=uids).exclude(
+        email_digest='immediate').values_list('user_id', flat=True))
+    DigestEvent.objects.bulk_create([
+        DigestEvent(uid=uid, subject=subject, html_message=html_message)
+        for uid in digest_uids
+    ])
+    return uids - digest_uids
+
+
+def send_digests(frequency):
+    """
+    Send one email to every user with the given digest frequency containing
+    all the emails recorded for them since the last digest.
+    Return the number of digest emails sent.
+    """
+    uids = Profile.objects.filter(
+        email_digest=frequency).values('user_id')
+    return send_events(DigestEvent.objects.filter(uid__in=uids))
+
+
+def flush_digest(uid):
+    """
+    Send the pending digest of a user at once, e.g. when they switch back to
+    immediate emails. Return the number of digest emails sent.
+    """
+    return send_events(DigestEvent.objects.filter(uid=uid))
+
+
+def send_events(events):
+    """
+    Send the digest of the DigestEvents of every user, and delete the events
+    of the digests accepted by the email backend. The others are kept for the
+    next digest. Return the number of digest emails sent.
+    """
+    events = list(events.order_by('uid', 'date_created'))
+    if not events:
+        return 0
+
+    users = User.objects.in_bulk({event.uid for event in events})
+    digests = []
+    for uid, user_events in groupby(events, key=lambda event: event.uid):
+        user_events = list(user_events)
+        subject = "FOSSEE Forums - {0} new notifications".format(
+            len(user_events))
+        html_message = render_to_string(
+            'website/templates/emails/digest_email.html', {
+                'events': user_events,
+            })
+        plain_message = strip_tags(html_message)
+        email = EmailMultiAlternatives(
+            subject,
+            plain_message,
+            settings.SENDER_EMAIL,
+            [users[uid].email],
+            headers={"Content-type": "text/html;charset=iso-8859-1"},
+        )
+        email.attach_alternative(html_message, "text/html")
+        digests.append((user_events, email))
+
+    # All the digests are sent over a single connection, one at a time to
+    # know which ones were accepted.
+    connection = mail.get_connection()
+    try:
+        connection.open()
+    except Exception:
+        logger.exception('%d digests could not be sent', len(digests))
+        email_failures.inc(len(digests))
+        return 0
+    sent = []
+    try:
+        for user_events, email in digests:
+            if deliver([email], connection):
+                sent.append(user_events)
+    finally:
+        connection.close()
+    DigestEvent.objects.filter(id__in=[
+        event.id for user_events in sent for event in user_events]).delete()
+    return len(sent)
@@ -0,0 +1,86 @@
+"""
+Template loader stripping the whitespace of the HTML templates when they are
+loaded, instead of minifying every response (which htmlmin did by parsing the
+whole page). With the cached loader around it (when DEBUG is off), a template
+is stripped once per process.
+
+The indentation, the trailing spaces and the blank lines are removed, and so
+are the HTML comments outside of scripts and styles and the line breaks after
+the tags which render nothing ({% if %}, {% for %}, {% block %}...). Any other
+line break is kept: it is whitespace to the browsers like the spaces it
+replaces, and it ends the // comments and the statements of the scripts. The
+content of <pre> and <textarea> is left as it is, and so are the templates of
+TEMPLATE_MINIFY_EXCLUDE (e.g. plain text emails).
+"""
+import re
+
+from django.conf import settings
+from django.template.loaders.base import Loader as BaseLoader
+
+# Blocks kept as they are, and blocks whose HTML comments are kept
+PRESERVED_RE = re.compile(r'(<(pre|textarea)\b.*?</\2\s*>)',
+                          re.DOTALL | re.IGNORECASE)
+CODE_RE = re.compile(r'(<(script|style)\b.*?</\2\s*>)',
+                     re.DOTALL | re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'[ \t\r\f\v]*\n[ \t\r\n\f\v]*')
+COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+# Line breaks after the tags, alone on their line, which render nothing
+TAG_LINE_RE = re.compile(
+    r'^((?:\{%\s*(?:if|elif|else|endif|for|empty|endfor|with|endwith|block|'
+    r'endblock|extends|load|comment|endcomment)\b(?:(?!%\})[^\n])*%\})+)\n',
+    re.MULTILINE)
+
+
+def strip_comments(source):
+    # A comment holding template tags may hold half of a block
+    return COMMENT_RE.sub(
+        lambda match: match.group(0) if '{%' in match.group(0) else '',
+        source)
+
+
+def strip_whitespace(source):
+    """Return the source of an HTML template without its whitespace."""
+    parts = []
+    for i, part in enumerate(PRESERVED_RE.split(source)):
+        # split() returns [text, block, tag name, text, block, tag name, ...]
+        if i % 3 == 1:
+            parts.append(part)
+        elif i % 3 == 0:
+            for j, code in enumerate(CODE_RE.split(part)):
+                if j % 3 == 2:
+                    continue
+                if j % 3 == 0:
+                    code = strip_comments(code)
+                parts.append(TAG_LINE_RE.sub(r'\1', WHITESPACE_RE.sub(
+                    '\n', code)))
+    return ''.join(parts)
+
+
+class Loader(BaseLoader):
+    """
+    Load the templates with the loaders given as argument, and strip their
+    whitespace (see strip_whitespace()).
+    """
+
+    def __init__(self, engine, loaders):
+        super().__init__(engine)
+        self.loaders = engine.get_template_loaders(loaders)
+
+    def get_template_sources(self, template_name):
+        for loader in self.loaders:
+            for origin in loader.get_template_sources(template_name):
+                origin.source_loader = origin.loader
+                origin.loader = self
+                yield origin
+
+    def get_contents(self, origin):
+        contents = origin.source_loader.get_contents(origin)
+        if any(re.search(pattern, origin.template_name)
+               for pattern in settings.TEMPLATE_MINIFY_EXCLUDE):
+            return contents
+        return strip_whitespace(contents)
+
+    def reset(self):
+        for loader in self.loaders:
+            if hasattr(loader, 'reset'):
+                loader.reset()
@@ -0,0 +1,329 @@
+"""
+Load test of the main flows of the forum, run by ``python manage.py
+load_test``.
+
+Every virtual user is a thread with its own HTTP session, running the flows
+of FLOWS one after the other, picked at random according to their weights.
+The requests are timed per endpoint (named after its URL pattern) and the
+results can be saved as a baseline, which later runs are compared with.
+"""
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.urls import reverse
+
+import requests
+
+from .models import Answer, FossCategory, Question
+
+# Words searched by the keyword search flow
+KEYWORDS = ('install', 'error', 'plot', 'python', 'matrix', 'how', 'file')
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class Recorder(object):
+    """Latencies and errors of the requests, per endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.stopped = None
+
+    def add(self, endpoint, latency, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def stop(self):
+        self.stopped = time.perf_counter()
+
+    def report(self):
+        """
+        Return the results of the run: endpoint -> {requests, errors,
+        throughput (requests per second), p50, p90, p99 and max (in ms)}.
+        """
+        duration = (self.stopped or time.perf_counter()) - self.started
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            report[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'throughput': len(latencies) / duration,
+                'p50': percentile(latencies, 0.5) * 1000,
+                'p90': percentile(latencies, 0.9) * 1000,
+                'p99': percentile(latencies, 0.99) * 1000,
+                'max': max(latencies) * 1000,
+            }
+        return report
+
+
+class Client(object):
+    """HTTP session of a virtual user, timing its requests."""
+
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.session = requests.Session()
+
+    def request(self, endpoint, method, path, data=None, expect=None):
+        """
+        Send a request, recorded as failed if its status is not expect (or
+        is an error when expect is None).
+        """
+        headers = {}
+        if method == 'post':
+            headers['X-CSRFToken'] = self.session.cookies.get('csrftoken', '')
+            headers['Referer'] = self.base_url + path
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.base_url + path, data=data, headers=headers,
+                allow_redirects=False, timeout=60)
+        except requests.RequestException:
+            self.recorder.add(endpoint, time.perf_counter() - start, False)
+            return None
+        # Pages of logged in users redirect to the login page when the
+        # session is lost
+        if expect is None:
+            ok = (response.status_code < 400 and not response.headers.get(
+                'Location', '').startswith(settings.LOGIN_URL))
+        else:
+            ok = response.status_code == expect
+        self.recorder.add(endpoint, time.perf_counter() - start, ok)
+        return response
+
+    def get(self, endpoint, path):
+        return self.request(endpoint, 'get', path)
+
+    def post(self, endpoint, path, data, expect=None):
+        return self.request(endpoint, 'post', path, data, expect)
+
+    def login(self, username, password):
+        """Log in, once. Return True if the user is logged in."""
+        if 'sessionid' in self.session.cookies:
+            return True
+        self.get('login_form', reverse('user_login'))
+        self.post('login', reverse('user_login'), {
+            'username': username, 'password': password}, expect=302)
+        return 'sessionid' in self.session.cookies
+
+
+class ForumData(object):
+    """Existing posts, categories and users the flows pick from."""
+
+    def __init__(self, users, moderator, password, limit=1000):
+        self.questions = list(Question.objects.filter(
+            is_active=True, is_spam=False, category__hidden=False,
+            category__disabled=False).order_by('-id').values_list(
+            'id', flat=True)[:limit])
+        self.answers = list(Answer.objects.filter(
+            is_active=True, is_spam=False).order_by('-id').values_list(
+            'id', flat=True)[:limit])
+        self.categories = list(FossCategory.objects.filter(
+            hidden=False).values_list('name', flat=True))
+        self.users = list(User.objects.filter(
+            is_active=True, is_superuser=False).exclude(
+            username=moderator).order_by('id').values_list(
+            'username', flat=True)[:users])
+        self.moderator = moderator
+        self.password = password
+        if not (self.questions and self.answers and self.categories and
+                self.users):
+            raise ValueError('The forum needs users, categories, questions '
+                             'and answers, see generate_forum.')
+
+
+def prepare_moderator(username, password):
+    """Create (or reset) the super moderator account of the moderator flow."""
+    user, _ = User.objects.get_or_create(username=username, defaults={
+        'first_name': 'Load', 'last_name': 'Test',
+        'email': '{0}@example.com'.format(username)})
+    user.set_password(password)
+    user.save()
+    user.groups.add(Group.objects.get_or_create(name='forum_moderator')[0])
+
+
+# FLOWS
+
+def browse(client, data, rng, username):
+    """Anonymous browsing of the home, questions, filter and thread pages."""
+    client.get('home', reverse('website:home'))
+    client.get('questions', reverse('website:questions'))
+    client.get('filter', reverse('website:filter', args=[
+        rng.choice(data.categories)]))
+    client.get('get_question', reverse('website:get_question', args=[
+        rng.choice(data.questions)]))
+
+
+def search(client, data, rng, username):
+    """Keyword search, as typed in the search page."""
+    client.get('search', reverse('website:search'))
+    client.post('ajax_keyword_search', reverse('website:ajax_keyword_search'),
+                {'key': rng.choice(KEYWORDS)})
+
+
+def answer(client, data, rng, username):
+    """A logged in user reads a thread and answers it."""
+    if not client.login(username, data.password):
+        return
+    question_id = rng.choice(data.questions)
+    client.get('get_question', reverse('website:get_question',
+                                       args=[question_id]))
+    client.post('question_answer', reverse('website:question_answer',
+                                           args=[question_id]), {
+        'question': question_id,
+        'body': 'Load test answer {0}: try reinstalling the package and '
+                'running the script again.'.format(rng.randrange(10 ** 9)),
+        'g-recaptcha-response': 'load-test',
+    }, expect=302)
+
+
+def vote(client, data, rng, username):
+    """A logged in user votes on (or recalls a vote on) a question and an
+    answer."""
+    if not client.login(username, data.password):
+        return
+    client.post('ajax_vote_post', reverse('website:ajax_vote_post'), {
+        'id': rng.choice(data.questions), 'type': rng.choice(['up', 'down']),
+        'action': rng.choice(['vote', 'recall-vote'])})
+    client.post('ajax_ans_vote_post', reverse('website:ajax_ans_vote_post'), {
+        'id': rng.choice(data.answers), 'type': rng.choice(['up', 'down']),
+        'action': rng.choice(['vote', 'recall-vote'])})
+
+
+def moderate(client, data, rng, username):
+    """The super moderator goes through the pages of the moderator panel."""
+    if not client.login(data.moderator, data.password):
+        return
+    client.get('moderator_activate', reverse('website:moderator_activate'))
+    client.get('moderator_home', reverse('website:moderator_home'))
+    client.get('moderator_questions', reverse('website:moderator_questions'))
+    client.get('moderator_unanswered',
+               reverse('website:moderator_unanswered'))
+    client.get('moderator_review', reverse('website:moderator_review'))
+
+
+# Flows of the virtual users: name -> (weight, function(client, data, rng,
+# username)).
+FLOWS = {
+    'browse': (10, browse),
+    'search': (3, search),
+    'answer': (2, answer),
+    'vote': (3, vote),
+    'moderate': (1, moderate),
+}
+
+
+def run(base_url, data, flows, concurrency, duration=None, iterations=None,
+        seed=42):
+    """
+    Run the flows with concurrency virtual users, for duration seconds or
+    until every virtual user ran iterations flows, and return the Recorder.
+    """
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration if duration else None
+    names = sorted(flows)
+    weights = [FLOWS[name][0] for name in names]
+
+    def virtual_user(index):
+        rng = random.Random(seed + index)
+        # A session (and user) per flow, so that the flows do not share
+        # their login
+        clients = {}
+        username = data.users[index % len(data.users)]
+        done = 0
+        while ((deadline is None or time.perf_counter() < deadline) and
+               (iterations is None or done < iterations)):
+            name = rng.choices(names, weights)[0]
+            if name not in clients:
+                clients[name] = Client(base_url, recorder)
+            FLOWS[name][1](clients[name], data, rng, username)
+            done += 1
+
+    threads = [threading.Thread(target=virtual_user, args=(index,))
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.stop()
+    return recorder
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve(host='127.0.0.1', port=0):
+    """Serve the forum in a thread of this process, yielding its URL."""
+    server = ThreadedWSGIServer((host, port), QuietRequestHandler)
+    server.set_app(get_internal_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://{0}:{1}'.format(*server.server_address[:2])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# BASELINES
+
+# Measures compared with the baseline, and whether higher values are better
+COMPARED = (('throughput', True), ('p50', False), ('p99', False))
+
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return {endpoint: {measure: relative change}} of the endpoints of both
+    runs, and the descriptions of the regressions: measures worse than the
+    baseline by more than tolerance, and new errors.
+    """
+    changes = {}
+    regressions = []
+    for endpoint, results in report.items():
+        if endpoint not in baseline:
+            continue
+        before = baseline[endpoint]
+        changes[endpoint] = {}
+        for measure, higher_is_better in COMPARED:
+            if not before[measure]:
+                continue
+            change = (results[measure] - before[measure]) / before[measure]
+            changes[endpoint][measure] = change
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append('{0} {1}: {2:.1f} -> {3:.1f} ({4:+.0%})'
+                                   .format(endpoint, measure, before[measure],
+                                           results[measure], change))
+        if results['errors'] > before['errors']:
+            regressions.append('{0} errors: {1} -> {2}'.format(
+                endpoint, before['errors'], results['errors']))
+    return changes, regressions
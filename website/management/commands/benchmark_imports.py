@@ -0,0 +1,45 @@
+import subprocess
+import sys
+from statistics import median
+
+from django.core.management.base import BaseCommand
+
+# Modules which should not be loaded by importing the views: they are slow to
+# import and only needed by the spam filter and the spreadsheet export.
+HEAVY_MODULES = ['sklearn', 'numpy', 'scipy', 'openpyxl', 'nltk']
+
+# Run in a fresh interpreter, so that nothing is imported yet.
+SCRIPT = '''
+import sys, time
+import django
+django.setup()
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure the time taken by a cold import of a module.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='website.views')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        script = SCRIPT.format(module=options['module'], heavy=HEAVY_MODULES)
+        timings = []
+        for _ in range(options['runs']):
+            output = subprocess.check_output(
+                [sys.executable, '-c', script], universal_newlines=True)
+            lines = output.splitlines()
+            timings.append(float(lines[-2]))
+            loaded = lines[-1].split()
+
+        self.stdout.write('import {0}: median {1:.3f}s, min {2:.3f}s'.format(
+            options['module'], median(timings), min(timings)))
+        if loaded:
+            self.stdout.write('Heavy modules loaded: ' + ', '.join(loaded))
+        else:
+            self.stdout.write('No heavy modules loaded.')
@@ -0,0 +1,123 @@
+import copy
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from website.models import FossCategory
+
+FILE_LOADERS = ['django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader']
+
+# How the HTML is minified: the template loaders (kept compiled by the
+# cached loader, as in production) and whether the responses are minified
+# with htmlmin, as the forum did before website.loaders.
+MINIFY_MODES = {
+    'templates': ([('website.loaders.Loader', FILE_LOADERS)], False),
+    'htmlmin': (FILE_LOADERS, True),
+    'none': (FILE_LOADERS, False),
+}
+
+
+def template_settings(loaders):
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', loaders)]
+    return templates
+
+
+class Command(BaseCommand):
+    help = ('Measure the pages of the forum rendered in this process: the '
+            'size of the responses, their queries and the wall clock and CPU '
+            'time taken, with an empty cache ("cold", every row and page '
+            'rendered) and a filled one ("warm"), and with the templates '
+            'stripped of their whitespace (website.loaders), the responses '
+            'minified by htmlmin or neither. Run it on a development '
+            'database filled with generate_forum.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Paths of the pages (default: the home page, all the '
+                 'questions and the category with the most questions).')
+        parser.add_argument('--requests', type=int, default=10,
+                            help='Requests per page and cache state.')
+        parser.add_argument('--minify', nargs='+', default=['templates'],
+                            choices=sorted(MINIFY_MODES),
+                            help='Ways of minifying the HTML to compare.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        rows = []
+        for mode in options['minify']:
+            loaders, htmlmin = MINIFY_MODES[mode]
+            minify = self.htmlmin() if htmlmin else None
+            with override_settings(ALLOWED_HOSTS=['testserver'],
+                                   TEMPLATES=template_settings(loaders)):
+                client = Client()
+                for path in paths:
+                    for state in ('cold', 'warm'):
+                        rows.append([path, mode, state] + self.measure(
+                            client, path, state == 'cold',
+                            options['requests'], minify))
+        self.write_table(['page', 'minify', 'cache', 'bytes', 'queries',
+                          'wall (ms)', 'cpu (ms)'], rows)
+
+    def htmlmin(self):
+        try:
+            from htmlmin.minify import html_minify
+        except ImportError:
+            raise CommandError('Comparing with htmlmin needs django-htmlmin.')
+        return html_minify
+
+    def default_paths(self):
+        category = FossCategory.objects.filter(hidden=False).annotate(
+            questions=Count('question')).order_by('-questions').first()
+        if category is None:
+            raise CommandError('The forum has no categories, see '
+                               'generate_forum.')
+        return [reverse('website:home'), reverse('website:questions'),
+                reverse('website:filter', args=[category.name])]
+
+    def measure(self, client, path, cold, requests, minify=None):
+        """
+        Return the bytes, queries and median wall and CPU ms of a page,
+        minified by the minify function if any.
+        """
+        if not cold:
+            client.get(path)
+        walls = []
+        cpus = []
+        for _ in range(requests):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                response = client.get(path)
+                content = response.content
+                if minify is not None:
+                    content = minify(content, ignore_comments=True,
+                                     parser='html5lib').encode('utf-8')
+                cpus.append(time.process_time() - cpu)
+                walls.append(time.perf_counter() - wall)
+            if response.status_code != 200:
+                raise CommandError('{0} answered {1}'.format(
+                    path, response.status_code))
+        return [len(content), len(queries),
+                '{0:.1f}'.format(statistics.median(walls) * 1000),
+                '{0:.1f}'.format(statistics.median(cpus) * 1000)]
+
+    def write_table(self, columns, rows):
+        widths = [max(len(str(value)) for value in values)
+                  for values in zip(columns, *rows)]
+        for row in [columns] + rows:
+            self.stdout.write('  '.join(
+                str(value).ljust(width) for value, width in zip(row, widths)))
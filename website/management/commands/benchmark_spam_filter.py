@@ -0,0 +1,157 @@
+import pickle
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from website import spamFilter
+
+
+def fit_pipeline(vectorizer, model, xTrain, yTrain):
+    import numpy as np
+
+    model.fit(vectorizer.fit_transform(xTrain), np.asarray(yTrain))
+    return vectorizer, model
+
+
+def tfidf(**kwargs):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(stop_words='english', max_df=75, **kwargs)
+
+
+def hashing():
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(stop_words='english', alternate_sign=False)
+
+
+def linear_svc():
+    from sklearn.svm import LinearSVC
+    return LinearSVC(class_weight='balanced')
+
+
+def sgd():
+    from sklearn.linear_model import SGDClassifier
+    return SGDClassifier(class_weight='balanced', random_state=42)
+
+
+# Candidate configurations: name -> function(xTrain, yTrain) returning a
+# fitted (vectorizer, model) pair. 'current' is the one used by the forum.
+CONFIGS = {
+    'current': spamFilter.fit,
+    'tfidf-bigram-svc': lambda x, y: fit_pipeline(
+        tfidf(ngram_range=(1, 2)), linear_svc(), x, y),
+    'tfidf-sgd': lambda x, y: fit_pipeline(tfidf(), sgd(), x, y),
+    'hashing-svc': lambda x, y: fit_pipeline(hashing(), linear_svc(), x, y),
+    'hashing-sgd': lambda x, y: fit_pipeline(hashing(), sgd(), x, y),
+}
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+class Command(BaseCommand):
+    help = ('Compare spam filter configurations with k-fold cross-validation '
+            'on the labelled data, and measure their cost.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'configs', nargs='*',
+            help='Configurations to compare among {0} (default: all).'.format(
+                ', '.join(CONFIGS)))
+        parser.add_argument('--folds', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument(
+            '--latency-samples', type=int, default=200,
+            help='Number of texts scored one by one to measure the latency.')
+
+    def handle(self, *args, **options):
+        from sklearn.model_selection import StratifiedKFold
+
+        names = options['configs'] or list(CONFIGS)
+        unknown = set(names) - set(CONFIGS)
+        if unknown:
+            raise CommandError('Unknown configurations: {0}'.format(
+                ', '.join(sorted(unknown))))
+        xData, yData = spamFilter.store()
+        if len(xData) < options['folds']:
+            raise CommandError('Not enough labelled data.')
+        self.stdout.write('{0} samples, {1} spam, {2}-fold cross-validation'
+                          .format(len(xData), sum(yData), options['folds']))
+        self.stdout.write('Scores are those of calc_f_score() for the ham '
+                          'class (as reported by the trainings) and the spam '
+                          'class, averaged over the folds. Latencies exclude '
+                          'clean_string().\n')
+
+        folds = list(StratifiedKFold(
+            n_splits=options['folds'], shuffle=True, random_state=42).split(
+            xData, yData))
+        rows = []
+        for name in names:
+            rows.append(self.evaluate(name, CONFIGS[name], xData, yData,
+                                      folds, options))
+
+        columns = ['config', 'ham F1', 'ham precision', 'ham recall',
+                   'spam F1', 'spam precision', 'spam recall', 'fit (s)',
+                   'vocabulary', 'size (KB)', 'single p50 (ms)',
+                   'single p99 (ms)', 'batch p50 (ms)', 'batch p99 (ms)']
+        widths = [max(len(str(value)) for value in values)
+                  for values in zip(columns, *rows)]
+        self.stdout.write('  '.join(
+            column.ljust(width) for column, width in zip(columns, widths)))
+        for row in rows:
+            self.stdout.write('  '.join(
+                str(value).ljust(width) for value, width in zip(row, widths)))
+
+    def evaluate(self, name, fit, xData, yData, folds, options):
+        scores = []
+        fit_times = []
+        for train_index, test_index in folds:
+            start = time.perf_counter()
+            vectorizer, model = fit([xData[i] for i in train_index],
+                                    [yData[i] for i in train_index])
+            fit_times.append(time.perf_counter() - start)
+            xTest = [xData[i] for i in test_index]
+            yTest = [yData[i] for i in test_index]
+            scores.append(
+                spamFilter.calc_f_score(xTest, yTest, model, vectorizer)[:3] +
+                spamFilter.calc_f_score(xTest, yTest, model, vectorizer,
+                                        pos_label=1)[:3])
+
+        # Cost of the model trained on all the data, as used in production
+        vectorizer, model = fit(xData, yData)
+        vocabulary = (len(vectorizer.vocabulary_)
+                      if hasattr(vectorizer, 'vocabulary_')
+                      else vectorizer.n_features)
+        size = len(pickle.dumps((vectorizer, model), pickle.HIGHEST_PROTOCOL))
+
+        texts = (xData * (options['latency_samples'] // len(xData) + 1))[
+            :options['latency_samples']]
+        single = self.latencies(vectorizer, model, [[text] for text in texts])
+        batch_size = options['batch_size']
+        batched = self.latencies(vectorizer, model, [
+            texts[i:i + batch_size] for i in range(0, len(texts), batch_size)])
+
+        return [name] + [
+            '{0:.3f}'.format(mean([score[i] for score in scores]))
+            for i in range(6)] + [
+            '{0:.3f}'.format(mean(fit_times)),
+            vocabulary,
+            size // 1024,
+            '{0:.3f}'.format(percentile(single, 0.5) * 1000),
+            '{0:.3f}'.format(percentile(single, 0.99) * 1000),
+            '{0:.3f}'.format(percentile(batched, 0.5) * 1000),
+            '{0:.3f}'.format(percentile(batched, 0.99) * 1000),
+        ]
+
+    def latencies(self, vectorizer, model, batches):
+        latencies = []
+        for batch in batches:
+            start = time.perf_counter()
+            model.predict(vectorizer.transform(batch))
+            latencies.append(time.perf_counter() - start)
+        return latencies
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from website.models import Answer, AnswerComment, Question, fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Compute the content fingerprint of the posts which have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Compute the fingerprint of every post again, e.g. after '
+                 'changing SPAM_FINGERPRINT_MIN_LENGTH.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Question, Answer, AnswerComment):
+            posts = model.objects.only('id', 'body')
+            if not options['all']:
+                posts = posts.filter(fingerprint='')
+            batch = []
+            count = 0
+            for post in posts.iterator(chunk_size=batch_size):
+                post.fingerprint = fingerprint(post.body)
+                batch.append(post)
+                if len(batch) == batch_size:
+                    model.objects.bulk_update(batch, ['fingerprint'])
+                    count += len(batch)
+                    batch = []
+            model.objects.bulk_update(batch, ['fingerprint'])
+            count += len(batch)
+            self.stdout.write('{0}: {1} posts fingerprinted.'.format(
+                model.__name__, count))
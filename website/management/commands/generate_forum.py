@@ -0,0 +1,338 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from website.models import (Answer, AnswerComment, FossCategory, Notification,
+                            Profile, Question, SubFossCategory, fingerprint)
+
+# Preset sizes, giving about 10k, 100k and 1M rows with the default averages
+# (around 19 rows for each question with its answers, comments, votes,
+# views and notifications).
+SIZES = {
+    '10k': {'users': 200, 'categories': 10, 'questions': 500},
+    '100k': {'users': 2000, 'categories': 30, 'questions': 5000},
+    '1m': {'users': 20000, 'categories': 100, 'questions': 50000},
+}
+
+WORDS = (
+    'install', 'compile', 'error', 'version', 'package', 'file', 'script',
+    'module', 'function', 'variable', 'loop', 'array', 'matrix', 'plot',
+    'graph', 'window', 'terminal', 'command', 'library', 'path', 'output',
+    'input', 'value', 'simulation', 'circuit', 'model', 'tutorial', 'video',
+    'lesson', 'example', 'exercise', 'assignment', 'code', 'syntax', 'server',
+    'database', 'query', 'table', 'image', 'layer', 'mesh', 'solver',
+    'equation', 'toolbox', 'linux', 'windows', 'ubuntu', 'python', 'scilab',
+    'latex', 'document', 'figure', 'label', 'option', 'setting', 'update',
+    'download', 'upload', 'login', 'account', 'page', 'link', 'step', 'time',
+)
+SPAM_WORDS = (
+    'buy', 'cheap', 'discount', 'offer', 'free', 'casino', 'loan', 'pills',
+    'winner', 'prize', 'click', 'best', 'price', 'deal', 'cash', 'bonus',
+)
+QUESTION_STARTS = (
+    'How do I', 'Why does', 'Unable to', 'Error when I', 'What is the',
+    'Problem with', 'How to', 'Cannot',
+)
+
+
+def sentence(rng, words, length):
+    return ' '.join(rng.choice(words) for _ in range(length)).capitalize()
+
+
+def post_body(rng, spam, sentences):
+    if spam:
+        return '<p>{0}. Visit http://{1}.example.com/{2}</p>'.format(
+            sentence(rng, SPAM_WORDS, rng.randint(8, 20)),
+            rng.choice(SPAM_WORDS), rng.randrange(10 ** 6))
+    return ''.join('<p>{0}.</p>'.format(
+        sentence(rng, WORDS, rng.randint(6, 18))) for _ in range(sentences))
+
+
+def question_title(rng, spam):
+    if spam:
+        return sentence(rng, SPAM_WORDS, rng.randint(3, 8))
+    return '{0} {1}?'.format(rng.choice(QUESTION_STARTS),
+                             ' '.join(rng.choice(WORDS)
+                                      for _ in range(rng.randint(2, 7))))
+
+
+def count(rng, average):
+    """Random count with the given average."""
+    return rng.randint(0, 2 * average)
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+@contextmanager
+def generated_dates(*models):
+    """
+    Save the dates set on the instances of the models, instead of the
+    current time put by the auto_now and auto_now_add fields.
+    """
+    fields = [field for model in models for field in model._meta.fields
+              if getattr(field, 'auto_now', False) or
+              getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a generated forum (users, categories, '
+            'questions, answers, comments, votes, views and notifications) '
+            'for benchmarks. The same seed on the same database always '
+            'generates the same forum.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', choices=sorted(SIZES), default='10k',
+            help='Preset numbers of users, categories and questions, which '
+                 'the options below override.')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--categories', type=int)
+        parser.add_argument('--questions', type=int)
+        parser.add_argument('--sub-categories', type=int, default=5,
+                            help='Sub-categories of each category.')
+        parser.add_argument('--answers', type=int, default=2,
+                            help='Average number of answers of a question.')
+        parser.add_argument('--comments', type=int, default=1,
+                            help='Average number of comments of an answer.')
+        parser.add_argument('--votes', type=int, default=2,
+                            help='Average number of votes of a post.')
+        parser.add_argument('--views', type=int, default=3,
+                            help='Average number of users who viewed a '
+                                 'question.')
+        parser.add_argument('--spam-ratio', type=float, default=0.05,
+                            help='Share of the posts which are spam.')
+        parser.add_argument('--days', type=int, default=730,
+                            help='Number of days the posts are spread over.')
+        parser.add_argument('--password', default='password',
+                            help='Password of all the generated users.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for name, value in SIZES[options['size']].items():
+            if options[name] is None:
+                options[name] = value
+        if options['users'] < 1 or options['categories'] < 1:
+            raise CommandError('At least one user and one category are needed.')
+        if not 0 <= options['spam_ratio'] <= 1:
+            raise CommandError('The spam ratio must be between 0 and 1.')
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.start = datetime(2019, 1, 1, tzinfo=timezone.utc)
+        self.rows = {}
+        started = time.perf_counter()
+
+        with generated_dates(User, Profile, FossCategory, SubFossCategory,
+                             Question, Answer, AnswerComment, Notification):
+            self.create_users()
+            self.create_categories()
+            for first in range(0, options['questions'], options['batch_size']):
+                with transaction.atomic():
+                    self.create_questions(min(
+                        options['batch_size'], options['questions'] - first))
+                self.stdout.write('{0}/{1} questions'.format(
+                    min(first + options['batch_size'], options['questions']),
+                    options['questions']))
+
+        # The ids were given explicitly, the sequences have to follow
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [
+                    User, Profile, FossCategory, SubFossCategory, Question,
+                    Answer, AnswerComment, Notification]):
+                cursor.execute(sql)
+
+        elapsed = time.perf_counter() - started
+        total = sum(self.rows.values())
+        for name, rows in sorted(self.rows.items()):
+            self.stdout.write('{0}: {1}'.format(name, rows))
+        self.stdout.write('{0} rows in {1:.1f}s ({2:.0f} rows/s)'.format(
+            total, elapsed, total / elapsed if elapsed else 0))
+
+    def insert(self, model, objs):
+        # Django 3.0 does not cap the batch size to the limits of the
+        # database (999 parameters for SQLite) by itself
+        batch_size = min(self.options['batch_size'], max(
+            connection.ops.bulk_batch_size(model._meta.concrete_fields, objs),
+            1))
+        model.objects.bulk_create(objs, batch_size=batch_size)
+        name = model._meta.label
+        self.rows[name] = self.rows.get(name, 0) + len(objs)
+
+    def date(self, after=None, days=None):
+        after = after or self.start
+        days = days or self.options['days']
+        return after + timedelta(seconds=self.rng.randrange(days * 86400))
+
+    def create_users(self):
+        rng = self.rng
+        password = make_password(self.options['password'])
+        first_id = next_id(User)
+        self.user_ids = range(first_id, first_id + self.options['users'])
+        for first in range(0, len(self.user_ids), self.options['batch_size']):
+            users = []
+            profiles = []
+            for user_id in self.user_ids[first:first +
+                                         self.options['batch_size']]:
+                joined = self.date()
+                users.append(User(
+                    id=user_id, username='user{0}'.format(user_id),
+                    first_name=rng.choice(WORDS).capitalize(),
+                    last_name=rng.choice(WORDS).capitalize(),
+                    email='user{0}@example.com'.format(user_id),
+                    password=password, date_joined=joined))
+                profiles.append(Profile(
+                    user_id=user_id, created=joined,
+                    confirmation_code='{0:08x}'.format(
+                        rng.getrandbits(32))))
+            with transaction.atomic():
+                self.insert(User, users)
+                self.insert(Profile, profiles)
+
+    def create_categories(self):
+        first_id = next_id(FossCategory)
+        self.categories = []
+        categories = []
+        sub_categories = []
+        for category_id in range(first_id,
+                                 first_id + self.options['categories']):
+            name = 'Category {0}'.format(category_id)
+            tutorials = ['{0} tutorial {1}'.format(name, n + 1)
+                         for n in range(self.options['sub_categories'])]
+            categories.append(FossCategory(
+                id=category_id, name=name,
+                description=post_body(self.rng, False, 1),
+                email='category{0}@example.com'.format(category_id),
+                date_created=self.start, date_modified=self.start))
+            sub_categories.extend(SubFossCategory(
+                parent_id=category_id, name=tutorial,
+                date_created=self.start, date_modified=self.start)
+                for tutorial in tutorials)
+            self.categories.append((category_id, tutorials))
+        with transaction.atomic():
+            self.insert(FossCategory, categories)
+            self.insert(SubFossCategory, sub_categories)
+
+    def spam(self):
+        return self.rng.random() < self.options['spam_ratio']
+
+    def voters(self, average):
+        """Return (up voters, down voters) of a post."""
+        voters = self.rng.sample(self.user_ids, min(
+            count(self.rng, average), len(self.user_ids)))
+        up = [user_id for user_id in voters if self.rng.random() < 0.8]
+        return up, [user_id for user_id in voters if user_id not in up]
+
+    def create_questions(self, number):
+        rng = self.rng
+        options = self.options
+        question_id = next_id(Question)
+        answer_id = next_id(Answer)
+        comment_id = next_id(AnswerComment)
+        questions, answers, comments, notifications = [], [], [], []
+        votes = {Question.userUpVotes.through: [],
+                 Question.userDownVotes.through: [],
+                 Question.userViews.through: [],
+                 Answer.userUpVotes.through: [],
+                 Answer.userDownVotes.through: []}
+
+        for _ in range(number):
+            category_id, tutorials = rng.choice(self.categories)
+            spam = self.spam()
+            body = post_body(rng, spam, rng.randint(1, 4))
+            up, down = self.voters(options['votes'])
+            viewers = rng.sample(self.user_ids, min(
+                count(rng, options['views']), len(self.user_ids)))
+            question = Question(
+                id=question_id, user_id=rng.choice(self.user_ids),
+                category_id=category_id,
+                sub_category=rng.choice(tutorials) if tutorials else '',
+                title=question_title(rng, spam), body=body,
+                views=1 + len(viewers) + rng.randrange(50),
+                num_votes=len(up) - len(down), is_spam=spam,
+                fingerprint=fingerprint(body))
+            question.date_created = question.date_modified = self.date()
+            questions.append(question)
+            votes[Question.userUpVotes.through].extend(
+                Question.userUpVotes.through(question_id=question_id,
+                                             user_id=user_id)
+                for user_id in up)
+            votes[Question.userDownVotes.through].extend(
+                Question.userDownVotes.through(question_id=question_id,
+                                               user_id=user_id)
+                for user_id in down)
+            votes[Question.userViews.through].extend(
+                Question.userViews.through(question_id=question_id,
+                                           user_id=user_id)
+                for user_id in viewers)
+
+            for _ in range(count(rng, options['answers'])):
+                spam = self.spam()
+                body = post_body(rng, spam, rng.randint(1, 3))
+                up, down = self.voters(options['votes'])
+                answer = Answer(
+                    id=answer_id, uid=rng.choice(self.user_ids),
+                    question_id=question_id, body=body,
+                    num_votes=len(up) - len(down), is_spam=spam,
+                    fingerprint=fingerprint(body))
+                answer.date_created = answer.date_modified = self.date(
+                    question.date_created, 30)
+                answers.append(answer)
+                votes[Answer.userUpVotes.through].extend(
+                    Answer.userUpVotes.through(answer_id=answer_id,
+                                               user_id=user_id)
+                    for user_id in up)
+                votes[Answer.userDownVotes.through].extend(
+                    Answer.userDownVotes.through(answer_id=answer_id,
+                                                 user_id=user_id)
+                    for user_id in down)
+                if answer.uid != question.user_id:
+                    notifications.append(Notification(
+                        uid=question.user_id, qid=question_id, aid=answer_id,
+                        date_created=answer.date_created))
+
+                for _ in range(count(rng, options['comments'])):
+                    spam = self.spam()
+                    body = post_body(rng, spam, 1)
+                    comment = AnswerComment(
+                        id=comment_id, uid=rng.choice(self.user_ids),
+                        answer_id=answer_id, body=body, is_spam=spam,
+                        fingerprint=fingerprint(body))
+                    comment.date_created = comment.date_modified = self.date(
+                        answer.date_created, 30)
+                    comments.append(comment)
+                    if comment.uid != answer.uid:
+                        notifications.append(Notification(
+                            uid=answer.uid, qid=question_id, aid=answer_id,
+                            cid=comment_id,
+                            date_created=comment.date_created))
+                    comment_id += 1
+                answer_id += 1
+            question_id += 1
+
+        self.insert(Question, questions)
+        self.insert(Answer, answers)
+        self.insert(AnswerComment, comments)
+        self.insert(Notification, notifications)
+        for through, rows in votes.items():
+            self.insert(through, rows)
@@ -0,0 +1,133 @@
+from django.conf import settings
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from website import loadtest
+
+
+def server_settings():
+    """
+    Settings of the forum served by the command itself: the emails are kept
+    in memory, the reCAPTCHA is not sent to Google and the virtual users are
+    not rate limited.
+    """
+    return {
+        'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+        'RECAPTCHA_BACKEND': 'website.recaptcha.LocalBackend',
+        'RATE_LIMITS': {action: (10 ** 9, period) for action, (_, period)
+                        in settings.RATE_LIMITS.items()},
+        'ALLOWED_HOSTS': ['127.0.0.1', 'localhost'],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Load test the main flows of the forum (browsing, keyword '
+            'search, answering, voting and moderation) and report the '
+            'throughput and latency percentiles of every endpoint. Run it '
+            'on a development database, filled with generate_forum: it '
+            'posts answers and votes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'flows', nargs='*',
+            help='Flows to run among {0} (default: all).'.format(
+                ', '.join(sorted(loadtest.FLOWS))))
+        parser.add_argument(
+            '--url',
+            help='URL of a running forum (e.g. gunicorn) sharing the '
+                 'database. By default the forum is served by the command, '
+                 'with the emails captured in memory and the reCAPTCHA '
+                 'stubbed.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of virtual users.')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Seconds the test runs for.')
+        parser.add_argument('--iterations', type=int,
+                            help='Run this number of flows per virtual user '
+                                 'instead of a fixed duration.')
+        parser.add_argument('--users', type=int, default=50,
+                            help='Number of existing accounts logged in with.')
+        parser.add_argument('--password', default='password',
+                            help='Password of these accounts (that of the '
+                                 'users made by generate_forum by default).')
+        parser.add_argument('--moderator', default='loadtest-moderator',
+                            help='Super moderator account, created if needed.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--save', metavar='PATH',
+                            help='Save the results as a baseline.')
+        parser.add_argument('--baseline', metavar='PATH',
+                            help='Compare with a baseline and fail on '
+                                 'regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Relative change allowed from the baseline.')
+
+    def handle(self, *args, **options):
+        flows = options['flows'] or sorted(loadtest.FLOWS)
+        unknown = set(flows) - set(loadtest.FLOWS)
+        if unknown:
+            raise CommandError('Unknown flows: {0}'.format(
+                ', '.join(sorted(unknown))))
+        if 'moderate' in flows:
+            loadtest.prepare_moderator(options['moderator'],
+                                       options['password'])
+        try:
+            data = loadtest.ForumData(options['users'], options['moderator'],
+                                      options['password'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        duration = None if options['iterations'] else options['duration']
+        if options['url']:
+            recorder = loadtest.run(
+                options['url'], data, flows, options['concurrency'], duration,
+                options['iterations'], options['seed'])
+            emails = None
+        else:
+            with override_settings(**server_settings()), loadtest.serve() as url:
+                mail.outbox = []
+                recorder = loadtest.run(
+                    url, data, flows, options['concurrency'], duration,
+                    options['iterations'], options['seed'])
+                emails = len(mail.outbox)
+
+        report = recorder.report()
+        changes = {}
+        regressions = []
+        if options['baseline']:
+            changes, regressions = loadtest.compare(
+                report, loadtest.load(options['baseline']),
+                options['tolerance'])
+        self.write_report(report, changes)
+        if emails is not None:
+            self.stdout.write('{0} emails captured'.format(emails))
+        if options['save']:
+            loadtest.save(report, options['save'])
+            self.stdout.write('Results saved to {0}'.format(options['save']))
+        if regressions:
+            raise CommandError('Regressions from the baseline:\n' +
+                               '\n'.join(regressions))
+
+    def write_report(self, report, changes):
+        columns = ['endpoint', 'requests', 'errors', 'req/s', 'p50 (ms)',
+                   'p90 (ms)', 'p99 (ms)', 'max (ms)']
+        if changes:
+            columns += ['req/s vs base', 'p50 vs base', 'p99 vs base']
+        rows = []
+        for endpoint, results in report.items():
+            row = [endpoint, results['requests'], results['errors']] + [
+                '{0:.1f}'.format(results[measure])
+                for measure in ('throughput', 'p50', 'p90', 'p99', 'max')]
+            if changes:
+                row += ['{0:+.0%}'.format(changes[endpoint][measure])
+                        if measure in changes.get(endpoint, {}) else '-'
+                        for measure in ('throughput', 'p50', 'p99')]
+            rows.append(row)
+
+        widths = [max(len(str(value)) for value in values)
+                  for values in zip(columns, *rows)]
+        self.stdout.write('  '.join(
+            column.ljust(width) for column, width in zip(columns, widths)))
+        for row in rows:
+            self.stdout.write('  '.join(
+                str(value).ljust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from website.recaptcha import StandInServer
+
+
+class Command(BaseCommand):
+    help = ('Run a local stand-in for the reCAPTCHA siteverify API. Point '
+            'RECAPTCHA_VERIFY_URL at the URL it prints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument(
+            '--delay', type=float, default=0,
+            help='Seconds to wait before each answer, to try out a slow '
+                 'upstream.')
+
+    def handle(self, *args, **options):
+        server = StandInServer((options['host'], options['port']),
+                               delay=options['delay'])
+        self.stdout.write('reCAPTCHA stand-in listening on {0}'.format(
+            server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
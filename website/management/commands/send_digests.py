@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from website.digest import send_digests
+
+
+class Command(BaseCommand):
+    help = 'Send the pending notification emails of users as a digest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('frequency', choices=['hourly', 'daily'])
+
+    def handle(self, *args, **options):
+        count = send_digests(options['frequency'])
+        self.stdout.write('{0} digest emails sent.'.format(count))
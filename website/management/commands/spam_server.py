@@ -0,0 +1,42 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from website import spamFilter, spamServer
+
+
+class Command(BaseCommand):
+    help = 'Run the spam scoring server shared by the workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket', default=settings.SPAM_SERVER_SOCKET,
+            help='Path of the Unix socket (default: SPAM_SERVER_SOCKET).')
+        parser.add_argument(
+            '--stats', action='store_true',
+            help='Print the statistics of the running server and exit.')
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError('Set SPAM_SERVER_SOCKET or pass --socket.')
+
+        if options['stats']:
+            try:
+                stats = spamServer.request({'command': 'stats'}, path=path)
+            except spamServer.SPAM_SERVER_ERRORS as e:
+                raise CommandError('Spam server unavailable: {0}'.format(e))
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+            return
+
+        spamFilter.train_local()
+        server = spamServer.SpamServer(path)
+        self.stdout.write('Spam server listening on {0}'.format(path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
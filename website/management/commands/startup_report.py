@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter, so that the startup is measured from scratch.
+SCRIPT = '''
+import json, resource, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+from website.warmup import warm_up
+report = [('django setup', setup, None)] + warm_up()
+print(json.dumps({
+    'steps': report,
+    'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report the time taken by each step of the startup of a worker.'
+
+    def handle(self, *args, **options):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT], universal_newlines=True)
+        report = json.loads(output.splitlines()[-1])
+
+        total = 0
+        for name, seconds, result in report['steps']:
+            total += seconds
+            line = '{0:<15} {1:8.3f}s'.format(name, seconds)
+            if result is not None:
+                line += '  ({0})'.format(result)
+            self.stdout.write(line)
+        self.stdout.write('{0:<15} {1:8.3f}s'.format('total', total))
+        self.stdout.write('Peak memory: {0:.1f} MB'.format(
+            report['maxrss'] / 1024))
@@ -0,0 +1,323 @@
+"""
+Counters and histograms of the internals of the forum, exported at /metrics
+in the text format of Prometheus.
+
+Every process keeps its metrics in memory and writes them to a file of its
+own in METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds (and when it
+exits). /metrics adds up the files, so that whichever worker serves it, it
+shows the metrics of all the processes, dead ones included: their counters
+must not go back when a worker is replaced. The files of the dead processes
+are merged into a single ARCHIVE_FILENAME when /metrics is read, so that the
+directory does not grow with every worker ever started. METRICS_DIR should
+be emptied when the server is (re)started.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# File of the metrics of the dead processes, and lock of the directory
+ARCHIVE_FILENAME = 'archive.json'
+LOCK_FILENAME = '.lock'
+
+# Upper bounds of the buckets of the histograms of durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                    30, 60, 300)
+
+
+class Metric(object):
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{0} has the labels {1}, not {2}'.format(
+                self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def snapshot(self):
+        with self.lock:
+            samples = [[list(key), value] for key, value in self.values.items()]
+        return {'kind': self.kind, 'help': self.documentation,
+                'labelnames': list(self.labelnames), 'samples': samples}
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values. The value of every label set is
+    [count of the values in each bucket (the last one above all the bounds),
+    sum of the values].
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DURATION_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time taken by the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        snapshot = Metric.snapshot(self)
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+class Registry(object):
+    """The metrics of a process, and their files in directory."""
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.new_process()
+
+    @property
+    def directory(self):
+        return self._directory or settings.METRICS_DIR
+
+    def new_process(self):
+        """Start from zero, in a new file (called in forked processes)."""
+        self.filename = '{0}-{1}.json'.format(os.getpid(), time.time_ns())
+        self.flushed = 0
+        for metric in list(self.metrics.values()):
+            metric.reset()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError('{0} is already registered'.format(
+                    metric.name))
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), **kwargs):
+        return self.register(Histogram(name, documentation, labelnames,
+                                       **kwargs))
+
+    def snapshot(self):
+        return {name: metric.snapshot()
+                for name, metric in list(self.metrics.items())}
+
+    def flush(self, force=False):
+        """
+        Write the metrics of this process to its file, unless they were
+        written less than METRICS_FLUSH_INTERVAL seconds ago.
+        """
+        directory = self.directory
+        now = time.monotonic()
+        if not directory or (
+                not force and
+                now - self.flushed < settings.METRICS_FLUSH_INTERVAL):
+            return
+        self.flushed = now
+        path = os.path.join(directory, self.filename)
+        # Replaced atomically, the readers never see a partial file
+        temporary = '{0}.{1}.tmp'.format(path, threading.get_ident())
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(temporary, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temporary, path)
+        except OSError:
+            logger.warning('Metrics could not be written to %s', path,
+                           exc_info=True)
+
+    def collect(self):
+        """Return the snapshot of the metrics of all the processes."""
+        directory = self.directory
+        if not directory:
+            return merge([self.snapshot()])
+        self.flush(force=True)
+        try:
+            with open(os.path.join(directory, LOCK_FILENAME), 'a') as lock:
+                # Not read while the files of dead processes are archived
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self.archive_dead_processes(directory)
+                snapshots = [snapshot for filename, snapshot in
+                             read_snapshots(directory)]
+        except OSError:
+            return merge([self.snapshot()])
+        return merge(snapshots)
+
+    def archive_dead_processes(self, directory):
+        """
+        Merge the files of the dead processes into ARCHIVE_FILENAME, and
+        delete them. Called with the lock of the directory held.
+        """
+        snapshots = read_snapshots(directory)
+        dead = [filename for filename, _ in snapshots
+                if filename != ARCHIVE_FILENAME and
+                not process_alive(filename)]
+        if not dead:
+            return
+        archive = os.path.join(directory, ARCHIVE_FILENAME)
+        temporary = '{0}.{1}.tmp'.format(archive, threading.get_ident())
+        with open(temporary, 'w') as f:
+            json.dump(merge([snapshot for filename, snapshot in snapshots
+                             if filename == ARCHIVE_FILENAME or
+                             filename in dead]), f)
+        os.replace(temporary, archive)
+        for filename in dead:
+            os.unlink(os.path.join(directory, filename))
+
+
+def read_snapshots(directory):
+    """Return the [(filename, snapshot)] of the files of the directory."""
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append((filename, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def process_alive(filename):
+    """Return False if the process which wrote the file has exited."""
+    try:
+        os.kill(int(filename.split('-')[0]), 0)
+    except ValueError:
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. run by another user
+        return True
+    return True
+
+
+def merge(snapshots):
+    """Add up the snapshots of several processes."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            total = merged.setdefault(name, dict(metric, samples={}))
+            if metric.get('buckets') != total.get('buckets'):
+                # Buckets changed by a new version of the code
+                continue
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if key not in total['samples']:
+                    total['samples'][key] = value
+                elif isinstance(value, list):
+                    total['samples'][key] = [
+                        a + b for a, b in zip(total['samples'][key], value)]
+                else:
+                    total['samples'][key] += value
+    for metric in merged.values():
+        metric['samples'] = sorted(metric['samples'].items())
+    return merged
+
+
+def escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, escape(value))
+                          for name, value in pairs) + '}'
+
+
+def format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshot):
+    """Return the metrics in the text format of Prometheus."""
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append('# HELP {0} {1}'.format(
+            name, metric['help'].replace('\\', r'\\').replace('\n', r'\n')))
+        lines.append('# TYPE {0} {1}'.format(name, metric['kind']))
+        names = metric['labelnames']
+        for labels, value in metric['samples']:
+            if metric['kind'] != 'histogram':
+                lines.append('{0}{1} {2}'.format(
+                    name, format_labels(names, labels), format_number(value)))
+                continue
+            cumulative = 0
+            bounds = list(metric['buckets']) + [float('inf')]
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, format_labels(names, labels,
+                                        [('le', format_number(bound))]),
+                    cumulative))
+            lines.append('{0}_sum{1} {2}'.format(
+                name, format_labels(names, labels), format_number(value[-1])))
+            lines.append('{0}_count{1} {2}'.format(
+                name, format_labels(names, labels), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+
+# A forked worker (e.g. of gunicorn --preload) starts from zero in its own
+# file instead of sharing the metrics of its parent
+os.register_at_fork(after_in_child=registry.new_process)
+atexit.register(lambda: registry.flush(force=True))
@@ -0,0 +1,146 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponseBadRequest
+
+from . import metrics, profiler
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+
+
+def query_shape(sql):
+    """Return the SQL with its lists of parameters collapsed."""
+    return IN_LIST_RE.sub('(%s, ...)', sql)
+
+
+class QueryStats(object):
+    """
+    Number, time and shapes of the queries run while serving a request,
+    recorded as an execute wrapper of the database connections.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated(self):
+        """
+        Return (shape, count) of the queries run more than
+        SQL_REPEATED_QUERY_BUDGET times, most repeated first: the per-row
+        queries of a loop (N+1).
+        """
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count > settings.SQL_REPEATED_QUERY_BUDGET]
+
+    def over_budget(self):
+        """Return the descriptions of the budgets exceeded by the request."""
+        problems = []
+        if self.count > settings.SQL_QUERY_BUDGET:
+            problems.append('{0} queries'.format(self.count))
+        if self.time > settings.SQL_TIME_BUDGET:
+            problems.append('{0:.1f}ms in the database'.format(
+                self.time * 1000))
+        for shape, count in self.repeated():
+            problems.append('{0} times {1}'.format(count, shape))
+        return problems
+
+    def summary(self):
+        repeated = self.repeated()
+        return 'queries={0}; time={1:.1f}ms; repeated={2}'.format(
+            self.count, self.time * 1000,
+            max([count for _, count in repeated], default=0))
+
+
+@contextmanager
+def record_queries(stats):
+    """Record the queries run on all the connections in stats."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        yield stats
+
+
+def query_stats_middleware(get_response):
+    """
+    Record the queries of every request and log a warning when a request
+    goes over the budgets of the settings (SQL_QUERY_BUDGET, SQL_TIME_BUDGET
+    and SQL_REPEATED_QUERY_BUDGET). With SQL_STATS_HEADER on, the summary is
+    sent in the X-SQL-Stats header of the response.
+    """
+    def middleware(request):
+        with record_queries(QueryStats()) as stats:
+            response = get_response(request)
+
+        problems = stats.over_budget()
+        if problems:
+            logger.warning('%s %s over the SQL budget: %s',
+                           request.method, request.path, '; '.join(problems))
+        if settings.SQL_STATS_HEADER:
+            response['X-SQL-Stats'] = stats.summary()
+        return response
+    return middleware
+
+
+request_duration = metrics.histogram(
+    'forum_http_request_duration_seconds',
+    'Time taken to serve the requests, per view.',
+    ['view', 'method', 'status'])
+
+
+def metrics_middleware(get_response):
+    """
+    Time every request for the forum_http_request_duration_seconds metric,
+    and write the metrics of the process for /metrics from time to time.
+    """
+    def middleware(request):
+        start = time.perf_counter()
+        response = get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        request_duration.observe(
+            time.perf_counter() - start,
+            view=match.view_name if match else 'unresolved',
+            method=request.method, status=response.status_code)
+        metrics.registry.flush()
+        return response
+    return middleware
+
+
+def profiler_middleware(get_response):
+    """
+    Return a profile of the request instead of the page when a superuser
+    adds the PROFILER_PARAMETER query parameter (see website.profiler). It
+    comes after AuthenticationMiddleware, and profiles the middleware after
+    it and the view.
+    """
+    def middleware(request):
+        mode = request.GET.get(settings.PROFILER_PARAMETER)
+        if mode is None or not request.user.is_superuser:
+            return get_response(request)
+        mode = mode or 'text'
+        if mode not in profiler.MODES:
+            return HttpResponseBadRequest(
+                'Unknown profile {0}, use one of {1}.'.format(
+                    mode, ', '.join(profiler.MODES)))
+
+        profile = profiler.RequestProfile(mode)
+        with record_queries(QueryStats()) as queries:
+            response = profile.run(get_response, request)
+        return profile.response(request, response, queries)
+    return middleware
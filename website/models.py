@@ -1,12 +1,41 @@
 from builtins import object
+import hashlib
+import html
+import re
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User, Group
 from django.contrib.auth import get_user_model
 from django_resized import ResizedImageField
 from ckeditor.fields import RichTextField
-from django.db.models.signals import post_delete
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+# Cache key of the ids of the superusers, see permissions.get_admin_ids()
+ADMIN_IDS_CACHE_KEY = 'admin_ids'
+
+TAG_RE = re.compile(r'<[^>]*>')
+
+
+def fingerprint(text):
+    """
+    Return a hash of the text of a post, ignoring the HTML tags, the case and
+    the whitespace, so that reposts of the same text get the same hash.
+    Return '' for texts shorter than SPAM_FINGERPRINT_MIN_LENGTH (e.g.
+    "thanks", or a post made of images), shared by too many unrelated posts.
+    """
+    normalized = ' '.join(html.unescape(TAG_RE.sub(' ', text)).lower().split())
+    if len(normalized) < settings.SPAM_FINGERPRINT_MIN_LENGTH:
+        return ''
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def fingerprint_key(fingerprint):
+    """Cache key telling whether posts with the fingerprint are spam."""
+    return 'spam_fingerprint_{0}'.format(fingerprint)
 
 
 class FossCategory(models.Model):
@@ -18,6 +47,8 @@ class FossCategory(models.Model):
     email = models.CharField(max_length=50)
     disabled = models.BooleanField(default=False)
     hidden = models.BooleanField(default=False)
+    # Version stamp of the listings of the category, see touch_posts()
+    last_activity = models.DateTimeField(default=timezone.now)
     image = ResizedImageField(
         size=[
             800,
@@ -72,6 +103,9 @@ class Question(models.Model):
     is_spam = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     notif_flag = models.IntegerField(default=0)
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True)
+    # Version stamp of the thread, see touch_posts()
+    last_activity = models.DateTimeField(default=timezone.now)
     image = ResizedImageField(
         size=[
             800,
@@ -104,6 +138,7 @@ class Answer(models.Model):
     is_spam = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     notif_flag = models.IntegerField(default=0)
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True)
     image = ResizedImageField(
         size=[
             800,
@@ -112,8 +147,12 @@ class Answer(models.Model):
         blank=True)
 
     def user(self):
-        user = User.objects.get(id=self.uid)
-        return user
+        # Loaded once, or by load_users() for all the posts of a page
+        try:
+            return self._user
+        except AttributeError:
+            self._user = User.objects.get(id=self.uid)
+            return self._user
 
     def __str__(self):
         return '{0} - {1} - {2}'.format(self.question.category.name,
@@ -127,6 +166,15 @@ def submission_delete(sender, instance, **kwargs):
     instance.image.delete(False)
 
 
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Saving only the last login time (done on every login) cannot change
+    # the superusers.
+    if update_fields != frozenset(['last_login']):
+        cache.delete(ADMIN_IDS_CACHE_KEY)
+
+
 class AnswerComment(models.Model):
 
     uid = models.IntegerField()
@@ -137,10 +185,106 @@ class AnswerComment(models.Model):
     is_spam = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     notif_flag = models.IntegerField(default=0)
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True)
 
     def user(self):
-        user = User.objects.get(id=self.uid)
-        return user
+        # Loaded once, or by load_users() for all the posts of a page
+        try:
+            return self._user
+        except AttributeError:
+            self._user = User.objects.get(id=self.uid)
+            return self._user
+
+
+def load_users(posts):
+    """
+    Load the authors of Answers and AnswerComments in one query, for their
+    user() method.
+    """
+    users = User.objects.in_bulk({post.uid for post in posts})
+    for post in posts:
+        if post.uid in users:
+            post._user = users[post.uid]
+
+
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=Answer)
+@receiver(pre_save, sender=AnswerComment)
+def set_fingerprint(sender, instance, **kwargs):
+    instance.fingerprint = fingerprint(instance.body)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Answer)
+@receiver(post_save, sender=AnswerComment)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Answer)
+@receiver(post_delete, sender=AnswerComment)
+def fingerprint_changed(sender, instance, **kwargs):
+    # The post may have been marked or unmarked as spam
+    if instance.fingerprint:
+        cache.delete(fingerprint_key(instance.fingerprint))
+
+
+def touch_posts(question_ids=(), answer_ids=(), comment_ids=()):
+    """
+    Bump the version stamps (last_activity) of the threads of the posts and
+    of their categories, so that the pages showing them are not answered
+    with 304 Not Modified. Called by the signals below, and after the
+    update()s of posts, which do not send them.
+    """
+    threads = Q(pk__in=[])
+    listings = Q(pk__in=[])
+    for lookup, ids in (('id', question_ids), ('answer__id', answer_ids),
+                        ('answer__answercomment__id', comment_ids)):
+        if ids:
+            threads |= Q(**{lookup + '__in': list(ids)})
+            listings |= Q(**{'question__' + lookup + '__in': list(ids)})
+    now = timezone.now()
+    Question.objects.filter(threads).update(last_activity=now)
+    FossCategory.objects.filter(listings).update(last_activity=now)
+
+
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=FossCategory)
+def set_last_activity(sender, instance, **kwargs):
+    instance.last_activity = timezone.now()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    # Bumped once the question is written, so that a page rendered before
+    # cannot be taken for the new version. A question moved to another
+    # category is saved in its old category first (see edit_question).
+    FossCategory.objects.filter(id=instance.category_id).update(
+        last_activity=timezone.now())
+
+
+@receiver(post_delete, sender=FossCategory)
+def category_deleted(sender, instance, **kwargs):
+    # The pages listing all the categories take the latest stamp of the
+    # remaining ones
+    FossCategory.objects.update(last_activity=timezone.now())
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def answer_changed(sender, instance, **kwargs):
+    touch_posts(question_ids=[instance.question_id])
+
+
+@receiver(post_save, sender=AnswerComment)
+@receiver(post_delete, sender=AnswerComment)
+def comment_changed(sender, instance, **kwargs):
+    touch_posts(answer_ids=[instance.answer_id])
+
+
+@receiver(post_save, sender=SubFossCategory)
+@receiver(post_delete, sender=SubFossCategory)
+def sub_category_changed(sender, instance, **kwargs):
+    FossCategory.objects.filter(id=instance.parent_id).update(
+        last_activity=timezone.now())
 
 
 class Notification(models.Model):
@@ -153,12 +297,54 @@ class Notification(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
 
 
+class DigestEvent(models.Model):
+
+    uid = models.IntegerField(db_index=True)   # User id
+    subject = models.CharField(max_length=255)
+    html_message = models.TextField()
+    date_created = models.DateTimeField(auto_now_add=True)
+
+
+SPAM_FILTER_TRAINING_STATUSES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+
+class SpamFilterTraining(models.Model):
+
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    status = models.CharField(
+        max_length=10, choices=SPAM_FILTER_TRAINING_STATUSES, default='pending')
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True)
+    date_finished = models.DateTimeField(null=True)
+    samples = models.IntegerField(null=True)    # Size of the training data
+    # Scores of the model on 20% of the data kept for testing
+    f_score = models.FloatField(null=True)
+    precision = models.FloatField(null=True)
+    recall = models.FloatField(null=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return 'Spam filter training {0} ({1})'.format(self.id, self.status)
+
+
 class Scheduled_Auto_Mail(models.Model):
     mail_sent_date = models.CharField(max_length=255)
     is_sent = models.BooleanField(default=True)
     is_active = models.BooleanField(default=True)
 
 
+EMAIL_DIGEST_CHOICES = (
+    ('immediate', 'Send every email immediately'),
+    ('hourly', 'Hourly digest'),
+    ('daily', 'Daily digest'),
+)
+
+
 class Profile(models.Model):
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -166,6 +352,9 @@ class Profile(models.Model):
     phone = models.CharField(max_length=20, null=True)
     address = models.TextField(null=True)
     created = models.DateTimeField(auto_now_add=True)
+    # How the user receives emails about activity in threads
+    email_digest = models.CharField(
+        max_length=10, choices=EMAIL_DIGEST_CHOICES, default='immediate')
 
     class Meta(object):
         app_label = 'website'
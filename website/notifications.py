@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Notification
+
+
+# Cached per-user counter of unread Notifications shown in the navbar.
+# The counter is rebuilt from the database whenever it is missing from the
+# cache, so keeping it up to date is best-effort: a lost update is corrected
+# once the key expires or is reset.
+
+def notification_count_key(uid):
+    return 'notification_count_{0}'.format(uid)
+
+
+def notification_count(uid):
+    """Return the number of Notifications of the user, using the cache."""
+    key = notification_count_key(uid)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(uid=uid).count()
+        cache.set(key, count, settings.NOTIFICATION_COUNT_TIMEOUT)
+    return count
+
+
+def incr_notification_count(uid, delta=1):
+    """
+    Add delta to the cached counter of the user. Nothing is done if the
+    counter is not cached, it will be rebuilt on the next read.
+    """
+    try:
+        cache.incr(notification_count_key(uid), delta)
+    except ValueError:
+        pass
+
+
+def decr_notification_count(uid, delta=1):
+    """Subtract delta from the cached counter of the user."""
+    incr_notification_count(uid, -delta)
+
+
+def reset_notification_count(*uids):
+    """Drop the cached counters of the users so that they are rebuilt."""
+    cache.delete_many([notification_count_key(uid) for uid in uids])
@@ -0,0 +1,67 @@
+from builtins import object
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from .models import ADMIN_IDS_CACHE_KEY
+
+
+class ForumPermissions(object):
+    """
+    Moderation rights of a user, resolved with at most one query.
+
+    Use get_permissions() to get the instance attached to a user. Since the
+    user object is loaded afresh for every request, the permissions are
+    computed once per request and shared by views, decorators and templates.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def groups(self):
+        """Return (group name, moderated category id) pairs of the user."""
+        if not self.user.is_authenticated:
+            return []
+        return list(self.user.groups.values_list(
+            'name', 'moderatorgroup__category_id'))
+
+    @cached_property
+    def is_moderator(self):
+        """Return True if the user is a moderator of any category."""
+        return len(self.groups) > 0
+
+    @cached_property
+    def is_super_moderator(self):
+        """Return True if the user moderates all the categories."""
+        return any(name == "forum_moderator" for name, _ in self.groups)
+
+    @cached_property
+    def category_ids(self):
+        """Return the ids of the categories moderated by the user."""
+        return [category_id for _, category_id in self.groups
+                if category_id is not None]
+
+    def moderates(self, category_id):
+        """Return True if the user is a moderator of the category."""
+        return self.is_super_moderator or category_id in self.category_ids
+
+
+def get_permissions(user):
+    """Return the ForumPermissions of the user, computing them only once."""
+    try:
+        return user._forum_permissions
+    except AttributeError:
+        user._forum_permissions = ForumPermissions(user)
+        return user._forum_permissions
+
+
+def get_admin_ids():
+    """Return the ids of the superusers, using the cache."""
+    admin_ids = cache.get(ADMIN_IDS_CACHE_KEY)
+    if admin_ids is None:
+        admin_ids = frozenset(get_user_model().objects.filter(
+            is_superuser=True).values_list('id', flat=True))
+        cache.set(ADMIN_IDS_CACHE_KEY, admin_ids, None)
+    return admin_ids
@@ -0,0 +1,179 @@
+"""
+Profiles of single requests, asked by superusers by adding the
+PROFILER_PARAMETER query parameter to any URL (see
+middleware.profiler_middleware):
+
+- ``?profile`` (or ``?profile=text``): the time of the request split between
+  the database, the ORM, the templates and the spam filter, followed
+  by the functions taking the most time, measured with cProfile;
+- ``?profile=pstats``: the cProfile statistics, to open with pstats,
+  snakeviz or gprof2dot;
+- ``?profile=flamegraph``: the stacks of the request sampled every
+  PROFILER_SAMPLE_INTERVAL seconds, in the folded format read by
+  flamegraph.pl and speedscope.
+
+The profile is returned instead of the page. The times of the parts overlap
+(the templates include the queries they run).
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.http import HttpResponse
+
+MODES = ('text', 'pstats', 'flamegraph')
+
+
+def parts():
+    """Return the (name, code) of the functions whose time is reported."""
+    from django.db.models.sql.compiler import SQLCompiler
+    from django.template.base import Template
+
+    from . import spamFilter
+
+    return [
+        ('orm', SQLCompiler.execute_sql.__code__),
+        ('templates', Template.render.__code__),
+        ('spam filter', spamFilter.predict.__code__),
+    ]
+
+
+def code_name(code):
+    """Name of a function in the stacks: function (file:line)."""
+    filename = code.co_filename
+    for directory in sorted(sys.path, key=len, reverse=True):
+        if directory and filename.startswith(directory + os.sep):
+            filename = filename[len(directory) + 1:]
+            break
+    return '{0} ({1}:{2})'.format(code.co_name, filename,
+                                  code.co_firstlineno).replace(';', ',')
+
+
+class Sampler(object):
+    """Samples of the stack of a thread, taken from another thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def folded(self):
+        """Return the stacks in the folded format, one 'a;b;c count' a line."""
+        return ''.join('{0} {1}\n'.format(
+            ';'.join(code_name(code) for code in stack), count)
+            for stack, count in self.stacks.most_common())
+
+
+class RequestProfile(object):
+    """Profile of a request, measured with cProfile or a Sampler."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.elapsed = None
+        self.profile = None
+        self.sampler = None
+
+    def run(self, func, *args):
+        start = time.perf_counter()
+        if self.mode == 'flamegraph':
+            self.sampler = Sampler(threading.get_ident(),
+                                   settings.PROFILER_SAMPLE_INTERVAL)
+            self.sampler.start()
+            try:
+                return func(*args)
+            finally:
+                self.sampler.stop()
+                self.elapsed = time.perf_counter() - start
+        self.profile = cProfile.Profile()
+        try:
+            return self.profile.runcall(func, *args)
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+    def stats(self):
+        return pstats.Stats(self.profile)
+
+    def part_times(self):
+        """Return [(name, seconds)] of the parts()."""
+        if self.sampler is not None:
+            total = sum(self.sampler.stacks.values()) or 1
+            return [(name, self.elapsed * sum(
+                count for stack, count in self.sampler.stacks.items()
+                if code in stack) / total) for name, code in parts()]
+
+        stats = self.stats().stats
+        return [(name, stats.get(
+            (code.co_filename, code.co_firstlineno, code.co_name),
+            (0, 0, 0, 0))[3]) for name, code in parts()]
+
+    def breakdown(self, queries):
+        """Summary of the parts, for the X-Profile-Breakdown header."""
+        return '; '.join(
+            ['total={0:.1f}ms'.format(self.elapsed * 1000),
+             'sql={0:.1f}ms'.format(queries.time * 1000)] +
+            ['{0}={1:.1f}ms'.format(name.replace(' ', '-'), seconds * 1000)
+             for name, seconds in self.part_times()])
+
+    def report(self, request, response, queries):
+        """Return the text report of the profile."""
+        lines = [
+            '{0} {1} -> {2}'.format(request.method, request.get_full_path(),
+                                    response.status_code),
+            '',
+            '{0:<12} {1:>9.1f} ms'.format('total', self.elapsed * 1000),
+            '{0:<12} {1:>9.1f} ms  ({2} queries)'.format(
+                'sql', queries.time * 1000, queries.count),
+        ]
+        for name, seconds in self.part_times():
+            lines.append('{0:<12} {1:>9.1f} ms'.format(name, seconds * 1000))
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(settings.PROFILER_TOP)
+        return '\n'.join(lines) + '\n\n' + out.getvalue()
+
+    def response(self, request, response, queries):
+        """Return the HTTP response carrying the profile."""
+        if self.mode == 'pstats':
+            result = HttpResponse(marshal.dumps(self.stats().stats),
+                                  content_type='application/octet-stream')
+            result['Content-Disposition'] = (
+                'attachment; filename="profile.pstats"')
+        elif self.mode == 'flamegraph':
+            result = HttpResponse(self.sampler.folded(),
+                                  content_type='text/plain; charset=utf-8')
+            result['Content-Disposition'] = (
+                'attachment; filename="profile.folded"')
+        else:
+            result = HttpResponse(self.report(request, response, queries),
+                                  content_type='text/plain; charset=utf-8')
+        result['X-Profile-Breakdown'] = self.breakdown(queries)
+        return result
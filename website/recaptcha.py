@@ -0,0 +1,162 @@
+"""
+Verification of the reCAPTCHA responses posted with the forms.
+
+The responses are checked by the backend named by RECAPTCHA_BACKEND:
+SiteVerifyBackend posts them to RECAPTCHA_VERIFY_URL (the siteverify API of
+Google by default, or a StandInServer run with ``python manage.py
+recaptcha_server``), and LocalBackend answers without any network access.
+Any class with a verify(response, remote_ip) method returning a bool and
+raising VerificationError when it cannot tell can be used instead.
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Response rejected by LocalBackend and StandInServer, all others pass
+INVALID_RESPONSE = 'invalid'
+
+
+class VerificationError(Exception):
+    """The backend could not verify the response."""
+
+
+class SiteVerifyBackend(object):
+    """
+    Verify the responses with the siteverify API at RECAPTCHA_VERIFY_URL,
+    waiting at most RECAPTCHA_TIMEOUT seconds. Every thread keeps its own
+    requests.Session, so the connection is reused from one request to the
+    next instead of being opened again.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def verify(self, response, remote_ip=None):
+        data = {
+            'secret': settings.GOOGLE_RECAPTCHA_SECRET_KEY,
+            'response': response,
+        }
+        if remote_ip:
+            data['remoteip'] = remote_ip
+        try:
+            r = self.session.post(settings.RECAPTCHA_VERIFY_URL, data=data,
+                                  timeout=settings.RECAPTCHA_TIMEOUT)
+            r.raise_for_status()
+            return bool(r.json()['success'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise VerificationError(str(e)) from e
+
+
+class LocalBackend(object):
+    """
+    Accept every response except INVALID_RESPONSE, like the test keys of
+    Google do, without any network access. For tests and offline
+    environments only.
+    """
+
+    def verify(self, response, remote_ip=None):
+        return response != INVALID_RESPONSE
+
+
+_backend = (None, None)
+
+
+def get_backend():
+    """Return the instance of the RECAPTCHA_BACKEND class."""
+    global _backend
+    path, backend = _backend
+    if path != settings.RECAPTCHA_BACKEND:
+        path = settings.RECAPTCHA_BACKEND
+        backend = import_string(path)()
+        _backend = (path, backend)
+    return backend
+
+
+def verify(response, remote_ip=None):
+    """
+    Return True if the reCAPTCHA response is valid. Every response is asked
+    to the backend: the responses are valid once, and one accepted again
+    without asking could be replayed. When the backend cannot tell, the
+    response is accepted if RECAPTCHA_FAIL_OPEN is True and rejected
+    otherwise.
+    """
+    response = response or ''
+    start = time.perf_counter()
+    try:
+        valid = get_backend().verify(response, remote_ip)
+    except VerificationError:
+        logger.warning("reCAPTCHA verification failed after %.3fs",
+                       time.perf_counter() - start, exc_info=True)
+        return settings.RECAPTCHA_FAIL_OPEN
+    return valid
+
+
+def verify_request(request):
+    """Return True if the reCAPTCHA response posted with request is valid."""
+    return verify(request.POST.get('g-recaptcha-response'),
+                  request.META.get('REMOTE_ADDR'))
+
+
+# LOCAL STAND-IN SERVER
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = parse_qs(self.rfile.read(length).decode('utf-8'))
+        self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        response = data.get('response', [''])[0]
+        body = json.dumps({
+            'success': response != INVALID_RESPONSE,
+            'hostname': 'localhost',
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server answering like the siteverify API of Google, without
+    checking the secret key: every response except INVALID_RESPONSE passes.
+    Each answer is delayed by delay seconds, to try out a slow upstream.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, delay=0):
+        self.delay = delay
+        self.requests = 0
+        HTTPServer.__init__(self, address, StandInHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{0}:{1}/recaptcha/api/siteverify'.format(host, port)
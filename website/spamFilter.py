@@ -1,19 +1,41 @@
 from builtins import str
 from builtins import range
-import openpyxl
-import numpy as np
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+
 from django.conf import settings
-from .cleanText import clean_string
-from sklearn.svm import LinearSVC
-from sklearn.metrics import (confusion_matrix, f1_score, precision_score,
-                             recall_score)
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from website.models import Question, Answer, AnswerComment
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from website import metrics
+from website.permissions import get_permissions
+from website.models import (Question, Answer, AnswerComment,
+                            SpamFilterTraining, fingerprint, fingerprint_key)
 from forums.local import TRAIN_SPAMFILTER
-# Get the original dataset
 
+# NOTE: openpyxl, numpy, scikit-learn and the text cleaning dependencies
+# (BeautifulSoup, nltk) are imported inside the functions using them, so
+# that importing this module (and website.views) stays cheap. The model is
+# trained on the first prediction instead of at import time.
+#
+# A trained model is published to settings.SPAM_FILTER_MODEL_PATH. Every
+# process checks the modification time of that file before predicting and
+# loads the model again when it changed, so a model trained by one worker is
+# used by all of them.
 
+
+# Get the original dataset
 def store():
+    import openpyxl
+    from .cleanText import clean_string
 
     # Add data from Excel file
     file_location = settings.BASE_DIR + '/Spam_Filter_Data/DataSet.xlsx'
@@ -75,21 +97,206 @@ def store():
 
 
 def train():
+    """
+    Re-train the spam filter: the one of the scoring server if it is used,
+    else the one of this process.
+    """
+    if settings.SPAM_SERVER_SOCKET:
+        from . import spamServer
+        try:
+            spamServer.request({'command': 'train'}, timeout=None)
+            return
+        except spamServer.SPAM_SERVER_ERRORS:
+            logger.exception("Spam filter server could not be re-trained")
+    train_local()
+
+
+def fit(xTrain, yTrain):
+    """Return a (vectorizer, model) pair trained on the cleaned texts."""
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.svm import LinearSVC
+
+    newVectorizer = TfidfVectorizer(stop_words='english', max_df=75)
+    xTrainMatrix = newVectorizer.fit_transform(xTrain)
+    yTrainMatrix = np.asarray(yTrain)
+
+    newModel = LinearSVC(class_weight='balanced')
+    newModel.fit(xTrainMatrix, yTrainMatrix)
+    return newVectorizer, newModel
+
 
+def train_local(evaluate=False):
+    """
+    Train the spam filter in this process and publish it to the others.
+    Return the number of samples and, if evaluate is True, the scores of
+    calc_f_score() for a model trained on 80% of the data and tested on the
+    rest, else None.
+    """
     print("Training spam filter...")
+    start = time.perf_counter()
+    try:
+        # Create training data
+        xData, yData = store()
+        scores = None
+        if evaluate:
+            from sklearn.model_selection import train_test_split
+            xTrain, xTest, yTrain, yTest = train_test_split(
+                xData, yData, test_size=0.2, random_state=42)
+            vectorizer, model = fit(xTrain, yTrain)
+            scores = calc_f_score(xTest, yTest, model, vectorizer)
+
+        publish(fit(xData, yData))
+    except Exception:
+        training_failures.inc()
+        raise
+    finally:
+        training_duration.observe(time.perf_counter() - start)
+        # Trainings are rare and may run outside of any request (spam
+        # server, cron), their metrics are written right away
+        metrics.registry.flush(force=True)
+    return len(xData), scores
+
+
+def model_version():
+    """Return the version of the published model, or None if there is none."""
+    try:
+        return os.stat(settings.SPAM_FILTER_MODEL_PATH).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+def publish(pair):
+    """
+    Use the (vectorizer, model) pair in this process and write it to the
+    model file for the other processes. The file is replaced atomically, so
+    a process never reads a partly written model.
+    """
+    global trained, trained_version
+    version = None
+    path = settings.SPAM_FILTER_MODEL_PATH
+    if path:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(pair, f, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        version = model_version()
+
+    # Replace the vectorizer and the model together, so that concurrent
+    # predictions keep using the old pair until then.
+    trained_version = version
+    trained = pair
+
+
+def load_published(version):
+    """Use the published model in this process."""
+    global trained, trained_version
+    with open(settings.SPAM_FILTER_MODEL_PATH, 'rb') as f:
+        pair = pickle.load(f)
+    trained_version = version
+    trained = pair
+
+
+def get_trained():
+    """
+    Return the trained (vectorizer, model) pair. The published model is
+    loaded if it is newer than the one of this process, else the spam filter
+    is trained if it has not been trained yet in this process.
+    """
+    version = model_version()
+    if version is not None and version != trained_version:
+        with training_lock:
+            if version != trained_version:
+                load_published(version)
+    if trained is None and TRAIN_SPAMFILTER is True:
+        with training_lock:
+            if trained is None:
+                train_local()
+    if trained is None:
+        raise RuntimeError("Spam filter is not trained.")
+    return trained
+
+
+# Cache key held while a training job is being started, and the seconds
+# after which it is released if its holder died
+TRAINING_START_LOCK = 'spam_filter_training_start'
+TRAINING_START_LOCK_TIMEOUT = 10
+
+
+@contextmanager
+def training_start_lock():
+    """Wait for the other requests starting a training job."""
+    while not cache.add(TRAINING_START_LOCK, True,
+                        TRAINING_START_LOCK_TIMEOUT):
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(TRAINING_START_LOCK)
+
+
+def start_training(user=None):
+    """
+    Train the spam filter in a background thread, recording the progress in
+    a SpamFilterTraining. Return the training job, which is the one already
+    in progress if there is one.
+    """
+    started_after = timezone.now() - timedelta(
+        seconds=settings.SPAM_FILTER_TRAINING_TIMEOUT)
+    # Two quick requests must not both find no job and start two trainings
+    with training_start_lock():
+        job = SpamFilterTraining.objects.filter(
+            status__in=['pending', 'running'],
+            date_created__gte=started_after).order_by('-id').first()
+        if job is not None:
+            return job
+        job = SpamFilterTraining.objects.create(user=user)
+
+    # The thread uses its own database connection, which only sees the job
+    # once it is committed.
+    transaction.on_commit(lambda: threading.Thread(
+        target=run_training_thread, args=(job.id,), daemon=True).start())
+    return job
+
+
+def run_training(job_id):
+    """Run the training job, recording its progress and results."""
+    job = SpamFilterTraining.objects.get(id=job_id)
+    job.status = 'running'
+    job.date_started = timezone.now()
+    job.save()
+    try:
+        samples, scores = train_local(evaluate=True)
+    except Exception as e:
+        logger.exception("Spam filter training failed")
+        job.status = 'failed'
+        job.error = str(e)
+    else:
+        job.status = 'done'
+        job.samples = samples
+        job.f_score, job.precision, job.recall, _ = scores
+    job.date_finished = timezone.now()
+    job.save()
+    return job
 
-    # Create training data
-    xTrain, yTrain = store()
-    global vectorizer
-    xTrainMatrix = vectorizer.fit_transform(xTrain)
-    yTrainMatrix = np.asarray(yTrain)
 
-    global model
-    model.fit(xTrainMatrix, yTrainMatrix)
+def run_training_thread(job_id):
+    try:
+        run_training(job_id)
+    finally:
+        connection.close()
 
 
-# Calculating the F-score
-def calc_f_score(xTest, yTest, model, vectorizer):
+# Calculating the F-score, of the ham class (0) unless pos_label is 1 (spam)
+def calc_f_score(xTest, yTest, model, vectorizer, pos_label=0):
+    import numpy as np
+    from sklearn.metrics import (confusion_matrix, f1_score, precision_score,
+                                 recall_score)
 
     xTestMatrix = vectorizer.transform(xTest)
     yTestMatrix = np.asarray(yTest)
@@ -97,35 +304,247 @@ def calc_f_score(xTest, yTest, model, vectorizer):
     result = model.predict(xTestMatrix)
     matrix = confusion_matrix(yTestMatrix, result)
 
-    fScore = f1_score(yTestMatrix, result, pos_label=0)
-    precision = precision_score(yTestMatrix, result, pos_label=0)
-    recall = recall_score(yTestMatrix, result, pos_label=0)
+    fScore = f1_score(yTestMatrix, result, pos_label=pos_label)
+    precision = precision_score(yTestMatrix, result, pos_label=pos_label)
+    recall = recall_score(yTestMatrix, result, pos_label=pos_label)
     return fScore, precision, recall, matrix
 
 # Test new data for Spam
 
 
-def predict(emailBody):
-
-    string = clean_string(emailBody)
-    if ('httpaddr' in string or 'linktag' in string):
+def predict(emailBody, user=None):
+    """
+    Return "Spam" or "Not Spam". The text goes through the stages of the
+    CASCADE in order, up to the first one giving a verdict. The user, if
+    given, is the author of a new post.
+    """
+    started = time.perf_counter()
+    for name, stage in CASCADE:
+        start = time.perf_counter()
+        result = stage(emailBody, user)
+        cascade.record(name, result is not None, time.perf_counter() - start)
+        if result is not None:
+            break
+    predict_duration.observe(time.perf_counter() - started, stage=name,
+                             verdict=result or 'none')
+
+    # Reject the next copies of the spam without scoring them again
+    post_fingerprint = fingerprint(emailBody)
+    if result == "Spam" and name == 'model' and post_fingerprint:
+        cache.set(fingerprint_key(post_fingerprint), True,
+                  settings.SPAM_FINGERPRINT_TIMEOUT)
+    return result
+
+
+# STAGES OF THE CASCADE
+# Every stage returns "Spam", "Not Spam" or None if it cannot tell.
+
+LINK_RE = re.compile(r'https?://|<a[\s>]', re.IGNORECASE)
+REPEATED_CHARACTERS_RE = re.compile(r'(\S)\1{3,}')
+
+
+def check_links(emailBody, user):
+    """Posts with links are spam, as for the 'httpaddr' and 'linktag' words."""
+    if LINK_RE.search(emailBody):
         return "Spam"
 
-    global vectorizer
-    featureMatrix = vectorizer.transform([string])
-    global model
-    result = model.predict(featureMatrix)
 
-    if (1 in result):
+def is_known_spam(post_fingerprint):
+    """
+    Return True if a post with the fingerprint is marked as spam. The answer
+    is cached until a post with the fingerprint is saved or deleted. Blank
+    fingerprints (short texts) are never known spam.
+    """
+    if not post_fingerprint:
+        return False
+    key = fingerprint_key(post_fingerprint)
+    known = cache.get(key)
+    if known is None:
+        known = any(
+            model.objects.filter(
+                fingerprint=post_fingerprint, is_spam=True).exists()
+            for model in (Question, Answer, AnswerComment))
+        cache.set(key, known, settings.SPAM_FINGERPRINT_TIMEOUT)
+    return known
+
+
+def check_known_spam(emailBody, user):
+    if is_known_spam(fingerprint(emailBody)):
         return "Spam"
-    else:
-        return "Not Spam"
 
 
-model = LinearSVC(class_weight='balanced')
-vectorizer = TfidfVectorizer(stop_words='english', max_df=75)
+def check_repeated_characters(emailBody, user):
+    """
+    Spam if most of the text is made of runs of a repeated character. The
+    short texts ("hmmmm") are left to the model.
+    """
+    characters = len(''.join(emailBody.split()))
+    if characters < settings.SPAM_REPEATED_CHARACTERS_MIN_LENGTH:
+        return None
+    repeated = sum(len(match.group(0)) for match in
+                   REPEATED_CHARACTERS_RE.finditer(emailBody))
+    if repeated / characters > settings.SPAM_REPEATED_CHARACTERS_RATIO:
+        return "Spam"
+
 
-if TRAIN_SPAMFILTER is True:
-    train()
-else:
-    pass
+def check_velocity(emailBody, user):
+    """
+    Log the users posting too much in a short time, moderators excepted.
+    It is no verdict: their posts are left to the model, and the users are
+    stopped with feedback by the RATE_LIMITS of the views.
+    """
+    if user is None or not user.is_authenticated or user.is_superuser:
+        return None
+    key = 'spam_velocity_{0}'.format(user.id)
+    cache.add(key, 0, settings.SPAM_VELOCITY_WINDOW)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        count = 1
+    if (count > settings.SPAM_VELOCITY_LIMIT
+            and not get_permissions(user).is_moderator):
+        logger.warning("User %s posted %d times in %d seconds", user.id,
+                       count, settings.SPAM_VELOCITY_WINDOW)
+    return None
+
+
+def check_model(emailBody, user):
+    """
+    Score the text with the model of the scoring server if one is configured
+    and reachable, else in this process.
+    """
+    if settings.SPAM_SERVER_SOCKET:
+        from . import spamServer
+        start = time.perf_counter()
+        try:
+            result = spamServer.predict([emailBody])[0]
+        except spamServer.SPAM_SERVER_ERRORS:
+            logger.warning("Spam filter server unavailable", exc_info=True)
+            latency.record('fallback', time.perf_counter() - start)
+        else:
+            latency.record('server', time.perf_counter() - start)
+            return result
+
+    start = time.perf_counter()
+    result = score([emailBody])[0]
+    latency.record('local', time.perf_counter() - start)
+    return result
+
+
+CASCADE = [
+    ('links', check_links),
+    ('known spam', check_known_spam),
+    ('repeated characters', check_repeated_characters),
+    ('velocity', check_velocity),
+    ('model', check_model),
+]
+
+
+def score(emailBodies):
+    """Score a batch of texts in this process."""
+    from .cleanText import clean_string
+
+    strings = [clean_string(emailBody) for emailBody in emailBodies]
+    results = ["Spam" if ('httpaddr' in string or 'linktag' in string)
+               else None for string in strings]
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        vectorizer, model = get_trained()
+        featureMatrix = vectorizer.transform([strings[i] for i in pending])
+        for i, result in zip(pending, model.predict(featureMatrix)):
+            results[i] = "Spam" if result == 1 else "Not Spam"
+    return results
+
+
+class LatencyStats(object):
+    """Latencies of the recent predictions, per way of scoring."""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=self.size)).append(
+                seconds)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self):
+        """
+        Return {name: {'count', 'p50', 'p99', 'max'}}, the percentiles being
+        in seconds over the recent predictions.
+        """
+        stats = {}
+        with self.lock:
+            for name, samples in self.samples.items():
+                ordered = sorted(samples)
+                stats[name] = {
+                    'count': self.counts[name],
+                    'p50': ordered[len(ordered) // 2],
+                    'p99': ordered[int(len(ordered) * 0.99)],
+                    'max': ordered[-1],
+                }
+        return stats
+
+
+class CascadeStats(object):
+    """Number of texts checked, verdicts and time spent, per stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, name, hit, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(
+                name, {'checked': 0, 'hits': 0, 'seconds': 0.0})
+            stage['checked'] += 1
+            stage['hits'] += hit
+            stage['seconds'] += seconds
+
+    def snapshot(self):
+        """
+        Return {stage: {'checked', 'hits', 'hit_rate', 'seconds', 'mean'}}.
+        """
+        stats = {}
+        with self.lock:
+            for name, stage in self.stages.items():
+                stats[name] = dict(
+                    stage,
+                    hit_rate=stage['hits'] / stage['checked'],
+                    mean=stage['seconds'] / stage['checked'])
+        return stats
+
+
+def cascade_stats():
+    """Return the statistics of the stages of the predictions."""
+    return cascade.snapshot()
+
+
+def latency_stats():
+    """Return the latencies of the predictions done by this process."""
+    return latency.snapshot()
+
+
+logger = logging.getLogger(__name__)
+latency = LatencyStats()
+cascade = CascadeStats()
+predict_duration = metrics.histogram(
+    'forum_spam_predict_duration_seconds',
+    'Time taken to tell whether a post is spam, per stage giving the verdict.',
+    ['stage', 'verdict'])
+training_duration = metrics.histogram(
+    'forum_spam_training_duration_seconds',
+    'Time taken to train the spam filter.')
+training_failures = metrics.counter(
+    'forum_spam_training_failures_total',
+    'Trainings of the spam filter which failed.')
+
+# (vectorizer, model) pair, set by publish() and load_published(), and the
+# version of the published model it comes from
+trained = None
+trained_version = None
+training_lock = threading.Lock()
@@ -0,0 +1,180 @@
+"""
+Spam scoring server shared by the workers of the forum.
+
+Run with ``python manage.py spam_server``. The server holds the only trained
+spam filter and answers the workers over a Unix socket, so that the memory
+and the training are not repeated in every worker and all the workers use
+the same model. Requests arriving at the same time are scored as one batch.
+
+The protocol is one JSON object per line in each direction:
+{"predict": [texts]} -> {"results": ["Spam" or "Not Spam", ...]}
+{"command": "train"} -> {"trained": true}
+{"command": "stats"} -> {"batches": ..., "texts": ..., ...}
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from . import spamFilter
+
+logger = logging.getLogger(__name__)
+
+
+class SpamServerError(Exception):
+    """The server answered with an error."""
+
+
+# Errors meaning that the server could not score the texts
+SPAM_SERVER_ERRORS = (OSError, ValueError, SpamServerError)
+
+
+# CLIENT
+
+def request(message, timeout=-1, path=None):
+    """
+    Send a message to the server listening on path (SPAM_SERVER_SOCKET by
+    default) and return its answer. A timeout of -1 stands for
+    SPAM_SERVER_TIMEOUT and None for no timeout.
+    """
+    if timeout == -1:
+        timeout = settings.SPAM_SERVER_TIMEOUT
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or settings.SPAM_SERVER_SOCKET)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as response:
+            line = response.readline()
+    if not line:
+        raise SpamServerError("Connection closed by the server")
+    answer = json.loads(line.decode('utf-8'))
+    if 'error' in answer:
+        raise SpamServerError(answer['error'])
+    return answer
+
+
+def predict(texts):
+    """Return the results of the server for a list of texts."""
+    return request({'predict': texts})['results']
+
+
+# SERVER
+
+class Job(object):
+    """Texts of one request, waiting to be scored in a batch."""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                answer = self.server.dispatch(json.loads(line.decode('utf-8')))
+            except Exception as e:
+                logger.exception("Spam filter server request failed")
+                answer = {'error': str(e)}
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+
+
+class SpamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server scoring the texts of the concurrent requests in
+    batches of at most batch_size texts, waiting at most batch_wait seconds
+    for a batch to fill up.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, batch_wait=None, batch_size=None):
+        if batch_wait is None:
+            batch_wait = settings.SPAM_SERVER_BATCH_WAIT
+        if batch_size is None:
+            batch_size = settings.SPAM_SERVER_BATCH_SIZE
+        self.batch_wait = batch_wait
+        self.batch_size = batch_size
+        self.jobs = queue.Queue()
+        self.stats = {'batches': 0, 'texts': 0, 'scoring_time': 0.0}
+        self.latency = spamFilter.LatencyStats()
+
+        # Remove the socket left by a previous server
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+        scorer = threading.Thread(target=self.score_batches, daemon=True)
+        scorer.start()
+
+    def dispatch(self, message):
+        if 'predict' in message:
+            start = time.perf_counter()
+            job = Job(message['predict'])
+            self.jobs.put(job)
+            job.done.wait()
+            self.latency.record('request', time.perf_counter() - start)
+            if job.error is not None:
+                raise job.error
+            return {'results': job.results}
+
+        command = message.get('command')
+        if command == 'train':
+            try:
+                spamFilter.train_local()
+            finally:
+                connection.close()
+            return {'trained': True}
+        if command == 'stats':
+            stats = dict(self.stats)
+            stats['latency'] = self.latency.snapshot()
+            return stats
+        raise SpamServerError("Unknown request {0!r}".format(message))
+
+    def next_batch(self):
+        """Wait for a job, then take the jobs arriving within batch_wait."""
+        jobs = [self.jobs.get()]
+        size = len(jobs[0].texts)
+        deadline = time.monotonic() + self.batch_wait
+        while size < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs
+
+    def score_batches(self):
+        while True:
+            jobs = self.next_batch()
+            texts = [text for job in jobs for text in job.texts]
+            start = time.perf_counter()
+            try:
+                results = spamFilter.score(texts)
+            except Exception as e:
+                logger.exception("Spam filter scoring failed")
+                for job in jobs:
+                    job.error = e
+            else:
+                for job in jobs:
+                    job.results = results[:len(job.texts)]
+                    results = results[len(job.texts):]
+            self.stats['batches'] += 1
+            self.stats['texts'] += len(texts)
+            self.stats['scoring_time'] += time.perf_counter() - start
+            for job in jobs:
+                job.done.set()
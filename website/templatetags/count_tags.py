@@ -15,8 +15,15 @@ def category_question_count(category):
 
 @register.simple_tag
 def answer_count(question):
-    """Return the number of active and non-spam answers to a question."""
-    return question.answer_set.filter(is_active=True, is_spam=False).count()
+    """
+    Return the number of active and non-spam answers to a question, as
+    annotated by views.question_rows() if it was.
+    """
+    count = getattr(question, 'answer_count', None)
+    if count is None:
+        count = question.answer_set.filter(
+            is_active=True, is_spam=False).count()
+    return count
 
 
 @register.simple_tag
@@ -1,43 +1,48 @@
 from django import template
 
-from website.models import Question, Answer, AnswerComment, Notification
+from website import notifications
+from website.models import Question, Answer
 
 register = template.Library()
 
 # Display the notifications of the user
 @register.inclusion_tag('website/templates/notify.html')
-def get_notification(nid):
-    notification = Notification.objects.get(pk=nid)
-    question = Question.objects.get(pk=notification.qid)
-    answer = Answer.objects.get(pk=notification.aid)
-    comment = None
-    if notification.cid != 0:
-        comment = AnswerComment.objects.get(pk=notification.cid)
+def get_notification(notification):
+    """
+    Render a Notification whose question, answer and comment have already
+    been resolved by the view.
+    """
+    if notification.question is None:
+        raise Question.DoesNotExist
+    if notification.answer is None:
+        raise Answer.DoesNotExist
     context = {
         'notification': notification,
-        'question': question,
-        'answer': answer,
-        'comment': comment,
+        'question': notification.question,
+        'answer': notification.answer,
+        'comment': notification.comment,
     }
     return context
 
 
 @register.simple_tag
 def notification_count(user_id):
-    count = Notification.objects.filter(uid=user_id).count()
-    return count
+    return notifications.notification_count(user_id)
 
 
-# retriving the latest post of a category
+# Link to the questions of a category, if it has any
 @register.inclusion_tag('website/templates/latest_question.html')
 def latest_question(category):
-    question = None
-    try:
-        question = Question.objects.filter(
-            category=category, is_active=True).order_by('-date_created')[0]
-    except BaseException:
-        pass
+    """
+    The views annotate has_questions on the categories (see
+    views.with_question_flag) to spare a query per category.
+    """
+    has_questions = getattr(category, 'has_questions', None)
+    if has_questions is None:
+        has_questions = Question.objects.filter(
+            category=category, is_active=True).exists()
     context = {
-        'question': question
+        'category': category,
+        'has_questions': has_questions,
     }
     return context
@@ -1,5 +1,7 @@
 from django import template
 
+from website.permissions import get_permissions
+
 register = template.Library()
 
 @register.filter
@@ -15,19 +17,7 @@ def is_author(user, obj):
 
 @register.filter
 def is_moderator(user):
-    try:
-        if user.groups.count() > 0:
-            return True
-        else:
-            print("------------")
-            print("No group")
-            print("------------")
-            return False
-    except BaseException as e:
-        print("------Error------")
-        print(e)
-        print("------------")
-        return False
+    return get_permissions(user).is_moderator
 
 
 @register.filter
@@ -35,15 +25,17 @@ def comment_id(answer):
     return "comment" + str(answer.id)
 
 
+# The comments are filtered in Python to use those prefetched by the view
+
 @register.filter
 def havenot_comments(answer):
-    return(not answer.answercomment_set.filter(is_active=True).exists())
+    return not any(comment.is_active
+                   for comment in answer.answercomment_set.all())
 
 
 @register.filter
 def can_delete(answer, comment_id):
-    comments = answer.answercomment_set.filter(is_active=True)
-    for x in comments:
-        if x.id > comment_id:
+    for x in answer.answercomment_set.all():
+        if x.is_active and x.id > comment_id:
             return False
     return True
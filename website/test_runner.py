@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Run the tests with the spam filter published to a temporary file instead
+    of settings.SPAM_FILTER_MODEL_PATH, which the running servers load (any
+    test reaching spamFilter.predict() trains it on the test database).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.model_directory = tempfile.mkdtemp()
+        self.model_settings = override_settings(
+            SPAM_FILTER_MODEL_PATH=os.path.join(self.model_directory,
+                                                'model.pickle'))
+        self.model_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.model_settings.disable()
+        shutil.rmtree(self.model_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,183 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from website import loadtest
+from website.models import *
+
+
+class GenerateForumCommandTest(TestCase):
+
+    def generate(self, **options):
+        options = dict(dict(users=10, categories=2, sub_categories=2,
+                            questions=12, batch_size=5, seed=7), **options)
+        call_command('generate_forum', stdout=StringIO(), **options)
+        return list(Question.objects.order_by('id').values_list(
+            'id', 'user_id', 'title', 'is_spam', 'num_votes', 'views'))
+
+    def test_generate(self):
+        self.generate()
+        users = set(User.objects.values_list('id', flat=True))
+        self.assertEqual(len(users), 10)
+        self.assertEqual(FossCategory.objects.count(), 2)
+        self.assertEqual(SubFossCategory.objects.count(), 4)
+        self.assertEqual(Question.objects.count(), 12)
+        self.assertEqual(Profile.objects.count(), 10)
+        self.assertTrue(Answer.objects.exists())
+        self.assertTrue(AnswerComment.objects.exists())
+        self.assertTrue(Notification.objects.exists())
+        self.assertTrue(set(Answer.objects.values_list('uid', flat=True)) <= users)
+        self.assertFalse(Question.objects.filter(fingerprint='').exists())
+        self.assertFalse(Answer.objects.filter(fingerprint='').exists())
+        # Dates spread from 2019 on, not the time of the generation
+        self.assertFalse(Question.objects.filter(date_created__year__gt=2021).exists())
+        self.assertTrue(self.client.login(username=User.objects.first().username,
+                                          password='password'))
+
+    def test_deterministic(self):
+        with transaction.atomic():
+            first = self.generate()
+            transaction.set_rollback(True)
+        self.assertEqual(self.generate(), first)
+        titles = [row[2] for row in first]
+        self.assertNotEqual([row[2] for row in self.generate(seed=8)[12:]], titles)
+
+    def test_spam_ratio(self):
+        self.generate(spam_ratio=1)
+        self.assertFalse(Question.objects.filter(is_spam=False).exists())
+        self.assertFalse(AnswerComment.objects.filter(is_spam=False).exists())
+        self.generate(spam_ratio=0)
+        self.assertEqual(Question.objects.filter(is_spam=True).count(), 12)
+
+    def test_new_ids_after_generate(self):
+        self.generate()
+        question = Question.objects.create(
+            user=User.objects.first(), category=FossCategory.objects.first(),
+            title='Title', body='Body')
+        self.assertEqual(question.id, 13)
+
+
+@mock.patch('website.spamFilter.score', lambda texts: ["Not Spam"] * len(texts))
+class LoadTestCommandTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        call_command('generate_forum', users=5, categories=2, sub_categories=1,
+                     questions=5, spam_ratio=0, stdout=StringIO())
+
+    def load_test(self, *flows, **options):
+        out = StringIO()
+        call_command('load_test', *flows, iterations=3, concurrency=2,
+                     stdout=out, **options)
+        return out.getvalue()
+
+    def test_flows(self):
+        endpoints = {
+            'browse': ['home', 'questions', 'filter', 'get_question'],
+            'search': ['search', 'ajax_keyword_search'],
+            'answer': ['login', 'get_question', 'question_answer'],
+            'vote': ['login', 'ajax_vote_post', 'ajax_ans_vote_post'],
+            'moderate': ['login', 'moderator_activate', 'moderator_home',
+                         'moderator_review'],
+        }
+        for flow in loadtest.FLOWS:
+            output = self.load_test(flow)
+            for endpoint in endpoints[flow]:
+                with self.subTest(flow=flow, endpoint=endpoint):
+                    # Requests sent and none failed
+                    self.assertRegex(output, r'\n{0} +\d+ +0 '.format(endpoint))
+        self.assertEqual(Answer.objects.filter(body__startswith='Load test').count(), 6)
+        self.assertTrue(User.objects.get(username='loadtest-moderator')
+                        .groups.filter(name='forum_moderator').exists())
+
+    def test_emails_captured(self):
+        output = self.load_test('answer')
+        self.assertRegex(output, r'\n[1-9]\d* emails captured')
+
+    def test_baseline(self):
+        path = tempfile.mktemp(suffix='.json')
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        self.load_test('search', save=path)
+        self.assertIn('ajax_keyword_search', loadtest.load(path))
+
+        output = self.load_test('search', baseline=path, tolerance=100)
+        self.assertIn('p99 vs base', output)
+
+        # A baseline ten times faster
+        baseline = loadtest.load(path)
+        for results in baseline.values():
+            results['p50'] /= 10
+        loadtest.save(baseline, path)
+        with self.assertRaisesRegex(CommandError, 'search p50'):
+            self.load_test('search', baseline=path)
+
+    def test_unknown_flow(self):
+        with self.assertRaisesRegex(CommandError, 'Unknown flows: upload'):
+            self.load_test('upload')
+
+
+class LoadTestCompareTest(TestCase):
+
+    def results(self, **values):
+        return dict(dict(requests=10, errors=0, throughput=10.0, p50=10.0,
+                         p90=20.0, p99=30.0, max=40.0), **values)
+
+    def test_compare(self):
+        changes, regressions = loadtest.compare(
+            {'home': self.results(p50=12.0), 'search': self.results()},
+            {'home': self.results(), 'other': self.results()}, 0.1)
+        self.assertEqual(set(changes), {'home'})
+        self.assertAlmostEqual(changes['home']['p50'], 0.2)
+        self.assertEqual(regressions, ['home p50: 10.0 -> 12.0 (+20%)'])
+
+    def test_throughput_and_errors(self):
+        _, regressions = loadtest.compare(
+            {'home': self.results(throughput=5.0, errors=1, p99=31.0)},
+            {'home': self.results()}, 0.1)
+        self.assertEqual(regressions, ['home throughput: 10.0 -> 5.0 (-50%)',
+                                       'home errors: 0 -> 1'])
+
+    def test_percentile(self):
+        self.assertEqual(loadtest.percentile(list(range(100)), 0.5), 50)
+        self.assertEqual(loadtest.percentile(list(range(100)), 0.99), 99)
+        self.assertEqual(loadtest.percentile([3], 0.99), 3)
+
+
+class BenchmarkPagesCommandTest(TestCase):
+
+    def test_benchmark(self):
+        call_command('generate_forum', users=5, categories=2, questions=6, seed=7,
+                     stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark_pages', requests=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('page'))
+        self.assertEqual([line.split()[:3] for line in lines[1:3]],
+                         [['/', 'templates', 'cold'], ['/', 'templates', 'warm']])
+        self.assertEqual(len(lines), 7)
+        # The rows of the warm page come from the cache
+        cold, warm = [int(line.split()[4]) for line in lines[1:3]]
+        self.assertEqual(warm, cold - 1)
+
+    def test_minify_modes(self):
+        call_command('generate_forum', users=5, categories=2, questions=6, seed=7,
+                     stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark_pages', '/', requests=1, minify=['none', 'templates'],
+                     stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([row[1:3] for row in rows],
+                         [['none', 'cold'], ['none', 'warm'],
+                          ['templates', 'cold'], ['templates', 'warm']])
+        # The stripped templates give smaller pages
+        self.assertLess(int(rows[2][3]), int(rows[0][3]))
+
+    def test_page_not_found(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_pages', '/question/0/', requests=1, stdout=StringIO())
@@ -110,6 +110,7 @@ class UserLoginViewTest(TestCase):
             data=dict({'username': 'johndoe', 'password': 'johndoe'}, next=reverse('website:new_question')))
         self.assertRedirects(response, reverse('website:new_question'))
 
+@override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend')
 class AccountRegisterViewTest(TestCase):
 
     @classmethod
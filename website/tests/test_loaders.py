@@ -0,0 +1,44 @@
+from django.template import Context, Engine
+from django.test import TestCase
+from django.urls import reverse
+
+from website.loaders import strip_whitespace
+
+
+class TemplateLoaderTest(TestCase):
+
+    def engine(self, templates):
+        return Engine(loaders=[('website.loaders.Loader', [
+            ('django.template.loaders.locmem.Loader', templates)])])
+
+    def test_strip_whitespace(self):
+        source = ('<div>\n    <p>\n        {{ text }}  and more\n    </p>\n\n'
+                  '    <!-- Old layout -->\n</div>\n')
+        self.assertEqual(strip_whitespace(source),
+                         '<div>\n<p>\n{{ text }}  and more\n</p>\n</div>\n')
+
+    def test_preserved_blocks(self):
+        source = ('<div>\n    <pre>\n    a\n\n    b</pre>\n    <textarea>  x\n  y</textarea>\n'
+                  '    <script>\n        // <!-- kept -->\n        var a = 1\n    </script>\n'
+                  '    <!-- {% if a %} -->\n</div>')
+        self.assertEqual(strip_whitespace(source),
+                         '<div>\n<pre>\n    a\n\n    b</pre>\n<textarea>  x\n  y</textarea>\n'
+                         '<script>\n// <!-- kept -->\nvar a = 1\n</script>\n'
+                         '<!-- {% if a %} -->\n</div>')
+
+    def test_loader(self):
+        engine = self.engine({
+            'page.html': '{% if a %}\n    <b>{{ a }}</b>\n{% endif %}\n',
+            'emails/new.html': 'Hello,\n\n    {{ a }}\n',
+        })
+        self.assertEqual(engine.get_template('page.html').render(Context({'a': 1})),
+                         '<b>1</b>\n')
+        # The plain text emails are kept as they are
+        self.assertEqual(engine.get_template('emails/new.html').render(Context({'a': 1})),
+                         'Hello,\n\n    1\n')
+
+    def test_pages_stripped(self):
+        response = self.client.get(reverse('website:search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'\n ', response.content)
+        self.assertNotIn(b'\n\n', response.content)
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from website import metrics, spamFilter
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def registry(self):
+        registry = metrics.Registry(self.directory)
+        registry.counter('test_posts_total', 'Posts.', ['kind'])
+        registry.histogram('test_duration_seconds', 'Duration.', buckets=(0.1, 1))
+        return registry
+
+    def test_render(self):
+        registry = self.registry()
+        registry.metrics['test_posts_total'].inc(kind='answer')
+        registry.metrics['test_posts_total'].inc(2, kind='a "quoted"\nkind')
+        for value in (0.05, 0.5, 5):
+            registry.metrics['test_duration_seconds'].observe(value)
+        text = metrics.render(metrics.merge([registry.snapshot()]))
+        self.assertIn('# HELP test_posts_total Posts.\n# TYPE test_posts_total counter\n', text)
+        self.assertIn('test_posts_total{kind="answer"} 1\n', text)
+        self.assertIn('test_posts_total{kind="a \\"quoted\\"\\nkind"} 2\n', text)
+        self.assertIn('# TYPE test_duration_seconds histogram\n'
+                      'test_duration_seconds_bucket{le="0.1"} 1\n'
+                      'test_duration_seconds_bucket{le="1"} 2\n'
+                      'test_duration_seconds_bucket{le="+Inf"} 3\n'
+                      'test_duration_seconds_sum 5.55\n'
+                      'test_duration_seconds_count 3\n', text)
+
+    def test_labels_checked(self):
+        with self.assertRaises(ValueError):
+            self.registry().metrics['test_posts_total'].inc(post='answer')
+
+    def test_processes_added_up(self):
+        first, second = self.registry(), self.registry()
+        first.metrics['test_posts_total'].inc(kind='answer')
+        second.metrics['test_posts_total'].inc(3, kind='answer')
+        second.metrics['test_posts_total'].inc(kind='comment')
+        first.metrics['test_duration_seconds'].observe(0.5)
+        second.metrics['test_duration_seconds'].observe(2)
+        second.flush(force=True)
+        text = metrics.render(first.collect())
+        self.assertIn('test_posts_total{kind="answer"} 4\n', text)
+        self.assertIn('test_posts_total{kind="comment"} 1\n', text)
+        self.assertIn('test_duration_seconds_bucket{le="1"} 1\n', text)
+        self.assertIn('test_duration_seconds_count 2\n', text)
+
+        # A forked process starts from zero in its own file
+        first.new_process()
+        text = metrics.render(first.collect())
+        self.assertIn('test_posts_total{kind="answer"} 4\n', text)
+
+    def test_dead_processes_archived(self):
+        registry = self.registry()
+        registry.metrics['test_posts_total'].inc(2, kind='answer')
+        registry.metrics['test_duration_seconds'].observe(0.5)
+        registry.flush(force=True)
+        live = registry.filename
+        # Files left by two workers which exited
+        for pid in (2 ** 22 + 1, 2 ** 22 + 2):
+            shutil.copy(os.path.join(self.directory, live),
+                        os.path.join(self.directory, '{0}-1.json'.format(pid)))
+        for _ in range(2):
+            text = metrics.render(registry.collect())
+            self.assertIn('test_posts_total{kind="answer"} 6\n', text)
+            self.assertIn('test_duration_seconds_count 3\n', text)
+        self.assertEqual(sorted(name for name in os.listdir(self.directory)
+                                if name.endswith('.json')),
+                         sorted([live, metrics.ARCHIVE_FILENAME]))
+
+    @override_settings(METRICS_FLUSH_INTERVAL=60)
+    def test_flush_interval(self):
+        registry = self.registry()
+        registry.flush()
+        registry.metrics['test_posts_total'].inc(kind='answer')
+        registry.flush()
+        self.assertNotIn('test_posts_total{kind="answer"}',
+                         metrics.render(metrics.Registry(self.directory).collect()))
+        registry.flush(force=True)
+        self.assertIn('test_posts_total{kind="answer"} 1',
+                      metrics.render(metrics.Registry(self.directory).collect()))
+
+    def test_endpoint(self):
+        self.client.get(reverse('website:home'))
+        response = self.client.get(reverse('website:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertRegex(response.content.decode(),
+                         r'forum_http_request_duration_seconds_count\{view="website:home",'
+                         r'method="GET",status="200"\} [1-9]')
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_endpoint_forbidden(self):
+        response = self.client.get(reverse('website:metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_email_failures_counted(self):
+        def count(name):
+            return dict((tuple(labels), value) for labels, value in
+                        metrics.merge([metrics.registry.snapshot()])
+                        .get(name, {'samples': []})['samples']).get((), 0)
+
+        sent, failed = count('forum_emails_sent_total'), count('forum_email_failures_total')
+        from website.views import send_email
+        send_email('Subject', 'Body', '<p>Body</p>', 'forum@example.com', ['a@example.com'])
+        self.assertEqual(count('forum_emails_sent_total'), sent + 1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=ConnectionRefusedError):
+            # Logged, not raised
+            send_email('Subject', 'Body', '<p>Body</p>', 'forum@example.com', ['a@example.com'])
+        self.assertEqual(count('forum_email_failures_total'), failed + 1)
+
+    @mock.patch('website.spamFilter.score', lambda texts: ["Not Spam"] * len(texts))
+    def test_spam_predict(self):
+        spamFilter.predict('see <a href="/x">this</a>')
+        spamFilter.predict('a question')
+        text = metrics.render(metrics.registry.collect())
+        self.assertIn('forum_spam_predict_duration_seconds_count{stage="links",verdict="Spam"}', text)
+        self.assertIn('forum_spam_predict_duration_seconds_count{stage="model",verdict="Not Spam"}', text)
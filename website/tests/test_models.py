@@ -2,7 +2,7 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from website.models import Question, Answer, AnswerComment,\
                         FossCategory, Profile, SubFossCategory,\
-                        Notification
+                        Notification, fingerprint
 
 class FossCategoryModelTest(TestCase):
 
@@ -127,6 +127,18 @@ class QuestionModelTest(TestCase):
                                 question.sub_category, question.title, question.user)
         self.assertEqual(expected_object_name, str(question))
 
+    def test_fingerprint(self):
+        question = Question.objects.get(title="TestQuestion")
+        question.body = "<p>Buy   CHEAP&nbsp;pills online</p>"
+        question.save()
+        self.assertEqual(question.fingerprint, fingerprint("buy cheap pills online"))
+        self.assertEqual(Question.objects.filter(
+            fingerprint=fingerprint("Buy cheap\npills online")).count(), 1)
+
+    def test_short_text_not_fingerprinted(self):
+        self.assertEqual(fingerprint("<p>Thanks!</p>"), '')
+        self.assertEqual(fingerprint('<p><img src="/plot.png"></p>'), '')
+
 class AnswerModelTest(TestCase):
 
     @classmethod
@@ -170,4 +182,7 @@ class AnswerCommentModelTest(TestCase):
     def test_user(self):
         answer_comment = AnswerComment.objects.get(body="TestAnswerComment")
         user = User.objects.get(username="johndoe")
-        self.assertEqual(user, answer_comment.user())
\ No newline at end of file
+        self.assertEqual(user, answer_comment.user())
+    def test_fingerprint(self):
+        answer_comment = AnswerComment.objects.get(body="TestAnswerComment")
+        self.assertEqual(answer_comment.fingerprint, fingerprint("<p>testanswercomment</p>"))
@@ -1,9 +1,20 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import AnonymousUser, User, Group
 from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
 from website.models import *
 from website.forms import *
+from website.permissions import get_admin_ids, get_permissions
+from website import spamFilter
+from website.tests.test_website_views import capture_on_commit_callbacks
 
 
 class ModeratorActivateViewTest(TestCase):
@@ -723,3 +734,412 @@ class ModeratorUnansweredViewTest(TestCase):
         response = self.client.get(reverse('website:moderator_home'))
         self.assertTrue('categories' in response.context)
         self.assertQuerysetEqual(response.context['categories'], [])
+
+class ForumPermissionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Create a user
+        User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        # Create Question Categories
+        category1 = FossCategory.objects.create(name="TestCategory1", email="category1@example.com")
+        FossCategory.objects.create(name="TestCategory2", email="category2@example.com")
+        # Create Moderator for 'category1'
+        mod1 = User.objects.create_user('mod1', 'mod1@example.com', 'mod1')
+        group1 = Group.objects.create(name="TestCategory1 Group")
+        ModeratorGroup.objects.create(group=group1, category=category1)
+        mod1.groups.add(group1)
+        # Create a Super Moderator
+        mod2 = User.objects.create_user('mod2', 'mod2@example.com', 'mod2')
+        mod2.groups.add(Group.objects.create(name="forum_moderator"))
+
+    def test_user_permissions(self):
+        user = User.objects.get(username='johndoe')
+        with self.assertNumQueries(1):
+            permissions = get_permissions(user)
+            self.assertFalse(permissions.is_moderator)
+            self.assertFalse(permissions.is_super_moderator)
+            self.assertEqual(permissions.category_ids, [])
+
+    def test_moderator_permissions(self):
+        user = User.objects.get(username='mod1')
+        category1 = FossCategory.objects.get(name='TestCategory1')
+        category2 = FossCategory.objects.get(name='TestCategory2')
+        with self.assertNumQueries(1):
+            permissions = get_permissions(user)
+            self.assertTrue(permissions.is_moderator)
+            self.assertFalse(permissions.is_super_moderator)
+            self.assertEqual(permissions.category_ids, [category1.id])
+            self.assertTrue(permissions.moderates(category1.id))
+            self.assertFalse(permissions.moderates(category2.id))
+
+    def test_super_moderator_permissions(self):
+        user = User.objects.get(username='mod2')
+        category2 = FossCategory.objects.get(name='TestCategory2')
+        with self.assertNumQueries(1):
+            permissions = get_permissions(user)
+            self.assertTrue(permissions.is_moderator)
+            self.assertTrue(permissions.is_super_moderator)
+            self.assertTrue(permissions.moderates(category2.id))
+
+    def test_permissions_resolved_once_per_user(self):
+        user = User.objects.get(username='mod1')
+        self.assertIs(get_permissions(user), get_permissions(user))
+        get_permissions(user).is_moderator
+        with self.assertNumQueries(0):
+            get_permissions(user).is_super_moderator
+
+    def test_anonymous_user_permissions(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(get_permissions(AnonymousUser()).is_moderator)
+
+
+class ModeratorFingerprintViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        category1 = FossCategory.objects.create(name="TestCategory1", email="category1@example.com")
+        category2 = FossCategory.objects.create(name="TestCategory2", email="category2@example.com")
+        mod1 = User.objects.create_user('mod1', 'mod1@example.com', 'mod1')
+        group1 = Group.objects.create(name="TestCategory1 Group")
+        ModeratorGroup.objects.create(group=group1, category=category1)
+        mod1.groups.add(group1)
+        # The same spam posted three times in 'category1' and once in 'category2'
+        question1 = Question.objects.create(user=user, category=category1, title="TestQuestion1",
+                                            body="<p>Cheap watches for sale</p>")
+        answer = Answer.objects.create(question=question1, uid=user.id, body="cheap watches for sale")
+        comment = AnswerComment.objects.create(answer=answer, uid=user.id, body="Cheap Watches for Sale")
+        Question.objects.create(user=user, category=category2, title="TestQuestion2",
+                                body="Cheap watches for sale")
+        Question.objects.create(user=user, category=category1, title="TestQuestion3",
+                                body="How to plot a graph?")
+        Notification.objects.create(uid=user.id, qid=question1.id, aid=answer.id)
+        Notification.objects.create(uid=user.id, qid=question1.id, aid=answer.id, cid=comment.id)
+
+    def setUp(self):
+        self.fingerprint = Question.objects.get(title="TestQuestion1").fingerprint
+        self.url = reverse('website:moderator_fingerprint', args=[self.fingerprint])
+
+    def login_moderator(self):
+        self.client.login(username='mod1', password='mod1')
+        session = self.client.session
+        session['MODERATOR_ACTIVATED'] = True
+        session.save()
+
+    def test_view_redirect_if_not_moderator(self):
+        self.client.login(username='johndoe', password='johndoe')
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Question.objects.filter(is_active=True).count(), 3)
+
+    def test_view_lists_posts_in_moderated_categories(self):
+        self.login_moderator()
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'website/templates/moderator/fingerprint.html')
+        self.assertEqual([q.title for q in response.context['questions']], ['TestQuestion1'])
+        self.assertEqual(len(response.context['answers']), 1)
+        self.assertEqual(len(response.context['comments']), 1)
+
+    @mock.patch('website.views.process_Spam_bulk')
+    def test_view_deactivates_posts(self, process_Spam_bulk):
+        self.login_moderator()
+        # A constant number of queries, whatever the number of posts
+        with self.assertNumQueries(25), capture_on_commit_callbacks() as callbacks:
+            response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('website:moderator_home'), fetch_redirect_response=False)
+        question = Question.objects.get(title="TestQuestion1")
+        self.assertFalse(question.is_active)
+        self.assertTrue(question.is_spam)
+        self.assertFalse(Answer.objects.get().is_active)
+        self.assertFalse(AnswerComment.objects.get().is_active)
+        self.assertFalse(Notification.objects.exists())
+        # Other categories and contents are left alone
+        self.assertTrue(Question.objects.get(title="TestQuestion2").is_active)
+        self.assertTrue(Question.objects.get(title="TestQuestion3").is_active)
+        self.assertTrue(spamFilter.is_known_spam(self.fingerprint))
+        # The authors are emailed and the labels recorded as from the review queue
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(process_Spam_bulk.call_args[0][0]), 3)
+        self.assertTrue(any('Classified as Spam' in email.subject for email in mail.outbox))
+
+
+class ModeratorReviewViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        category1 = FossCategory.objects.create(name="TestCategory1", email="category1@example.com")
+        category2 = FossCategory.objects.create(name="TestCategory2", email="category2@example.com")
+        mod1 = User.objects.create_user('mod1', 'mod1@example.com', 'mod1')
+        group1 = Group.objects.create(name="TestCategory1 Group")
+        ModeratorGroup.objects.create(group=group1, category=category1)
+        mod1.groups.add(group1)
+        question1 = Question.objects.create(user=user, category=category1, title="TestQuestion1",
+                                            body="Cheap watches", is_spam=True)
+        Question.objects.create(user=user, category=category1, title="TestQuestion2",
+                                body="Cheap bags", is_spam=True)
+        Question.objects.create(user=user, category=category2, title="TestQuestion3",
+                                body="Cheap shoes", is_spam=True)
+        Question.objects.create(user=user, category=category1, title="TestQuestion4",
+                                body="How to plot a graph?")
+        answer = Answer.objects.create(question=question1, uid=user.id, body="Cheap watches",
+                                       is_spam=True)
+        comment = AnswerComment.objects.create(answer=answer, uid=user.id, body="Cheap watches",
+                                               is_spam=True)
+        Notification.objects.create(uid=user.id, qid=question1.id, aid=answer.id)
+        Notification.objects.create(uid=user.id, qid=question1.id, aid=answer.id, cid=comment.id)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('website:moderator_review')
+
+    def login_moderator(self):
+        self.client.login(username='mod1', password='mod1')
+        session = self.client.session
+        session['MODERATOR_ACTIVATED'] = True
+        session.save()
+
+    def selection(self, action):
+        return {
+            'action': action,
+            'question': list(Question.objects.values_list('id', flat=True)),
+            'answer': [Answer.objects.get().id],
+            'comment': [AnswerComment.objects.get().id],
+        }
+
+    def test_view_redirect_if_not_moderator(self):
+        self.client.login(username='johndoe', password='johndoe')
+        response = self.client.post(self.url, self.selection('delete'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Question.objects.filter(is_active=True).count(), 4)
+
+    def test_view_lists_spam_posts_in_moderated_categories(self):
+        self.login_moderator()
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'website/templates/moderator/review.html')
+        self.assertEqual([q.title for q in response.context['questions']],
+                         ['TestQuestion2', 'TestQuestion1'])
+        self.assertEqual(len(response.context['answers']), 1)
+        self.assertEqual(len(response.context['comments']), 1)
+
+        response = self.client.get(self.url + '?non-spam')
+        self.assertEqual([q.title for q in response.context['questions']], ['TestQuestion4'])
+        self.assertEqual(len(response.context['answers']), 0)
+
+    @mock.patch('website.views.on_commit')
+    def test_view_approves_selected_posts(self, on_commit):
+        self.login_moderator()
+        # One update() per kind of post and of version stamp, whatever the
+        # number of posts
+        with self.assertNumQueries(16):
+            response = self.client.post(self.url, self.selection('approve'))
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(
+            set(Question.objects.filter(is_spam=False).values_list('title', flat=True)),
+            {'TestQuestion1', 'TestQuestion2', 'TestQuestion4'})
+        self.assertFalse(Answer.objects.get().is_spam)
+        self.assertFalse(AnswerComment.objects.get().is_spam)
+        # Posts of other categories are left alone
+        self.assertTrue(Question.objects.get(title="TestQuestion3").is_spam)
+
+        # The emails are sent once for all the changed posts
+        on_commit.assert_called_once()
+        func, user, action, question_ids, answer_ids, comment_ids = on_commit.call_args[0]
+        self.assertEqual(action, 'approve')
+        self.assertEqual(len(question_ids), 2)
+        self.assertEqual(answer_ids, [Answer.objects.get().id])
+        self.assertEqual(comment_ids, [AnswerComment.objects.get().id])
+
+    def test_view_deletes_selected_posts(self):
+        self.login_moderator()
+        response = self.client.post(self.url, self.selection('delete'))
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(
+            set(Question.objects.filter(is_active=False).values_list('title', flat=True)),
+            {'TestQuestion1', 'TestQuestion2', 'TestQuestion4'})
+        self.assertFalse(Answer.objects.get().is_active)
+        self.assertFalse(AnswerComment.objects.get().is_active)
+        self.assertFalse(Notification.objects.exists())
+        self.assertTrue(Question.objects.get(title="TestQuestion3").is_active)
+
+    @mock.patch('website.views.process_Spam_bulk')
+    def test_deletions_emailed_to_authors(self, process_Spam_bulk):
+        self.login_moderator()
+        with capture_on_commit_callbacks() as callbacks:
+            self.client.post(self.url, self.selection('delete'))
+        self.assertEqual(len(mail.outbox), 0)
+        for callback in callbacks:
+            callback()
+        process_Spam_bulk.assert_not_called()
+        subjects = [email.subject for email in mail.outbox]
+        self.assertIn('FOSSEE Forums - TestCategory1 - Question Deleted', subjects)
+        self.assertTrue(any('johndoe@example.com' in email.to for email in mail.outbox))
+        question = Question.objects.get(title="TestQuestion1")
+        self.assertEqual(question.notif_flag, 0)
+        self.assertFalse(question.is_active)
+
+    @mock.patch('website.views.process_Spam_bulk')
+    def test_notifications_sent_in_one_batch(self, process_Spam_bulk):
+        from website.views import send_review_notifications
+        mod1 = User.objects.get(username='mod1')
+        question_ids = list(Question.objects.filter(
+            category__name="TestCategory1").values_list('id', flat=True))
+        with mock.patch('website.digest.mail.get_connection',
+                        wraps=mail.get_connection) as get_connection:
+            send_review_notifications(mod1, 'spam', question_ids,
+                                      [Answer.objects.get().id], [AnswerComment.objects.get().id])
+        get_connection.assert_called_once_with()
+        self.assertGreaterEqual(len(mail.outbox), 5)
+
+    def test_view_skips_disabled_categories(self):
+        FossCategory.objects.filter(name="TestCategory1").update(disabled=True)
+        self.login_moderator()
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['questions']), 0)
+        self.client.post(self.url, self.selection('delete'))
+        self.assertEqual(Question.objects.filter(is_active=True).count(), 4)
+
+    def test_view_rejects_unknown_action(self):
+        self.login_moderator()
+        response = self.client.post(self.url, self.selection('destroy'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Question.objects.filter(is_active=True).count(), 4)
+
+    @mock.patch('website.views.process_Spam_bulk')
+    def test_notifications_record_labels_once(self, process_Spam_bulk):
+        from website.views import send_review_notifications
+        mod1 = User.objects.get(username='mod1')
+        question_ids = list(Question.objects.filter(
+            category__name="TestCategory1").values_list('id', flat=True))
+        send_review_notifications(mod1, 'spam', question_ids,
+                                  [Answer.objects.get().id], [AnswerComment.objects.get().id])
+        process_Spam_bulk.assert_called_once()
+        labels = process_Spam_bulk.call_args[0][0]
+        self.assertEqual(len(labels), 5)
+        self.assertTrue(all(is_spam for _, is_spam in labels))
+
+
+class AdminIdsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_admin_ids_cached(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        with self.assertNumQueries(1):
+            self.assertEqual(get_admin_ids(), {admin.id})
+            self.assertEqual(get_admin_ids(), {admin.id})
+
+    def test_admin_ids_invalidated_on_user_change(self):
+        user = User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        self.assertEqual(get_admin_ids(), set())
+        user.is_superuser = True
+        user.save()
+        self.assertEqual(get_admin_ids(), {user.id})
+        user.delete()
+        self.assertEqual(get_admin_ids(), set())
+
+
+# Small cleaned dataset in place of spamFilter.store()
+TRAINING_DATA = (
+    ['buy cheap pill number now'] * 10 + ['how do i plot a graph in python'] * 10,
+    [1] * 10 + [0] * 10,
+)
+
+
+@mock.patch('website.spamFilter.store', lambda: TRAINING_DATA)
+class SpamFilterTrainingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        mod = User.objects.create_user('mod1', 'mod1@example.com', 'mod1')
+        mod.groups.add(Group.objects.create(name="forum_moderator"))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'model.pickle')
+        self.settings = override_settings(SPAM_FILTER_MODEL_PATH=path)
+        self.settings.enable()
+        self.trained = spamFilter.trained, spamFilter.trained_version
+
+    def tearDown(self):
+        spamFilter.trained, spamFilter.trained_version = self.trained
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_view_redirect_if_not_moderator(self):
+        self.client.login(username='johndoe', password='johndoe')
+        response = self.client.post(reverse('website:train_spam_filter'))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(SpamFilterTraining.objects.exists())
+
+    @mock.patch('website.spamFilter.threading.Thread')
+    def test_view_starts_one_training(self, thread):
+        self.client.login(username='mod1', password='mod1')
+        response = self.client.post(reverse('website:train_spam_filter'),
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        job = SpamFilterTraining.objects.get()
+        self.assertEqual(response.json()['id'], job.id)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(job.user.username, 'mod1')
+        # A second request returns the training in progress
+        response = self.client.post(reverse('website:train_spam_filter'),
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['id'], job.id)
+        self.assertEqual(SpamFilterTraining.objects.count(), 1)
+
+    def test_view_get_not_allowed(self):
+        self.client.login(username='mod1', password='mod1')
+        response = self.client.get(reverse('website:train_spam_filter'))
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(SpamFilterTraining.objects.exists())
+
+    def test_run_training(self):
+        job = SpamFilterTraining.objects.create()
+        spamFilter.run_training(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.samples, 20)
+        self.assertEqual(job.f_score, 1.0)
+        self.assertIsNotNone(job.date_started)
+        self.assertIsNotNone(job.date_finished)
+
+        self.client.login(username='mod1', password='mod1')
+        response = self.client.get(reverse('website:train_spam_filter_status'))
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertEqual(response.json()['samples'], 20)
+
+    def test_run_training_failure(self):
+        job = SpamFilterTraining.objects.create()
+        with mock.patch('website.spamFilter.fit', side_effect=ValueError('bad data')), \
+                self.assertLogs('website.spamFilter', 'ERROR'):
+            spamFilter.run_training(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, 'bad data')
+
+    def test_published_model_loaded_by_other_processes(self):
+        spamFilter.train_local()
+        published = spamFilter.trained
+        # Another process has not loaded any model yet
+        spamFilter.trained = spamFilter.trained_version = None
+        vectorizer, model = spamFilter.get_trained()
+        self.assertIsNot(vectorizer, published[0])
+        self.assertEqual(spamFilter.trained_version, spamFilter.model_version())
+        self.assertEqual(spamFilter.score(['buy cheap pill number now']), ["Spam"])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_spam_filter', 'current', 'tfidf-sgd', folds=2,
+                     latency_samples=10, stdout=out)
+        output = out.getvalue()
+        self.assertIn('20 samples, 10 spam, 2-fold', output)
+        self.assertIn('current ', output)
+        self.assertIn('tfidf-sgd ', output)
+        self.assertNotIn('hashing', output)
+        self.assertIn('ham F1', output)
+        self.assertIn('spam F1', output)
@@ -0,0 +1,250 @@
+from unittest import mock
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+
+from website.models import *
+
+# URL names without a budget: the admin and the uploads of the editor come
+# from third-party apps
+EXCLUDED_URL_NAMES = {'ckeditor_upload', 'ckeditor_browse'}
+
+# Requests measured by QueryBudgetTest:
+# (URL name, method, user, URL arguments, POST data, budget). The user,
+# the arguments and the data are functions of the test case, to refer to the
+# objects created by setUpTestData.
+CASES = [
+    # Forum
+    ('website:home', 'get', None, None, None, 5),
+    ('website:home', 'get', 'author', None, None, 9),
+    ('website:questions', 'get', None, None, None, 4),
+    ('website:get_question', 'get', None, lambda t: [t.question.id], None, 10),
+    ('website:get_question', 'get', 'author', lambda t: [t.question.id], None, 18),
+    ('website:new_question', 'get', 'author', None, None, 5),
+    ('website:new_question', 'post', 'author', None, lambda t: {
+        'category': t.category.id, 'tutorial': 'Tutorial1', 'title': 'How to plot a graph?',
+        'body': 'I cannot find how to plot a graph with two axes.'}, 8),
+    ('website:question_answer', 'post', 'other', lambda t: [t.question.id], lambda t: {
+        'question': t.question.id, 'body': 'Use the plot function with two axes.'}, 11),
+    ('website:answer_comment', 'post', 'author', lambda t: [t.answer.id], lambda t: {
+        'body': 'Thank you, it works now.'}, 13),
+    ('website:edit_question', 'get', 'author', lambda t: [t.question.id], None, 7),
+    ('website:answer_update', 'post', 'other', None, lambda t: {
+        'answer_id': t.answer.id, 'answer_body': 'Use the plot function with two axes.'}, 7),
+    ('website:answer_comment_update', 'post', 'author', None, lambda t: {
+        'comment_id': t.comment.id, 'comment_body': 'Thank you, it works now.'}, 8),
+    ('website:question_delete', 'post', 'moderator', lambda t: [t.question.id], lambda t: {
+        'deleteQuestion': 'Duplicate'}, 13),
+    ('website:answer_delete', 'post', 'moderator', lambda t: [t.answer.id], lambda t: {
+        'deleteAnswer': 'Off topic'}, 18),
+    ('website:comment_delete', 'post', 'moderator', lambda t: [t.comment.id], lambda t: {
+        'deleteComment': 'Off topic'}, 19),
+    ('website:question_restore', 'post', 'moderator', lambda t: [t.inactive_question.id], None, 6),
+    ('website:answer_restore', 'post', 'moderator', lambda t: [t.inactive_answer.id], None, 9),
+    ('website:comment_restore', 'post', 'moderator', lambda t: [t.inactive_comment.id], None, 10),
+    ('website:approve_spam_question', 'post', 'moderator', lambda t: [t.spam_question.id], None, 10),
+    ('website:mark_answer_spam', 'post', 'moderator', lambda t: [t.answer.id], lambda t: {
+        'selector': 'spam'}, 10),
+    ('website:mark_comment_spam', 'post', 'moderator', lambda t: [t.comment.id], lambda t: {
+        'choice': 'spam'}, 11),
+    ('website:search', 'get', None, None, None, 0),
+    ('website:filter', 'get', None, lambda t: [t.category.name], None, 3),
+    ('website:filter', 'get', None, lambda t: [t.category.name, 'Tutorial1'], None, 3),
+    ('website:user_notifications', 'get', 'author', lambda t: [t.author.id], None, 9),
+    ('website:clear_notifications', 'get', 'author', None, None, 3),
+
+    # Moderator Panel
+    ('website:moderator_home', 'get', 'moderator', None, None, 5),
+    ('website:moderator_activate', 'get', 'moderator', None, None, 6),
+    ('website:moderator_deactivate', 'get', 'moderator', None, None, 6),
+    ('website:moderator_questions', 'get', 'moderator', None, None, 5),
+    ('website:moderator_unanswered', 'get', 'moderator', None, None, 5),
+    ('website:moderator_fingerprint', 'get', 'moderator', lambda t: [t.question.fingerprint], None, 6),
+    ('website:moderator_review', 'get', 'moderator', None, None, 6),
+    ('website:moderator_review', 'post', 'moderator', None, lambda t: {
+        'action': 'approve',
+        'question': [q.id for q in Question.objects.filter(is_spam=True)[:20]]}, 9),
+    ('website:train_spam_filter', 'post', 'moderator', None, None, 5),
+    ('website:train_spam_filter_status', 'get', 'moderator', None, None, 4),
+
+    # Monitoring
+    ('website:metrics', 'get', None, None, None, 0),
+
+    # AJAX
+    ('website:ajax_tutorials', 'post', None, None, lambda t: {'category': t.category.id}, 2),
+    ('website:ajax_notification_remove', 'post', 'author', None, lambda t: {
+        'notification_id': t.notification.id}, 4),
+    ('website:ajax_keyword_search', 'post', None, None, lambda t: {'key': 'graph'}, 1),
+    ('website:ajax_vote_post', 'post', 'other', None, lambda t: {
+        'id': t.question.id, 'type': 'up', 'action': 'vote'}, 11),
+    ('website:ajax_ans_vote_post', 'post', 'author', None, lambda t: {
+        'id': t.answer.id, 'type': 'up', 'action': 'vote'}, 11),
+
+    # Accounts
+    ('user_login', 'get', None, None, None, 0),
+    ('user_logout', 'get', 'author', None, None, 4),
+    ('user_register', 'get', None, None, None, 0),
+    ('confirm', 'get', None, lambda t: ['12345678', t.author.username], None, 11),
+    ('profile', 'get', 'author', None, None, 5),
+    ('view_profile', 'get', None, lambda t: [t.author.id], None, 0),
+    ('view_profile', 'get', 'author', lambda t: [t.author.id], None, 9),
+    ('password_reset', 'get', None, None, None, 0),
+    ('password_reset_confirm', 'get', None, lambda t: ['MQ', 'set-password'], None, 1),
+    ('password_reset_done', 'get', None, None, None, 0),
+    ('password_reset_complete', 'get', None, None, None, 0),
+    ('password_change', 'get', 'author', None, None, 4),
+    ('password_change_done', 'get', 'author', None, None, 4),
+]
+
+
+def seed(author, other, category, question, answer, size):
+    """
+    Add two categories, size questions to every category with answers of
+    the author, and size answers, comments, votes, views and notifications to
+    the question of the author.
+    """
+    for i in range(2):
+        foss = FossCategory.objects.create(
+            name='SeedCategory{0}'.format(FossCategory.objects.count()),
+            email='seed@example.com')
+        SubFossCategory.objects.create(parent=foss, name='Tutorial1')
+    users = [User.objects.create_user('seed{0}'.format(User.objects.count() + i),
+                                      first_name='Seed', last_name='User')
+             for i in range(size)]
+    for foss in FossCategory.objects.all():
+        for i, user in enumerate(users):
+            seeded = Question.objects.create(
+                user=user, category=foss, sub_category='Tutorial1',
+                title='Seeded question {0} on graphs'.format(i),
+                body='How to plot graph {0}?'.format(i), is_spam=(i % 3 == 0))
+            seeded_answer = Answer.objects.create(
+                question=seeded, uid=other.id, body='Plot it {0}.'.format(i))
+            AnswerComment.objects.create(
+                answer=seeded_answer, uid=user.id, body='Thanks {0}.'.format(i))
+            Answer.objects.create(
+                question=seeded, uid=author.id, body='Or in a loop {0}.'.format(i))
+            seeded.userViews.add(author)
+        Question.objects.create(
+            user=author, category=foss, title='Another question of the author',
+            body='How to label the axes?')
+
+    for user in users:
+        seeded_answer = Answer.objects.create(
+            question=question, uid=user.id,
+            body='Another way by {0}.'.format(user.username))
+        seeded_answer.userUpVotes.add(author)
+        comment = AnswerComment.objects.create(
+            answer=seeded_answer, uid=user.id, body='See the documentation.')
+        AnswerComment.objects.create(
+            answer=answer, uid=user.id, body='Me too, {0}.'.format(user.username))
+        question.userUpVotes.add(user)
+        question.userViews.add(user)
+        Notification.objects.create(uid=author.id, qid=question.id,
+                                    aid=seeded_answer.id)
+        Notification.objects.create(uid=author.id, qid=question.id,
+                                    aid=seeded_answer.id, cid=comment.id)
+
+
+@override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend')
+@mock.patch('website.spamFilter.score', lambda texts: ["Not Spam"] * len(texts))
+@mock.patch('website.views.process_Spam', mock.Mock())
+@mock.patch('website.views.process_Spam_bulk', mock.Mock())
+class QueryBudgetTest(TestCase):
+    """
+    The number of queries of every URL must stay within its budget, and not
+    grow with the number of categories, questions, answers, comments,
+    votes and notifications.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            'author', 'author@example.com', 'author', first_name='John', last_name='Doe')
+        Profile.objects.create(user=cls.author, confirmation_code='12345678')
+        cls.other = User.objects.create_user(
+            'other', 'other@example.com', 'other', first_name='Jane', last_name='Doe')
+        cls.moderator = User.objects.create_user(
+            'moderator', 'moderator@example.com', 'moderator')
+        cls.moderator.groups.add(Group.objects.create(name='forum_moderator'))
+
+        for i in range(3):
+            foss = FossCategory.objects.create(
+                name='TestCategory{0}'.format(i), email='category{0}@example.com'.format(i))
+            SubFossCategory.objects.create(parent=foss, name='Tutorial1')
+        cls.category = FossCategory.objects.get(name='TestCategory0')
+
+        cls.question = Question.objects.create(
+            user=cls.author, category=cls.category, sub_category='Tutorial1',
+            title='How to plot a graph?', body='How to plot a graph with two axes?')
+        cls.answer = Answer.objects.create(
+            question=cls.question, uid=cls.other.id, body='Use the plot function.')
+        cls.comment = AnswerComment.objects.create(
+            answer=cls.answer, uid=cls.author.id, body='Which arguments?')
+        cls.notification = Notification.objects.create(
+            uid=cls.author.id, qid=cls.question.id, aid=cls.answer.id)
+        cls.spam_question = Question.objects.create(
+            user=cls.other, category=cls.category, title='Cheap watches',
+            body='Cheap watches', is_spam=True)
+        cls.inactive_question = Question.objects.create(
+            user=cls.other, category=cls.category, title='Deleted question',
+            body='Deleted question', is_active=False)
+        cls.inactive_answer = Answer.objects.create(
+            question=cls.question, uid=cls.other.id, body='Deleted answer', is_active=False)
+        cls.inactive_comment = AnswerComment.objects.create(
+            answer=cls.answer, uid=cls.other.id, body='Deleted comment', is_active=False)
+
+        seed(cls.author, cls.other, cls.category, cls.question, cls.answer, 3)
+
+    def count_queries(self, name, method, user, args, data):
+        """
+        Return the number of queries of the request, with a cold cache.
+        The changes made by the request are rolled back.
+        """
+        self.client.logout()
+        if user is not None:
+            self.client.force_login(getattr(self, user))
+            if user == 'moderator':
+                session = self.client.session
+                session['MODERATOR_ACTIVATED'] = True
+                session.save()
+        url = reverse(name, args=args(self) if args else None)
+        data = data(self) if data else {}
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(url, data)
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 500)
+        return len(queries)
+
+    def test_budgets(self):
+        small = [self.count_queries(*case[:5]) for case in CASES]
+        seed(self.author, self.other, self.category, self.question, self.answer, 10)
+        large = [self.count_queries(*case[:5]) for case in CASES]
+
+        for case, before, after in zip(CASES, small, large):
+            name, method, user, _, _, budget = case
+            with self.subTest(url=name, method=method, user=user):
+                self.assertLessEqual(after, budget)
+                # A query per row shows up as more queries with more rows
+                self.assertEqual(after, before)
+
+    def test_every_url_has_a_budget(self):
+        def names(patterns, namespace=''):
+            for pattern in patterns:
+                if isinstance(pattern, URLPattern):
+                    if pattern.name:
+                        yield namespace + pattern.name
+                elif pattern.namespace != 'admin':
+                    yield from names(
+                        pattern.url_patterns,
+                        namespace + (pattern.namespace + ':' if pattern.namespace else ''))
+
+        measured = {case[0] for case in CASES}
+        missing = set(names(get_resolver().url_patterns)) - measured - EXCLUDED_URL_NAMES
+        self.assertEqual(missing, set())
+
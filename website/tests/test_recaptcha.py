@@ -0,0 +1,63 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from website import recaptcha
+
+
+@override_settings(RECAPTCHA_BACKEND='website.recaptcha.SiteVerifyBackend',
+                   RECAPTCHA_TIMEOUT=0.5)
+class RecaptchaTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.server = recaptcha.StandInServer(('127.0.0.1', 0))
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings_override = override_settings(RECAPTCHA_VERIFY_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_verify_with_server(self):
+        self.assertTrue(recaptcha.verify('token1'))
+        self.assertFalse(recaptcha.verify(recaptcha.INVALID_RESPONSE))
+        self.assertEqual(self.server.requests, 2)
+
+    def test_verified_response_not_replayed(self):
+        # The backend, which rejects the responses used twice, is asked again
+        self.assertTrue(recaptcha.verify('token1'))
+        with mock.patch.object(recaptcha.LocalBackend, 'verify', return_value=False), \
+                override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend'):
+            self.assertFalse(recaptcha.verify('token1'))
+
+    def test_session_is_reused(self):
+        backend = recaptcha.get_backend()
+        session = backend.session
+        recaptcha.verify('token1')
+        recaptcha.verify('token2')
+        self.assertIs(backend.session, session)
+
+    def test_slow_server_fails_closed(self):
+        self.server.delay = 1
+        start = time.perf_counter()
+        with self.assertLogs('website.recaptcha', 'WARNING'):
+            self.assertFalse(recaptcha.verify('token1'))
+        self.assertLess(time.perf_counter() - start, 1)
+
+    @override_settings(RECAPTCHA_FAIL_OPEN=True)
+    def test_unreachable_server_fails_open(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertLogs('website.recaptcha', 'WARNING'):
+            self.assertTrue(recaptcha.verify('token1'))
+
+    @override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend')
+    def test_local_backend(self):
+        self.assertTrue(recaptcha.verify('token1'))
+        self.assertFalse(recaptcha.verify(recaptcha.INVALID_RESPONSE))
+        self.assertEqual(self.server.requests, 0)
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from website import spamFilter
+from website.spamServer import SpamServer
+from website.tests.test_website_views import fake_score
+
+
+@mock.patch('website.spamFilter.score', fake_score)
+class SpamServerTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'spam.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @contextmanager
+    def server(self, **kwargs):
+        server = SpamServer(self.path, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with override_settings(SPAM_SERVER_SOCKET=self.path):
+                yield server
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def latency_count(self, name):
+        return spamFilter.latency_stats().get(name, {}).get('count', 0)
+
+    def test_predict_with_server(self):
+        count = self.latency_count('server')
+        with self.server() as server:
+            self.assertEqual(spamFilter.predict('buy spam'), "Spam")
+            self.assertEqual(spamFilter.predict('a question'), "Not Spam")
+        self.assertEqual(server.stats['texts'], 2)
+        self.assertEqual(self.latency_count('server'), count + 2)
+
+    def test_concurrent_requests_batched(self):
+        results = {}
+
+        def predict(text):
+            results[text] = spamFilter.predict(text)
+
+        with self.server(batch_wait=0.5) as server:
+            threads = [threading.Thread(target=predict, args=(text,))
+                       for text in ['spam 1', 'question 2', 'spam 3']]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results, {'spam 1': "Spam", 'question 2': "Not Spam",
+                                   'spam 3': "Spam"})
+        self.assertEqual(server.stats['batches'], 1)
+        self.assertEqual(server.stats['texts'], 3)
+
+    def test_fallback_without_server(self):
+        count = self.latency_count('fallback')
+        with override_settings(SPAM_SERVER_SOCKET=self.path), \
+                self.assertLogs('website.spamFilter', 'WARNING'):
+            self.assertEqual(spamFilter.predict('buy spam'), "Spam")
+        self.assertEqual(self.latency_count('fallback'), count + 1)
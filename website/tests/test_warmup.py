@@ -0,0 +1,18 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from website.warmup import warm_up
+
+
+class WarmUpTest(TestCase):
+
+    @mock.patch('website.warmup.gc')
+    @mock.patch('website.warmup.TRAIN_SPAMFILTER', False)
+    def test_warm_up(self, gc):
+        report = warm_up()
+        steps = {name: result for name, seconds, result in report}
+        self.assertEqual(list(steps), ['urls', 'templates', 'spam filter'])
+        self.assertGreater(steps['urls'], 0)
+        self.assertGreater(steps['templates'], 0)
+        gc.freeze.assert_called_once_with()
@@ -1,9 +1,47 @@
-from django.test import TestCase, override_settings
+import marshal
+import re
+import time
+from contextlib import contextmanager
+from unittest import mock
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User, Group
 from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
 from website.models import *
 from website.forms import *
+from website.decorators import CSRF_TOKEN_PLACEHOLDER, rate_limit_count
+from website.deferred import run_after_response, run_deferred_queue, start_deferred_queue
+from website.digest import send_digests
+from website.middleware import query_shape, query_stats_middleware
+from website.notifications import notification_count
+from website import recaptcha
+from website import spamFilter
+from website.views import QUESTION_VIEWS_PLACEHOLDER, review_posts, send_answer_notification
+
+
+@contextmanager
+def capture_on_commit_callbacks(execute=False):
+    """
+    Capture the callbacks registered with transaction.on_commit() inside the
+    block and run them afterwards if execute is True. TestCase never commits,
+    so the callbacks would otherwise never run.
+    """
+    callbacks = []
+    start_count = len(connection.run_on_commit)
+    try:
+        yield callbacks
+    finally:
+        callbacks[:] = [func for sids, func in
+                        connection.run_on_commit[start_count:]]
+        if execute:
+            for callback in callbacks:
+                callback()
+
 
 class HomeViewTest(TestCase):
 
@@ -167,6 +205,38 @@ class QuestionsViewTest(TestCase):
         self.assertTrue('categories' in response.context)
         self.assertQuerysetEqual(response.context['categories'], [])
 
+    def test_view_rows_cached(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as rendered:
+            first = self.client.get(reverse('website:questions'))
+        # The rows are not queried again
+        with self.assertNumQueries(len(rendered) - 1):
+            second = self.client.get(reverse('website:questions'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(second.context['rows']), 1)
+
+    def test_view_rows_of_changed_questions_rendered(self):
+        cache.clear()
+        self.client.get(reverse('website:questions'))
+        question = Question.objects.get(title="TestQuestion1")
+        Question.objects.create(user=question.user, category=question.category, title="TestQuestion3")
+        Answer.objects.create(question=question, uid=question.user.id, body="TestAnswer")
+        response = self.client.get(reverse('website:questions'))
+        rows = response.context['rows']
+        self.assertEqual(len(rows), 2)
+        self.assertIn('TestQuestion3', rows[0])
+        self.assertIn('TestQuestion1', rows[1])
+        self.assertEqual(re.findall(r'<td>\s*(\d+)\s*</td>', rows[1])[-1], '1')
+
+    def test_view_rows_show_current_views(self):
+        cache.clear()
+        self.client.get(reverse('website:questions'))
+        # Counted without a change of the version of the question
+        Question.objects.filter(title="TestQuestion1").update(views=42)
+        row, = self.client.get(reverse('website:questions')).context['rows']
+        self.assertEqual(re.findall(r'<td>\s*(\d+)\s*</td>', row)[0], '42')
+        self.assertNotIn(QUESTION_VIEWS_PLACEHOLDER, row)
+
 class GetQuestionViewTest(TestCase):
 
     @classmethod
@@ -198,6 +268,10 @@ class GetQuestionViewTest(TestCase):
         Answer.objects.create(question=question1, uid=user.id, body="TestAnswer2", is_active=False)
         AnswerComment.objects.create(answer=answer, uid=user.id, body="TestAnswerComment")
 
+    def setUp(self):
+        # The pages of the anonymous users are cached
+        cache.clear()
+
     def test_view_url_at_desired_location(self):
         question_id = Question.objects.get(title="TestQuestion1").id
         response = self.client.get('/question/{0}/'.format(question_id))
@@ -350,6 +424,171 @@ class GetQuestionViewTest(TestCase):
         self.assertTrue('net_count' in response.context)
         self.assertEqual(response.context['net_count'], 1)
 
+@override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend')
+class ConditionalPageTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create sample data"""
+        cls.user = User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe',
+                                            first_name='John', last_name='Doe')
+        User.objects.create_user('janedoe', 'janedoe@example.com', 'janedoe')
+        cls.category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        cls.other_category = FossCategory.objects.create(name="OtherCategory",
+                                                         email="other@example.com")
+        cls.question = Question.objects.create(user=cls.user, category=cls.category,
+                                               title="TestQuestion", body="TestQuestion body")
+        cls.answer = Answer.objects.create(question=cls.question, uid=cls.user.id, body="TestAnswer")
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('website:get_question', args=(self.question.id,))
+        # The pages with a form depend on the CSRF cookie set by the first one
+        self.client.get(self.url)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_not_modified_counts_anonymous_views(self):
+        views = Question.objects.get(id=self.question.id).views
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.revalidate(self.url, etag).status_code, 304)
+        self.assertEqual(Question.objects.get(id=self.question.id).views, views + 2)
+
+    def test_views_do_not_change_version(self):
+        version = Question.objects.get(id=self.question.id).last_activity
+        self.client.login(username='johndoe', password='johndoe')
+        self.client.get(self.url)
+        question = Question.objects.get(id=self.question.id)
+        self.assertEqual(question.userViews.count(), 1)
+        self.assertEqual(question.last_activity, version)
+
+    def test_changes_of_posts_change_etag(self):
+        changes = [
+            lambda: Answer.objects.create(question=self.question, uid=self.user.id, body="New answer"),
+            lambda: AnswerComment.objects.create(answer=self.answer, uid=self.user.id, body="Comment"),
+            lambda: Answer.objects.get(id=self.answer.id).save(),
+            lambda: Question.objects.get(id=self.question.id).save(),
+            lambda: touch_posts(answer_ids=[self.answer.id]),
+        ]
+        for change in changes:
+            etag = self.client.get(self.url)['ETag']
+            change()
+            response = self.revalidate(self.url, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_review_posts_changes_listings(self):
+        urls = [reverse('website:home'), reverse('website:questions'),
+                reverse('website:filter', args=(self.category.name,)), self.url]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        other_url = reverse('website:filter', args=(self.other_category.name,))
+        other_etag = self.client.get(other_url)['ETag']
+        moderator = User.objects.create_user('mod', 'mod@example.com', 'mod')
+        review_posts(moderator, 'spam', Question.objects.none(),
+                     Answer.objects.filter(id=self.answer.id), AnswerComment.objects.none())
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.revalidate(url, etag).status_code, 200)
+        self.assertEqual(self.revalidate(other_url, other_etag).status_code, 304)
+
+    def test_etag_depends_on_user(self):
+        anonymous = self.client.get(self.url)['ETag']
+        self.client.login(username='johndoe', password='johndoe')
+        john = self.client.get(self.url)['ETag']
+        self.client.login(username='janedoe', password='janedoe')
+        jane = self.client.get(self.url)['ETag']
+        self.assertEqual(len({anonymous, john, jane}), 3)
+        self.assertEqual(self.revalidate(self.url, john).status_code, 200)
+
+    def test_last_modified_for_anonymous_users_only(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.client.login(username='johndoe', password='johndoe')
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_pages_with_messages_are_rendered(self):
+        self.client.login(username='johndoe', password='johndoe')
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(reverse('website:question_answer', args=(self.question.id,)),
+                         {'body': 'Answer body', 'question': self.question.id,
+                          'g-recaptcha-response': recaptcha.INVALID_RESPONSE})
+        response = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertContains(response, 'Invalid reCAPTCHA')
+
+    def test_missing_question(self):
+        response = self.client.get(reverse('website:get_question', args=(0,)))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend')
+class AnonymousPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create sample data"""
+        cls.user = User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe',
+                                            first_name='John', last_name='Doe')
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        cls.question = Question.objects.create(user=cls.user, category=category,
+                                               title="TestQuestion", body="TestQuestion body")
+        cls.answer = Answer.objects.create(question=cls.question, uid=cls.user.id, body="TestAnswer")
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('website:get_question', args=(self.question.id,))
+
+    def test_page_served_from_cache(self):
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'website/templates/get-question.html')
+        # The view is not run: only the session, the version and the views
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertIsNone(response.context)
+        self.assertContains(response, 'TestAnswer')
+        self.assertEqual(Question.objects.get(id=self.question.id).views, self.question.views + 2)
+
+    def test_csrf_token_of_each_request(self):
+        self.client.get(self.url)
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(self.url)
+        self.assertIsNone(response.context)
+        self.assertNotContains(response, CSRF_TOKEN_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"',
+                          response.content.decode()).group(1)
+        response = client.post(reverse('user_login'), {
+            'username': 'johndoe', 'password': 'wrong', 'csrfmiddlewaretoken': token})
+        self.assertNotEqual(response.status_code, 403)
+
+    def test_changes_of_posts_render_page(self):
+        self.client.get(self.url)
+        AnswerComment.objects.create(answer=self.answer, uid=self.user.id, body="TestComment")
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'TestComment')
+
+    def test_logged_in_users_not_cached(self):
+        self.client.get(self.url)
+        self.client.login(username='johndoe', password='johndoe')
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+        self.assertEqual(response.context['user'], self.user)
+
+
 class NewQuestionViewTest(TestCase):
 
     @classmethod
@@ -368,6 +607,10 @@ class NewQuestionViewTest(TestCase):
         # Sample Question
         Question.objects.create(user=user, category=category1, title="TestQuestion")
 
+    def setUp(self):
+        # Reset the rate limits
+        cache.clear()
+
     def test_view_redirect_if_not_logged_in(self):
         response = self.client.get(reverse('website:new_question'))
         self.assertEqual(response.status_code, 302)
@@ -526,6 +769,7 @@ class NewQuestionViewTest(TestCase):
         self.assertTrue('form' in response.context)
         self.assertIsInstance(response.context['form'], NewQuestionForm)
 
+@override_settings(RECAPTCHA_BACKEND='website.recaptcha.LocalBackend')
 class QuestionAnswerViewTest(TestCase):
 
     @classmethod
@@ -536,6 +780,10 @@ class QuestionAnswerViewTest(TestCase):
         category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
         Question.objects.create(user=user, category=category, title="TestQuestion")
 
+    def setUp(self):
+        # Reset the rate limits
+        cache.clear()
+
     def test_view_redirect_if_not_logged_in(self):
         question_id = Question.objects.get(title="TestQuestion").id
         response = self.client.get(reverse('website:question_answer', args=(question_id,)))
@@ -630,8 +878,9 @@ class QuestionAnswerViewTest(TestCase):
     def test_view_post_notification_created(self):
         self.client.login(username='johndoe2', password='johndoe2')
         question_id = Question.objects.get(title="TestQuestion").id
-        self.client.post(reverse('website:question_answer', args=(question_id,)),\
-                                    {'body': 'Test question body', 'question': question_id})
+        with capture_on_commit_callbacks(execute=True):
+            self.client.post(reverse('website:question_answer', args=(question_id,)),\
+                                        {'body': 'Test question body', 'question': question_id})
         try:
             user_id = User.objects.get(username='johndoe').id
             notification = Notification.objects.get(uid=user_id, qid=question_id)
@@ -650,6 +899,16 @@ class QuestionAnswerViewTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, reverse('website:get_question', args=(question_id,)))
     
+    def test_view_post_invalid_recaptcha(self):
+        self.client.login(username='johndoe2', password='johndoe2')
+        question_id = Question.objects.get(title="TestQuestion").id
+        response = self.client.post(reverse('website:question_answer', args=(question_id,)),
+                                    {'body': 'Test question body', 'question': question_id,
+                                     'g-recaptcha-response': recaptcha.INVALID_RESPONSE})
+        self.assertTrue("Invalid reCAPTCHA" in response.cookies['messages'].value)
+        self.assertFalse(Answer.objects.filter(body='Test question body').exists())
+
+
 class AnswerCommentViewTest(TestCase):
 
     @classmethod
@@ -663,6 +922,10 @@ class AnswerCommentViewTest(TestCase):
         answer = Answer.objects.create(question=question, uid=user.id, body="TestAnswer")
         AnswerComment.objects.create(answer=answer, uid=user3.id, body="TestAnswerComment")
 
+    def setUp(self):
+        # Reset the rate limits
+        cache.clear()
+
     def test_view_redirect_if_not_logged_in(self):
         answer_id = Answer.objects.get(body="TestAnswer").id
         response = self.client.get(reverse('website:answer_comment', args=(answer_id,)))
@@ -746,8 +1009,9 @@ class AnswerCommentViewTest(TestCase):
         answer_id = Answer.objects.get(body="TestAnswer").id
         self.client.login(username='johndoe2', password='johndoe2')
         answer = Answer.objects.get(body="TestAnswer")
-        self.client.post(reverse('website:answer_comment', args=(answer_id,)),
-                         {'body': 'Test Answer comment', 'answer_id': answer.id})
+        with capture_on_commit_callbacks(execute=True):
+            self.client.post(reverse('website:answer_comment', args=(answer_id,)),
+                             {'body': 'Test Answer comment', 'answer_id': answer.id})
         try:
             user_id = User.objects.get(username='johndoe').id
             notification = Notification.objects.get(uid=user_id, qid=answer.question.id, aid=answer.id)
@@ -759,8 +1023,9 @@ class AnswerCommentViewTest(TestCase):
         answer_id = Answer.objects.get(body="TestAnswer").id
         self.client.login(username='johndoe2', password='johndoe2')
         answer = Answer.objects.get(body="TestAnswer")
-        self.client.post(reverse('website:answer_comment', args=(answer_id,)),
-                         {'body': 'Test Answer comment', 'answer_id': answer.id})
+        with capture_on_commit_callbacks(execute=True):
+            self.client.post(reverse('website:answer_comment', args=(answer_id,)),
+                             {'body': 'Test Answer comment', 'answer_id': answer.id})
         try:
             user_id = User.objects.get(username='johndoe3').id
             notification = Notification.objects.get(uid=user_id, qid=answer.question.id, aid=answer.id)
@@ -777,6 +1042,200 @@ class AnswerCommentViewTest(TestCase):
         self.assertTrue(AnswerComment.objects.filter(body='Test Answer comment').exists())
         self.assertRedirects(response, reverse('website:get_question', args=(answer.question.id, )))
 
+class DeferredNotificationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create sample data"""
+        user = User.objects.create_user("johndoe", "johndoe@example.com", "johndoe")
+        User.objects.create_user("johndoe2", "johndoe2@example.com", "johndoe2", first_name="John", last_name="Doe")
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        question = Question.objects.create(user=user, category=category, title="TestQuestion")
+        Answer.objects.create(question=question, uid=user.id, body="TestAnswer")
+
+    def test_comment_notifications_run_after_commit(self):
+        self.client.login(username='johndoe2', password='johndoe2')
+        answer = Answer.objects.get(body="TestAnswer")
+        with capture_on_commit_callbacks() as callbacks:
+            self.client.post(reverse('website:answer_comment', args=(answer.id,)),
+                             {'body': 'Test Answer comment', 'answer_id': answer.id})
+        self.assertTrue(AnswerComment.objects.filter(body='Test Answer comment').exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        user_id = User.objects.get(username='johndoe').id
+        self.assertTrue(Notification.objects.filter(uid=user_id, aid=answer.id).exists())
+        self.assertNotEqual(len(mail.outbox), 0)
+
+    def test_new_question_notifications_run_after_commit(self):
+        self.client.login(username='johndoe2', password='johndoe2')
+        category = FossCategory.objects.get(name='TestCategory')
+        with capture_on_commit_callbacks() as callbacks:
+            self.client.post(reverse('website:new_question'),
+                             {'category': category.id, 'body': 'Test question body',
+                              'title': 'Test question title', 'tutorial': 'None'})
+        question = Question.objects.get(title='Test question title')
+        self.assertEqual(question.notif_flag, 1)
+        self.assertEqual(len(mail.outbox), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(mail.outbox[0].to, ['category@example.com'])
+        question.refresh_from_db()
+        self.assertEqual(question.notif_flag, 0)
+
+    def test_new_question_rolled_back_on_failure(self):
+        self.client.login(username='johndoe2', password='johndoe2')
+        category = FossCategory.objects.get(name='TestCategory')
+        with mock.patch.object(Question, 'userViews', new_callable=mock.PropertyMock,
+                               side_effect=DatabaseError):
+            with capture_on_commit_callbacks() as callbacks:
+                with self.assertRaises(DatabaseError):
+                    self.client.post(reverse('website:new_question'),
+                                     {'category': category.id, 'body': 'Test question body',
+                                      'title': 'Test question title', 'tutorial': 'None'})
+        self.assertFalse(Question.objects.filter(title='Test question title').exists())
+        self.assertEqual(callbacks, [])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_deferred_calls_run_after_response(self):
+        calls = []
+        start_deferred_queue(sender=None)
+        run_after_response(lambda: calls.append(1))
+        run_after_response(lambda: 1 / 0)
+        run_after_response(lambda: calls.append(2))
+        self.assertEqual(calls, [])
+        with self.assertLogs('website.deferred', level='ERROR'):
+            run_deferred_queue(sender=None)
+        self.assertEqual(calls, [1, 2])
+        # Without a request being served, calls are made right away
+        run_after_response(lambda: calls.append(3))
+        self.assertEqual(calls, [1, 2, 3])
+
+    def test_connections_closed_after_deferred_calls(self):
+        idle = mock.Mock(in_atomic_block=False)
+        in_transaction = mock.Mock(in_atomic_block=True)
+        start_deferred_queue(sender=None)
+        run_after_response(lambda: None)
+        with mock.patch('website.deferred.connections') as connections:
+            connections.all.return_value = [idle, in_transaction]
+            run_deferred_queue(sender=None)
+        idle.close_if_unusable_or_obsolete.assert_called_once_with()
+        in_transaction.close_if_unusable_or_obsolete.assert_not_called()
+
+class QueryStatsMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(8):
+            User.objects.create_user('user{0}'.format(i))
+
+    def run_middleware(self, view):
+        return query_stats_middleware(view)(RequestFactory().get('/question/1/'))
+
+    def per_row_view(self, request):
+        # One query per user, like a template tag in a loop
+        for user in User.objects.all():
+            User.objects.filter(id=user.id).exists()
+        return HttpResponse()
+
+    def test_query_shape_collapses_lists(self):
+        self.assertEqual(query_shape('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         'SELECT * FROM t WHERE id IN (%s, ...)')
+
+    @override_settings(SQL_STATS_HEADER=True)
+    def test_header(self):
+        response = self.run_middleware(lambda request: HttpResponse(
+            User.objects.count()))
+        self.assertTrue(response['X-SQL-Stats'].startswith('queries=1; time='))
+        self.assertTrue(response['X-SQL-Stats'].endswith('; repeated=0'))
+
+    @override_settings(SQL_STATS_HEADER=False)
+    def test_no_header(self):
+        response = self.run_middleware(lambda request: HttpResponse())
+        self.assertFalse(response.has_header('X-SQL-Stats'))
+
+    @override_settings(SQL_STATS_HEADER=True, SQL_REPEATED_QUERY_BUDGET=5)
+    def test_repeated_queries_are_logged(self):
+        with self.assertLogs('website.middleware', 'WARNING') as logs:
+            response = self.run_middleware(self.per_row_view)
+        self.assertTrue(response['X-SQL-Stats'].endswith('; repeated=8'))
+        self.assertIn('GET /question/1/ over the SQL budget: 8 times SELECT',
+                      logs.output[0])
+
+    @override_settings(SQL_QUERY_BUDGET=5, SQL_REPEATED_QUERY_BUDGET=100)
+    def test_query_budget(self):
+        with self.assertLogs('website.middleware', 'WARNING') as logs:
+            self.run_middleware(self.per_row_view)
+        self.assertIn('over the SQL budget: 9 queries', logs.output[0])
+
+    def test_within_budget(self):
+        with mock.patch('website.middleware.logger') as logger:
+            self.run_middleware(lambda request: HttpResponse(
+                User.objects.count()))
+        logger.warning.assert_not_called()
+
+
+class ProfilerMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.user = User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+        category = FossCategory.objects.create(name='TestCategory', email='category@example.com')
+        cls.question = Question.objects.create(user=cls.user, category=category,
+                                               title='TestQuestion', body='TestBody')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='admin', password='admin')
+
+    def profile(self, mode=''):
+        return self.client.get(reverse('website:get_question', args=[self.question.id]),
+                               {'profile': mode})
+
+    def test_text(self):
+        response = self.profile()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertTrue(text.startswith('GET /question/{0}/?profile= -> 200'.format(
+            self.question.id)))
+        for part in ['total', 'sql', 'orm', 'templates', 'spam filter']:
+            self.assertRegex(text, r'\n{0} +\d+\.\d ms'.format(part))
+        self.assertIn('cumulative', text)
+        self.assertRegex(response['X-Profile-Breakdown'],
+                         r'^total=[\d.]+ms; sql=[\d.]+ms; orm=[\d.]+ms; templates=[\d.]+ms')
+
+    def test_pstats(self):
+        response = self.profile('pstats')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="profile.pstats"')
+        stats = marshal.loads(response.content)
+        self.assertTrue(any(name == 'get_question' for _, _, name in stats))
+
+    def test_flamegraph(self):
+        with override_settings(PROFILER_SAMPLE_INTERVAL=0.0001):
+            response = self.profile('flamegraph')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="profile.folded"')
+        lines = response.content.decode().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r'^[^ ].*\) \d+$')
+        self.assertIn('X-Profile-Breakdown', response)
+
+    def test_unknown_mode(self):
+        self.assertEqual(self.profile('callgrind').status_code, 400)
+
+    def test_only_superusers(self):
+        self.client.login(username='johndoe', password='johndoe')
+        response = self.profile()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertNotIn('X-Profile-Breakdown', response)
+
+
 class EditQuestionViewTest(TestCase):
 
     @classmethod
@@ -2586,6 +3045,56 @@ class UserNotificationsViewTest(TestCase):
         self.assertQuerysetEqual(response.context['notifications'],
                                  ['<Notification: {0}>'.format(notification_id)])
 
+class UserNotificationsPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create sample notifications on answers and comments"""
+        user = User.objects.create_user("johndoe", "johndoe@example.com", "johndoe", first_name="John", last_name="John")
+        user2 = User.objects.create_user("johndoe2", "johndoe2@example.com", "johndoe2")
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        question = Question.objects.create(user=user, category=category, title="TestQuestion")
+        for i in range(3):
+            answer = Answer.objects.create(question=question, uid=user2.id, body="TestAnswer{0}".format(i))
+            comment = AnswerComment.objects.create(answer=answer, uid=user2.id, body="TestComment{0}".format(i))
+            Notification.objects.create(uid=user.id, qid=question.id, aid=answer.id)
+            Notification.objects.create(uid=user.id, qid=question.id, aid=answer.id, cid=comment.id)
+
+    @override_settings(NOTIFICATIONS_PER_PAGE=4)
+    def test_view_paginates_notifications(self):
+        self.client.login(username='johndoe', password='johndoe')
+        user_id = User.objects.get(username='johndoe').id
+        response = self.client.get(reverse('website:user_notifications', args=(user_id, )))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['notifications']), 4)
+        response = self.client.get(reverse('website:user_notifications', args=(user_id, )), {'page': 2})
+        self.assertEqual(len(response.context['notifications']), 2)
+
+    def test_view_resolves_notification_objects(self):
+        self.client.login(username='johndoe', password='johndoe')
+        user_id = User.objects.get(username='johndoe').id
+        response = self.client.get(reverse('website:user_notifications', args=(user_id, )))
+        for notification in response.context['notifications']:
+            self.assertEqual(notification.question.id, notification.qid)
+            self.assertEqual(notification.answer.id, notification.aid)
+            if notification.cid:
+                self.assertEqual(notification.comment.id, notification.cid)
+            else:
+                self.assertIsNone(notification.comment)
+        self.assertContains(response, 'TestQuestion', count=6)
+
+    def test_view_queries_independent_of_notification_count(self):
+        self.client.login(username='johndoe', password='johndoe')
+        user_id = User.objects.get(username='johndoe').id
+        url = reverse('website:user_notifications', args=(user_id, ))
+        with self.settings(NOTIFICATIONS_PER_PAGE=1):
+            with CaptureQueriesContext(connection) as one_row:
+                self.client.get(url)
+        with self.settings(NOTIFICATIONS_PER_PAGE=6):
+            with CaptureQueriesContext(connection) as six_rows:
+                self.client.get(url)
+        self.assertEqual(len(one_row), len(six_rows))
+
 class ClearNotificationsViewTest(TestCase):
 
     @classmethod
@@ -2735,6 +3244,132 @@ class AjaxNotificationRemoveViewTest(TestCase):
                                     {'notification_id': notification_id})
         self.assertContains(response, 'removed')
 
+class NotificationCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create sample question, answer and notifications"""
+        user = User.objects.create_user("johndoe", "johndoe@example.com", "johndoe", first_name="John", last_name="John")
+        user2 = User.objects.create_user("johndoe2", "johndoe2@example.com", "johndoe2")
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        question = Question.objects.create(user=user, category=category, title="TestQuestion")
+        answer = Answer.objects.create(question=question, uid=user2.id, body="TestAnswer")
+        Notification.objects.create(uid=user.id, qid=question.id, aid=answer.id)
+        Notification.objects.create(uid=user.id, qid=question.id, aid=answer.id)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_count_is_cached(self):
+        user_id = User.objects.get(username='johndoe').id
+        self.assertEqual(notification_count(user_id), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(notification_count(user_id), 2)
+
+    def test_count_incremented_by_new_answer(self):
+        user = User.objects.get(username='johndoe')
+        user2 = User.objects.get(username='johndoe2')
+        self.assertEqual(notification_count(user.id), 2)
+        question = Question.objects.get(title='TestQuestion')
+        answer = Answer.objects.create(question=question, uid=user2.id, body="TestAnswer2", notif_flag=1)
+        send_answer_notification(user2, answer)
+        with self.assertNumQueries(0):
+            self.assertEqual(notification_count(user.id), 3)
+
+    def test_count_decremented_by_notification_remove(self):
+        self.client.login(username='johndoe', password='johndoe')
+        user_id = User.objects.get(username='johndoe').id
+        self.assertEqual(notification_count(user_id), 2)
+        notification_id = Notification.objects.filter(uid=user_id)[0].id
+        self.client.post(reverse('website:ajax_notification_remove'),
+                         {'notification_id': notification_id})
+        with self.assertNumQueries(0):
+            self.assertEqual(notification_count(user_id), 1)
+
+    def test_count_reset_by_clear_notifications(self):
+        self.client.login(username='johndoe', password='johndoe')
+        user_id = User.objects.get(username='johndoe').id
+        self.assertEqual(notification_count(user_id), 2)
+        self.client.get(reverse('website:clear_notifications'))
+        self.assertEqual(notification_count(user_id), 0)
+
+class EmailDigestTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a thread with a participant who opted into a digest"""
+        user = User.objects.create_user("johndoe", "johndoe@example.com", "johndoe", first_name="John", last_name="John")
+        user2 = User.objects.create_user("johndoe2", "johndoe2@example.com", "johndoe2")
+        user3 = User.objects.create_user("johndoe3", "johndoe3@example.com", "johndoe3")
+        Profile.objects.create(user=user, email_digest='hourly')
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        question = Question.objects.create(user=user, category=category, title="TestQuestion")
+        Answer.objects.create(question=question, uid=user3.id, body="TestAnswer")
+
+    def post_answer(self):
+        user2 = User.objects.get(username='johndoe2')
+        question = Question.objects.get(title='TestQuestion')
+        answer = Answer.objects.create(question=question, uid=user2.id, body="TestAnswer2", notif_flag=1)
+        send_answer_notification(user2, answer)
+
+    def test_digest_user_not_mailed_immediately(self):
+        self.post_answer()
+        recipients = [to for email in mail.outbox for to in email.to]
+        self.assertNotIn('johndoe@example.com', recipients)
+        self.assertIn('johndoe3@example.com', recipients)
+        user_id = User.objects.get(username='johndoe').id
+        self.assertEqual(DigestEvent.objects.filter(uid=user_id).count(), 1)
+
+    def test_no_email_without_recipients(self):
+        # The email to the question author, on a digest, is not sent to the
+        # BCC address alone
+        self.post_answer()
+        self.assertEqual([email.subject for email in mail.outbox if not email.to], [])
+        self.assertNotIn('Your question has been Answered',
+                         ' '.join(email.subject for email in mail.outbox))
+
+    def test_users_sharing_an_email(self):
+        # A second account with the address of the digest user, in the thread
+        user4 = User.objects.create_user("johndoe4", "johndoe@example.com", "johndoe4")
+        question = Question.objects.get(title='TestQuestion')
+        Answer.objects.create(question=question, uid=user4.id, body="TestAnswer4")
+        self.post_answer()
+        self.assertIn(['johndoe@example.com'], [email.to for email in mail.outbox])
+        self.assertEqual(list(DigestEvent.objects.values_list('uid', flat=True)),
+                         [User.objects.get(username='johndoe').id])
+
+    def test_send_digests(self):
+        self.post_answer()
+        self.post_answer()
+        mail.outbox = []
+        self.assertEqual(send_digests('daily'), 0)
+        self.assertEqual(send_digests('hourly'), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['johndoe@example.com'])
+        self.assertIn('2 new notifications', mail.outbox[0].subject)
+        self.assertFalse(DigestEvent.objects.exists())
+
+    def test_failed_digests_kept(self):
+        self.post_answer()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=OSError('Connection refused')):
+            self.assertEqual(send_digests('hourly'), 0)
+        self.assertEqual(DigestEvent.objects.count(), 1)
+        # Sent with the next digest
+        self.assertEqual(send_digests('hourly'), 1)
+        self.assertFalse(DigestEvent.objects.exists())
+
+    def test_switch_to_immediate_flushes_digest(self):
+        self.post_answer()
+        mail.outbox = []
+        self.client.login(username='johndoe', password='johndoe')
+        self.client.post(reverse('profile'), {'first_name': 'John', 'last_name': 'John',
+                                              'address': '', 'phone': '',
+                                              'email_digest': 'immediate'})
+        self.assertEqual(Profile.objects.get(user__username='johndoe').email_digest, 'immediate')
+        self.assertEqual([email.to for email in mail.outbox], [['johndoe@example.com']])
+        self.assertFalse(DigestEvent.objects.exists())
+
 class AjaxKeywordSearchViewTest(TestCase):
 
     @classmethod
@@ -2967,4 +3602,153 @@ class AjaxAnsVotePostViewTest(TestCase):
         self.client.post(reverse('website:ajax_ans_vote_post'),
                          {'id': answer.id, 'action': 'recall-vote', 'type': 'down'})
         answer_votes = Answer.objects.get(body='TestAnswerBody').num_votes
-        self.assertEqual(answer_votes, 0)
\ No newline at end of file
+        self.assertEqual(answer_votes, 0)
+
+
+def fake_score(texts):
+    return ["Spam" if 'spam' in text else "Not Spam" for text in texts]
+
+
+class SpamFilterCascadeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user('johndoe', 'johndoe@example.com', 'johndoe')
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('website.spamFilter.score', side_effect=fake_score)
+        self.score = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hits(self, stage):
+        return spamFilter.cascade_stats().get(stage, {}).get('hits', 0)
+
+    def test_links_rejected_before_model(self):
+        hits = self.hits('links')
+        self.assertEqual(spamFilter.predict('see <a href="/x">this</a>'), "Spam")
+        self.assertEqual(spamFilter.predict('visit HTTPS://example.com'), "Spam")
+        self.assertEqual(self.hits('links'), hits + 2)
+        self.score.assert_not_called()
+
+    def test_known_spam_not_scored_again(self):
+        self.assertEqual(spamFilter.predict('Buy spam now, cheap and fast'), "Spam")
+        self.assertEqual(self.score.call_count, 1)
+        hits = self.hits('known spam')
+        self.assertEqual(spamFilter.predict('  buy SPAM\nnow, cheap and  FAST '), "Spam")
+        self.assertEqual(self.score.call_count, 1)
+        self.assertEqual(self.hits('known spam'), hits + 1)
+
+    def test_short_spam_scored_again(self):
+        # Too short to tell its reposts from unrelated posts
+        self.assertEqual(spamFilter.predict('buy spam'), "Spam")
+        self.assertEqual(spamFilter.predict('buy spam'), "Spam")
+        self.assertEqual(self.score.call_count, 2)
+        self.assertFalse(spamFilter.is_known_spam(''))
+
+    def test_repeated_characters(self):
+        self.assertEqual(spamFilter.predict('hiiiiiiiiiiiiiiiiiiii!!!!!!!!!!!!!!!!!!!!'), "Spam")
+        self.score.assert_not_called()
+        code = 'for i in range(10):\n        print(i)  # ====='
+        self.assertEqual(spamFilter.predict(code), "Not Spam")
+        # Short texts are left to the model
+        self.assertEqual(spamFilter.predict('hmmmm'), "Not Spam")
+        self.assertEqual(self.score.call_count, 2)
+
+    @override_settings(SPAM_VELOCITY_LIMIT=2)
+    def test_velocity(self):
+        user = User.objects.get(username='johndoe')
+        self.assertEqual(spamFilter.predict('a question', user), "Not Spam")
+        self.assertEqual(spamFilter.predict('an answer', user), "Not Spam")
+        # Logged, but left to the model
+        with self.assertLogs('website.spamFilter', 'WARNING'):
+            self.assertEqual(spamFilter.predict('a comment', user), "Not Spam")
+        self.assertEqual(spamFilter.predict('buy spam', user), "Spam")
+        self.assertEqual(self.score.call_count, 4)
+
+    @override_settings(SPAM_VELOCITY_LIMIT=1)
+    def test_velocity_moderators_not_logged(self):
+        user = User.objects.get(username='johndoe')
+        user.groups.add(Group.objects.create(name='forum_moderator'))
+        with mock.patch('website.spamFilter.logger') as logger:
+            for _ in range(3):
+                spamFilter.predict('an answer', user)
+        logger.warning.assert_not_called()
+
+    def test_stats(self):
+        spamFilter.predict('a question')
+        stats = spamFilter.cascade_stats()
+        for stage in ['links', 'known spam', 'repeated characters', 'velocity', 'model']:
+            self.assertGreater(stats[stage]['checked'], 0)
+            self.assertLessEqual(stats[stage]['hit_rate'], 1)
+
+    def test_known_spam_from_database(self):
+        user = User.objects.get(username='johndoe')
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        question = Question.objects.create(user=user, category=category, title="TestQuestion",
+                                           body="<p>Cheap watches for sale</p>", is_spam=True)
+        # A comment with the same text is spam without scoring it
+        self.assertEqual(spamFilter.predict('cheap   watches for SALE'), "Spam")
+        self.score.assert_not_called()
+        # Approving the question invalidates the cached lookup
+        question.is_spam = False
+        question.save()
+        self.assertEqual(spamFilter.predict('cheap watches for sale'), "Not Spam")
+        self.assertEqual(self.score.call_count, 1)
+
+
+@override_settings(RATE_LIMITS={'question': (2, 3600), 'answer': (2, 3600), 'comment': (2, 3600)})
+class RateLimitTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user("johndoe", "johndoe@example.com", "johndoe",
+                                        first_name="John", last_name="Doe")
+        category = FossCategory.objects.create(name="TestCategory", email="category@example.com")
+        question = Question.objects.create(user=user, category=category, title="TestQuestion")
+        Answer.objects.create(question=question, uid=user.id, body="TestAnswer")
+        mod1 = User.objects.create_user('mod1', 'mod1@example.com', 'mod1')
+        group1 = Group.objects.create(name="TestCategory Group")
+        ModeratorGroup.objects.create(group=group1, category=category)
+        mod1.groups.add(group1)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('website:answer_comment',
+                           args=(Answer.objects.get(body="TestAnswer").id,))
+
+    @mock.patch('website.views.predict', return_value="Not Spam")
+    def test_posts_over_limit_rejected(self, predict):
+        self.client.login(username='johndoe', password='johndoe')
+        for i in range(2):
+            response = self.client.post(self.url, {'body': 'Test comment {0}'.format(i)})
+            self.assertEqual(response.status_code, 302)
+        # Rejected after loading the session, the user and its permissions
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, {'body': 'Test comment 2'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(AnswerComment.objects.count(), 2)
+        # Other actions have their own limit
+        self.assertEqual(rate_limit_count('question', User.objects.get(username='johndoe').id,
+                                          3600, time.time()), 0)
+
+    def test_get_not_limited(self):
+        self.client.login(username='johndoe', password='johndoe')
+        for i in range(3):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 302)
+
+    @mock.patch('website.views.predict', return_value="Not Spam")
+    def test_moderator_not_limited(self, predict):
+        self.client.login(username='mod1', password='mod1')
+        for i in range(3):
+            response = self.client.post(self.url, {'body': 'Test comment {0}'.format(i)})
+            self.assertNotEqual(response.status_code, 429)
+
+    def test_sliding_window(self):
+        cache.set('rate_limit_comment_1_9', 4)
+        cache.set('rate_limit_comment_1_10', 1)
+        # A quarter of the current hour has passed, so three quarters of the
+        # previous hour are still within the window
+        self.assertEqual(rate_limit_count('comment', 1, 3600, 3600 * 10 + 900), 4)
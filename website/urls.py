@@ -47,7 +47,13 @@ urlpatterns = [
     path('moderator/deactivate/', views.moderator_deactivate, name='moderator_deactivate'),
     path('moderator/questions/', views.moderator_questions, name='moderator_questions'),
     path('moderator/unanswered/', views.moderator_unanswered, name='moderator_unanswered'),
+    path('moderator/fingerprint/<str:fingerprint>/', views.moderator_fingerprint, name='moderator_fingerprint'),
+    path('moderator/review/', views.moderator_review, name='moderator_review'),
     path('moderator/train_spam_filter/', views.train_spam_filter, name='train_spam_filter'),
+    path('moderator/train_spam_filter/status/', views.train_spam_filter_status, name='train_spam_filter_status'),
+
+    # Monitoring
+    path('metrics', views.export_metrics, name='metrics'),
 
 
     # AJAX
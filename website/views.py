@@ -4,9 +4,6 @@ from datetime import date, datetime, timedelta
 from django.utils import timezone
 
 
-# third-party
-import openpyxl
-
 # Django
 from django import forms
 from django.conf import settings
@@ -14,30 +11,51 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import Group, User
-from django.core import mail
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
-from django.db.models import Q
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect,
+    JsonResponse)
 from django.shortcuts import get_object_or_404, render
+from django.template import Context
 from django.template.context_processors import csrf
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.urls import Resolver404, resolve
 from django.utils.html import strip_tags
+from django.utils.safestring import mark_safe
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 # local Django
-from .auto_mail_send import Cron
-from .decorators import check_recaptcha
+from . import metrics
+from .decorators import (
+    anonymous_page_cache, check_recaptcha, code_stamp, conditional_page,
+    page_csrf, rate_limit,
+)
+from .deferred import on_commit
+from .digest import batch_emails, deliver, queue_digest
 from .forms import AnswerCommentForm, AnswerQuestionForm, NewQuestionForm
 from .models import (
-    Answer, AnswerComment, FossCategory, ModeratorGroup,
-    Notification, Question, Scheduled_Auto_Mail, SubFossCategory,
+    Answer, AnswerComment, FossCategory,
+    Notification, Question, Scheduled_Auto_Mail, SpamFilterTraining,
+    SubFossCategory, fingerprint_key, load_users, touch_posts,
+)
+from .notifications import (
+    decr_notification_count, incr_notification_count, reset_notification_count,
 )
-from .spamFilter import predict, train
+from .permissions import get_permissions
+from .spamFilter import predict, start_training
 from .templatetags.helpers import prettify
 
 User = get_user_model()
-admins = User.objects.filter(is_superuser=True).values_list('id')
+
+notification_fanout = metrics.histogram(
+    'forum_notification_fanout',
+    'Users notified of a new post in a thread.', ['post'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
 
 
 # NON-VIEWS FUNCTIONS
@@ -57,11 +75,165 @@ def is_moderator(user, question=None):
     Return True if the user is a moderator of any category,
     if question is not provided.
     """
+    permissions = get_permissions(user)
     if question:
-        return (user.groups.filter(name="forum_moderator").exists() or
-                user.groups.filter(moderatorgroup=get_object_or_404(
-                    ModeratorGroup, category=question.category)).exists())
-    return user.groups.count() > 0
+        return permissions.moderates(question.category_id)
+    return permissions.is_moderator
+
+
+def moderated_categories(user):
+    """Return the unhidden categories moderated by the user."""
+    return FossCategory.objects.filter(
+        id__in=get_permissions(user).category_ids, hidden=False)
+
+
+def question_rows(questions):
+    """
+    Return the questions with their category, their user and the number of
+    their answers (answer_count: active and non-spam ones, all_answer_count:
+    all of them), so that the rows of the tables of questions do not run any
+    query.
+    """
+    return questions.select_related('category', 'user').annotate(
+        answer_count=Count('answer', filter=Q(
+            answer__is_active=True, answer__is_spam=False)),
+        all_answer_count=Count('answer'))
+
+
+# Put in the rows in the place of the views count, it cannot come from the
+# escaped text of a question
+QUESTION_VIEWS_PLACEHOLDER = mark_safe('<!--views-->')
+
+
+def question_row_key(template_name, context, question_id, version):
+    variant = ','.join('{0}={1}'.format(name, value)
+                       for name, value in sorted(context.items()))
+    return 'question_row_{0}_{1}_{2}_{3}_{4}'.format(
+        template_name, variant, code_stamp().timestamp(), question_id,
+        version.timestamp())
+
+
+def question_row_html(questions, template_name, context=None):
+    """
+    Return the HTML of the rows of the questions in a table of questions,
+    rendered with the template and the context (the same for every row, made
+    of a few flags). The rows are cached under the version stamp of their
+    question, and only those of new or changed questions are rendered, from
+    question_rows(). The views, counted without a change of the version, are
+    left out of the cached rows and put in afterwards.
+    """
+    context = context or {}
+    versions = list(questions.values_list('id', 'last_activity', 'views'))
+    keys = [question_row_key(template_name, context, question_id, version)
+            for question_id, version, _ in versions]
+    rows = cache.get_many(keys)
+    missing = {question_id: key for (question_id, _, _), key in zip(versions, keys)
+               if key not in rows}
+    if missing:
+        # A few rows are looked up by id, the first render of the table
+        # runs the query of the listing
+        if len(missing) <= settings.QUESTION_ROW_BATCH_SIZE:
+            changed = Question.objects.filter(id__in=list(missing))
+        else:
+            changed = questions
+        # The template of the engine renders every row in the same Context
+        template = get_template(template_name).template
+        row_context = Context(dict(context, views=QUESTION_VIEWS_PLACEHOLDER),
+                              autoescape=template.engine.autoescape)
+        rendered = {}
+        for question in question_rows(changed):
+            if question.id in missing:
+                with row_context.push(question=question):
+                    rendered[missing[question.id]] = template.render(
+                        row_context)
+        cache.set_many(rendered, settings.QUESTION_ROW_TIMEOUT)
+        rows.update(rendered)
+    return [mark_safe(rows[key].replace(QUESTION_VIEWS_PLACEHOLDER, str(views)))
+            for (_, _, views), key in zip(versions, keys) if key in rows]
+
+
+def with_question_flag(categories):
+    """
+    Return the categories with has_questions, True for those with an active
+    question, for the latest_question tag.
+    """
+    return categories.annotate(has_questions=Exists(Question.objects.filter(
+        category=OuterRef('pk'), is_active=True)))
+
+
+# Moderation actions of the review queue, and their past participle
+REVIEW_ACTIONS = {
+    'approve': 'approved',
+    'spam': 'marked as Spam',
+    'delete': 'deleted',
+}
+
+
+def review_posts(user, action, questions, answers, comments):
+    """
+    Apply a moderation action of the review queue to the posts of the
+    querysets, with one update() per kind of post. Only the posts which
+    change are approved or marked as spam. The emails to their authors are
+    sent, and their labels recorded in DataSet for the retraining of the spam
+    filter, once the response has been sent.
+    Return the number of posts changed.
+    """
+    if action == 'approve':
+        querysets = [posts.filter(is_spam=True)
+                     for posts in (questions, answers, comments)]
+        changes = {'is_spam': False}
+    elif action == 'spam':
+        querysets = [posts.filter(is_spam=False)
+                     for posts in (questions, answers, comments)]
+        changes = {'is_spam': True}
+    else:
+        querysets = [questions, answers, comments]
+        changes = {'is_active': False, 'notif_flag': 3}
+
+    rows = [list(posts.values_list('id', 'fingerprint'))
+            for posts in querysets]
+    ids = [[id for id, _ in post_rows] for post_rows in rows]
+    count = 0
+    uids = set()
+    with transaction.atomic():
+        for model, post_ids in zip((Question, Answer, AnswerComment), ids):
+            if post_ids:
+                count += model.objects.filter(id__in=post_ids).update(
+                    **changes)
+
+        if action == 'delete':
+            # Delete all Notifications related to the answers and comments
+            notifications = Notification.objects.filter(
+                Q(aid__in=ids[1]) | Q(cid__in=ids[2]))
+            uids = set(notifications.values_list('uid', flat=True))
+            notifications.delete()
+        on_commit(send_review_notifications, user, action, *ids)
+
+    reset_notification_count(*uids)
+    # update() does not send the post_save signal
+    cache.delete_many([fingerprint_key(fingerprint)
+                       for post_rows in rows for _, fingerprint in post_rows
+                       if fingerprint])
+    touch_posts(*ids)
+    return count
+
+
+def training_status(job):
+    """Return the progress of a SpamFilterTraining as a dictionary."""
+    if job is None:
+        return {'status': None}
+    return {
+        'id': job.id,
+        'status': job.status,
+        'date_created': job.date_created,
+        'date_started': job.date_started,
+        'date_finished': job.date_finished,
+        'samples': job.samples,
+        'f_score': job.f_score,
+        'precision': job.precision,
+        'recall': job.recall,
+        'error': job.error,
+    }
 
 
 def to_uids(question):
@@ -69,15 +241,12 @@ def to_uids(question):
     Return a set of user ids of all the people linked to the Question,
     i.e., User IDs of Question, Answers and Comments' Authors.
     """
-    mail_uids = [question.user.id]
-    answers = Answer.objects.filter(question_id=question.id,
-                                    is_active=True).distinct()
-    for answer in answers:
-        for comment in AnswerComment.objects.values('uid').filter(
-                answer=answer, is_active=True).distinct():
-            mail_uids.append(comment['uid'])
-        mail_uids.append(answer.uid)
-    mail_uids = set(mail_uids)
+    mail_uids = {question.user_id}
+    mail_uids.update(Answer.objects.filter(
+        question_id=question.id, is_active=True).values_list('uid', flat=True))
+    mail_uids.update(AnswerComment.objects.filter(
+        answer__question_id=question.id, answer__is_active=True,
+        is_active=True).values_list('uid', flat=True))
     return mail_uids
 
 
@@ -104,13 +273,26 @@ def get_user_email(uid):
     return user.email
 
 
+def get_user_emails(uids):
+    """Return the emails of the users, in one query."""
+    return list(User.objects.filter(id__in=uids).values_list(
+        'email', flat=True))
+
+
 def send_email(subject, plain_message, html_message, from_email, to,
-               bcc=None, cc=None, reply_to=None):
+               bcc=None, cc=None, reply_to=None, digest_uids=None):
     """
     Send Emails to Everyone in the 'to' list, 'bcc' list, and 'cc' list.
     The Email IDs of everyone in the 'to' list and 'cc' list will be
     visible to the recipents of the email.
+    The users in digest_uids get the email too, in their next digest if
+    they opted into an email digest. Nothing is sent if no one is left.
     """
+    if digest_uids:
+        to = to + get_user_emails(
+            queue_digest(subject, html_message, digest_uids))
+    if not to and not cc:
+        return
     if bcc is None:
         bcc = [settings.BCC_EMAIL_ID]
     else:
@@ -130,18 +312,23 @@ def send_email(subject, plain_message, html_message, from_email, to,
     # if you are sending attachment with content id,
     # subtype must be 'related'.
     # email.mixed_subtype = 'related'
-    email.send(fail_silently=True)
+    deliver([email])
 
 
 def send_email_as_to(subject, plain_message, html_message,
-                     from_email, to, reply_to=None):
-    """Send Emails to everyone in the 'to' list individually."""
-    # The connection to be used for sending the emails so that
-    # all the emails can be sent by opening a single connection.
-    connection = mail.get_connection(fail_silently=True)
+                     from_email, to, reply_to=None, digest_uids=None):
+    """
+    Send Emails to everyone in the 'to' list individually.
+    The users in digest_uids get the email too, in their next digest if
+    they opted into an email digest. Nothing is sent if no one is left.
+    """
+    if digest_uids:
+        to = to + get_user_emails(
+            queue_digest(subject, html_message, digest_uids))
+    if not to:
+        return
     messages = []
-    to.append(settings.BCC_EMAIL_ID)
-    for to_email in to:
+    for to_email in to + [settings.BCC_EMAIL_ID]:
         email = EmailMultiAlternatives(
             subject,
             plain_message,
@@ -152,7 +339,8 @@ def send_email_as_to(subject, plain_message, html_message,
         )
         email.attach_alternative(html_message, "text/html")
         messages.append(email)
-    connection.send_messages(messages)
+    # All the emails are sent by opening a single connection.
+    deliver(messages)
 
 
 def can_delete_comment(answer, comment_id):
@@ -172,17 +360,31 @@ def process_Spam(content_body, is_spam):
     in DataSet. Add the question body and the corresponding value of is_spam in
     DataSet, otherwise.
     """
+    process_Spam_bulk([(content_body, is_spam)])
+
+
+def process_Spam_bulk(labels):
+    """
+    Record the (content_body, is_spam) pairs in DataSet as process_Spam()
+    does, reading and saving DataSet only once.
+    """
+    import openpyxl
+
     file_location = settings.BASE_DIR + '/Spam_Filter_Data/DataSet.xlsx'
     xfile = openpyxl.load_workbook(file_location)
     sheet = xfile['Data set']
     n = len(sheet['A']) + 1
+    rows = {}
     for i in range(2, n):
-        if(content_body == str(sheet.cell(row=i, column=1).value)):
-            sheet.cell(row=i, column=2).value = is_spam
-            xfile.save(file_location)
-            return
-    sheet['A%s' % n] = content_body
-    sheet['B%s' % n] = is_spam
+        rows.setdefault(str(sheet.cell(row=i, column=1).value), i)
+    for content_body, is_spam in labels:
+        if content_body in rows:
+            sheet.cell(row=rows[content_body], column=2).value = is_spam
+        else:
+            sheet['A%s' % n] = content_body
+            sheet['B%s' % n] = is_spam
+            rows[content_body] = n
+            n += 1
     xfile.save(file_location)
 
 
@@ -201,6 +403,8 @@ def send_remider_mail():
             print("***** Mail already sent on ", sent_date, " *****")
             pass
         else:
+            from .auto_mail_send import Cron
+
             auto_clean_spam()
             a = Cron()
             a.unanswered_notification()
@@ -248,24 +452,61 @@ def moderator_deactivate(request):
         return HttpResponseRedirect('/')
 
 
+def forum_version(request, *args, **kwargs):
+    """Version stamp of the pages listing the questions of all categories."""
+    return FossCategory.objects.aggregate(
+        version=Max('last_activity'))['version']
+
+
+def category_version(request, category=None, tutorial=None):
+    """Version stamp of the pages of the questions of a category."""
+    return FossCategory.objects.filter(name=category).aggregate(
+        version=Max('last_activity'))['version']
+
+
+def question_version(request, question_id=None, pretty_url=None):
+    """Version stamp of a thread, and of its category (hidden or not)."""
+    stamps = Question.objects.filter(id=question_id).values_list(
+        'last_activity', 'category__last_activity').first()
+    return max(stamps) if stamps else None
+
+
+def count_anonymous_view(request, question_id=None, pretty_url=None):
+    """
+    Count the view of a thread answered with 304 Not Modified, or from the
+    page cache.
+    """
+    # The logged in users were counted when the page was first rendered
+    if request.user.is_anonymous:
+        Question.objects.filter(id=question_id).update(views=F('views') + 1)
+
+
 def home(request):
     """Render the index Page of the Website."""
     send_remider_mail()
+    return index(request)
+
 
+@conditional_page(forum_version)
+def index(request):
     if request.session.get('MODERATOR_ACTIVATED', False):
         return HttpResponseRedirect('/moderator/')
 
-    categories = FossCategory.objects.filter(hidden=False).order_by('name')
+    categories = with_question_flag(
+        FossCategory.objects.filter(hidden=False).order_by('name'))
     questions = Question.objects.filter(
         is_spam=False, is_active=True, category__hidden=False,
     ).order_by('-date_created')
     context = {
         'categories': categories,
         'questions': questions,
+        'rows': question_row_html(questions,
+                                  'website/templates/rows/index.html'),
     }
     return render(request, "website/templates/index.html", context)
 
 
+@conditional_page(forum_version)
 def questions(request):
     """Show all the Questions posted till now with Pagination."""
     if request.session.get('MODERATOR_ACTIVATED', False):
@@ -278,10 +519,14 @@ def questions(request):
     context = {
         'categories': categories,
         'questions': questions,
+        'rows': question_row_html(questions,
+                                  'website/templates/rows/questions.html'),
     }
     return render(request, 'website/templates/questions.html', context)
 
 
+@conditional_page(question_version, not_modified=count_anonymous_view)
+@anonymous_page_cache(question_version, cached=count_anonymous_view)
 def get_question(request, question_id=None, pretty_url=None):
     """Show the details of the Question, its Answers and Comments under it."""
     if request.session.get('MODERATOR_ACTIVATED', False):
@@ -311,18 +556,33 @@ def get_question(request, question_id=None, pretty_url=None):
     if question.sub_category == "" or str(question.sub_category) == 'None':
         sub_category = False
 
+    answers = list(answers.prefetch_related('answercomment_set'))
+    load_users(answers + [comment for answer in answers
+                          for comment in answer.answercomment_set.all()])
+
     ans_count = len(answers)  # Includes Spam Answers
     form = AnswerQuestionForm()
     thisuserupvote = question.userUpVotes.filter(id=request.user.id).count()
     thisuserdownvote = question.userDownVotes.filter(
         id=request.user.id).count()
 
+    # Answers voted up and down by the user
+    upvoted = set()
+    downvoted = set()
+    if request.user.is_authenticated and answers:
+        answer_ids = [answer.id for answer in answers]
+        upvoted = set(Answer.userUpVotes.through.objects.filter(
+            user_id=request.user.id, answer_id__in=answer_ids,
+        ).values_list('answer_id', flat=True))
+        downvoted = set(Answer.userDownVotes.through.objects.filter(
+            user_id=request.user.id, answer_id__in=answer_ids,
+        ).values_list('answer_id', flat=True))
+
     ans_votes = []
     for vote in answers:
         net_ans_count = vote.num_votes
-        ans_votes.append([vote.userUpVotes.filter(id=request.user.id).count(
-        ), vote.userDownVotes.filter(id=request.user.id).count(),
-            net_ans_count])
+        ans_votes.append([int(vote.id in upvoted), int(vote.id in downvoted),
+                          net_ans_count])
 
     main_list = list(zip(answers, ans_votes))
     context = {
@@ -335,16 +595,16 @@ def get_question(request, question_id=None, pretty_url=None):
         'thisUserDownvote': thisuserdownvote,
         'net_count': question.num_votes,
     }
-    context.update(csrf(request))
+    context.update(page_csrf(request))
 
-    # updating views count
-    if (request.user.is_anonymous):  # if no one logged in
-        question.views += 1
-    elif (question.userViews.filter(id=request.user.id).count() == 0):
+    # updating views count, with update() so that the version stamp of the
+    # question is kept
+    if (request.user.is_anonymous or  # if no one logged in
+            question.userViews.filter(id=request.user.id).count() == 0):
         question.views += 1
-        question.userViews.add(request.user)
-
-    question.save()
+        Question.objects.filter(id=question.id).update(views=F('views') + 1)
+        if request.user.is_authenticated:
+            question.userViews.add(request.user)
 
     context['SITE_KEY'] = settings.GOOGLE_RECAPTCHA_SITE_KEY
     return render(request, 'website/templates/get-question.html', context)
@@ -353,6 +613,7 @@ def get_question(request, question_id=None, pretty_url=None):
 # post a new question on to forums, notification is sent to mailing list
 # team@fossee.in
 @login_required
+@rate_limit('question')
 @user_passes_test(account_credentials_defined, login_url='/accounts/profile/')
 def new_question(request):
     """Render the page to post a new question onto the forum."""
@@ -394,21 +655,23 @@ def new_question(request):
             question.title = cleaned_data['title']
             question.body = cleaned_data['body']
             question.views = 1
-            question.save()
-
-            question.userViews.add(request.user)
             if (str(question.sub_category) == 'None'):
                 question.sub_category = ""
-            if (predict(question.body) == "Spam"):
+            if (predict(question.body, request.user) == "Spam"):
                 question.is_spam = True
             question.notif_flag = 1
-            question.save()
 
-            # Sending email when a new question is asked
-            if question.is_spam:
-                send_spam_question_notification(request.user, question)
-            else:
-                send_question_notification(request.user, question)
+            with transaction.atomic():
+                question.save()
+                question.userViews.add(request.user)
+
+                # Sending email when a new question is asked
+                if question.is_spam:
+                    on_commit(send_spam_question_notification,
+                              request.user, question)
+                else:
+                    on_commit(send_question_notification,
+                              request.user, question)
 
             return HttpResponseRedirect('/question/{0}/'.format(question.id))
 
@@ -435,6 +698,7 @@ def new_question(request):
 
 
 @login_required
+@rate_limit('answer')
 @check_recaptcha
 @user_passes_test(account_credentials_defined, login_url='/accounts/profile/')
 def question_answer(request, question_id):
@@ -460,16 +724,19 @@ def question_answer(request, question_id):
             answer.body = body
             if ('image' in request.FILES):
                 answer.image = request.FILES['image']
-            if (predict(answer.body) == "Spam"):
+            if (predict(answer.body, request.user) == "Spam"):
                 answer.is_spam = True
             answer.notif_flag = 1
-            answer.save()
 
-            # SENDING EMAILS AND NOTIFICATIONS ABOUT NEW ANSWER
-            if answer.is_spam:
-                send_spam_answer_notification(request.user, answer)
-            else:
-                send_answer_notification(request.user, answer)
+            with transaction.atomic():
+                answer.save()
+
+                # SENDING EMAILS AND NOTIFICATIONS ABOUT NEW ANSWER
+                if answer.is_spam:
+                    on_commit(send_spam_answer_notification,
+                              request.user, answer)
+                else:
+                    on_commit(send_answer_notification, request.user, answer)
 
             return HttpResponseRedirect('/question/{0}/'.format(question_id))
 
@@ -485,6 +752,7 @@ def question_answer(request, question_id):
 
 
 @login_required
+@rate_limit('comment')
 @user_passes_test(account_credentials_defined, login_url='/accounts/profile/')
 def answer_comment(request, answer_id):
     """Post a comment on an answer to a question asked on the forum."""
@@ -505,16 +773,20 @@ def answer_comment(request, answer_id):
             body = request.POST['body']
             comment = AnswerComment(
                 uid=request.user.id, answer=answer, body=body)
-            if (predict(comment.body) == "Spam"):
+            if (predict(comment.body, request.user) == "Spam"):
                 comment.is_spam = True
             comment.notif_flag = 1
-            comment.save()
 
-            # SENDING EMAILS AND NOTIFICATIONS ABOUT NEW COMMENT
-            if comment.is_spam:
-                send_spam_comment_notification(request.user, comment)
-            else:
-                send_comment_notification(request.user, comment)
+            with transaction.atomic():
+                comment.save()
+
+                # SENDING EMAILS AND NOTIFICATIONS ABOUT NEW COMMENT
+                if comment.is_spam:
+                    on_commit(send_spam_comment_notification,
+                              request.user, comment)
+                else:
+                    on_commit(send_comment_notification,
+                              request.user, comment)
 
             return HttpResponseRedirect('/question/{0}/'.format(question.id))
 
@@ -834,7 +1106,9 @@ def answer_delete(request, answer_id):
 
         # Delete all Notifications related to it
         notifications = Notification.objects.filter(aid=answer.id)
+        uids = set(notifications.values_list('uid', flat=True))
         notifications.delete()
+        reset_notification_count(*uids)
 
         # Sending Emails for Answer Delete
         delete_reason = request.POST.get('deleteAnswer', None)
@@ -871,7 +1145,9 @@ def comment_delete(request, comment_id):
 
         # Delete all Notifications related to it
         notifications = Notification.objects.filter(cid=comment.id)
+        uids = set(notifications.values_list('uid', flat=True))
         notifications.delete()
+        reset_notification_count(*uids)
 
         # Sending notifications
         delete_reason = request.POST.get('deleteComment', None)
@@ -1077,6 +1353,7 @@ def search(request):
     return render(request, 'website/templates/search.html', context)
 
 
+@conditional_page(category_version)
 def filter(request, category=None, tutorial=None):
     """Filter Questions based on the category and
        tutorial (sub-category) provided as arguments."""
@@ -1090,11 +1367,15 @@ def filter(request, category=None, tutorial=None):
             category__name=category,
             category__hidden=False).order_by('-date_created')
 
-    if (not request.session.get('MODERATOR_ACTIVATED', False)):
+    moderator_activated = request.session.get('MODERATOR_ACTIVATED', False)
+    if (not moderator_activated):
         questions = questions.filter(is_spam=False, is_active=True)
 
     context = {
         'questions': questions,
+        'rows': question_row_html(
+            questions, 'website/templates/rows/filter.html',
+            {'MODERATOR_ACTIVATED': moderator_activated}),
         'category': category,
         'tutorial': tutorial,
     }
@@ -1114,6 +1395,24 @@ def user_notifications(request, user_id):
         try:
             notifications = Notification.objects.filter(
                 uid=user_id).order_by('-date_created')
+            paginator = Paginator(notifications,
+                                  settings.NOTIFICATIONS_PER_PAGE)
+            notifications = paginator.get_page(request.GET.get('page'))
+
+            # Resolve the Questions, Answers and Comments referred to by the
+            # Notifications on this page in one query each.
+            questions = Question.objects.in_bulk(
+                {notification.qid for notification in notifications})
+            answers = Answer.objects.in_bulk(
+                {notification.aid for notification in notifications})
+            comments = AnswerComment.objects.in_bulk(
+                {notification.cid for notification in notifications
+                 if notification.cid != 0})
+            for notification in notifications:
+                notification.question = questions.get(notification.qid)
+                notification.answer = answers.get(notification.aid)
+                notification.comment = comments.get(notification.cid)
+
             context = {
                 'notifications': notifications,
             }
@@ -1137,6 +1436,7 @@ def clear_notifications(request):
         return HttpResponseRedirect('/moderator/')
 
     Notification.objects.filter(uid=request.user.id).delete()
+    reset_notification_count(request.user.id)
     return HttpResponseRedirect(
         "/user/{0}/notifications/".format(request.user.id))
 
@@ -1151,31 +1451,20 @@ def moderator_home(request):
         return HttpResponseRedirect('/')
 
     # If user is a super moderator
-    if (request.user.groups.filter(name="forum_moderator").exists()):
+    if get_permissions(request.user).is_super_moderator:
         questions = Question.objects.filter(
             category__hidden=False).order_by('-date_created')
         categories = FossCategory.objects.filter(hidden=False).order_by('name')
 
     else:
         # Finding the moderator's categories and Getting the questions related
-        # to moderator's categories
-        categories = []
-        questions = []
-        for group in request.user.groups.all():
-            category = ModeratorGroup.objects.get(group=group).category
-            # Don't include hidden categories
-            if category.hidden:
-                continue
-            categories.append(category)
-            questions.extend(
-                Question.objects.filter(
-                    category__name=category.name).order_by('-date_created'))
-        questions.sort(
-            key=lambda question: question.date_created,
-            reverse=True)
+        # to moderator's categories (hidden categories are not included)
+        categories = moderated_categories(request.user)
+        questions = Question.objects.filter(
+            category__in=categories).order_by('-date_created')
     context = {
-        'questions': questions,
-        'categories': categories,
+        'questions': question_rows(questions),
+        'categories': with_question_flag(categories),
     }
 
     return render(request, 'website/templates/moderator/index.html', context)
@@ -1189,39 +1478,24 @@ def moderator_questions(request):
         return HttpResponseRedirect('/questions/')
 
     # If user is a super moderator
-    if (request.user.groups.filter(name="forum_moderator").exists()):
+    if get_permissions(request.user).is_super_moderator:
         categories = FossCategory.objects.filter(hidden=False).order_by('name')
         questions = Question.objects.filter(
             category__hidden=False).order_by('-date_created')
-        if ('spam' in request.GET):
-            questions = questions.filter(is_spam=True)
-        elif ('non-spam' in request.GET):
-            questions = questions.filter(is_spam=False)
 
     else:
         # Finding the moderator's category questions
-        questions = []
-        categories = []
-        for group in request.user.groups.all():
-            category = ModeratorGroup.objects.get(group=group).category
-            # Don't include hidden categories
-            if category.hidden:
-                continue
-            categories.append(category)
-            questions_to_add = Question.objects.filter(
-                category__name=category.name).order_by('-date_created')
-            if ('spam' in request.GET):
-                questions_to_add = questions_to_add.filter(is_spam=True)
-            elif ('non-spam' in request.GET):
-                questions_to_add = questions_to_add.filter(is_spam=False)
-            questions.extend(questions_to_add)
-        questions.sort(
-            key=lambda question: question.date_created,
-            reverse=True,
-        )
+        categories = moderated_categories(request.user)
+        questions = Question.objects.filter(
+            category__in=categories).order_by('-date_created')
+
+    if ('spam' in request.GET):
+        questions = questions.filter(is_spam=True)
+    elif ('non-spam' in request.GET):
+        questions = questions.filter(is_spam=False)
     context = {
         'categories': categories,
-        'questions': questions,
+        'questions': question_rows(questions),
     }
     return render(
         request,
@@ -1240,32 +1514,19 @@ def moderator_unanswered(request):
         return HttpResponseRedirect('/')
 
     # If user is a super moderator
-    if (request.user.groups.filter(name="forum_moderator").exists()):
+    if get_permissions(request.user).is_super_moderator:
         categories = FossCategory.objects.filter(hidden=False).order_by('name')
         questions = Question.objects.filter(
             is_active=True, category__hidden=False).order_by('-date_created')
 
     else:
         # Finding the moderator's category questions
-        questions = []
-        categories = []
-        for group in request.user.groups.all():
-            category = ModeratorGroup.objects.get(group=group).category
-            # Don't include hidden categories
-            if category.hidden:
-                continue
-            categories.append(category)
-            questions.extend(
-                Question.objects.filter(
-                    category__name=category.name,
-                    is_active=True).order_by('-date_created'))
-        questions.sort(
-            key=lambda question: question.date_created,
-            reverse=True,
-        )
+        categories = moderated_categories(request.user)
+        questions = Question.objects.filter(
+            category__in=categories, is_active=True).order_by('-date_created')
     context = {
         'categories': categories,
-        'questions': questions,
+        'questions': question_rows(questions),
     }
     return render(
         request,
@@ -1275,10 +1536,136 @@ def moderator_unanswered(request):
 
 @login_required
 @user_passes_test(is_moderator)
+def moderator_fingerprint(request, fingerprint):
+    """
+    Display the active posts with the same content (fingerprint) in the
+    Moderator's Categories, and deactivate them all as spam on POST.
+    """
+    if not request.session.get('MODERATOR_ACTIVATED', False):
+        return HttpResponseRedirect('/')
+
+    if get_permissions(request.user).is_super_moderator:
+        categories = FossCategory.objects.filter(hidden=False)
+    else:
+        categories = moderated_categories(request.user)
+    questions = Question.objects.filter(
+        fingerprint=fingerprint, is_active=True, category__in=categories)
+    answers = Answer.objects.filter(
+        fingerprint=fingerprint, is_active=True,
+        question__category__in=categories)
+    comments = AnswerComment.objects.filter(
+        fingerprint=fingerprint, is_active=True,
+        answer__question__category__in=categories)
+
+    if request.method == 'POST':
+        question_ids = list(questions.values_list('id', flat=True))
+        answer_ids = list(answers.values_list('id', flat=True))
+        comment_ids = list(comments.values_list('id', flat=True))
+        count = 0
+        with transaction.atomic():
+            # Marked as spam like from the review queue: their authors are
+            # emailed and their labels recorded for the retraining
+            review_posts(request.user, 'spam', questions, answers, comments)
+            for model, ids in ((Question, question_ids),
+                               (Answer, answer_ids),
+                               (AnswerComment, comment_ids)):
+                count += model.objects.filter(id__in=ids).update(
+                    is_active=False, notif_flag=3)
+        # update() does not send the post_save signal
+        cache.delete(fingerprint_key(fingerprint))
+        touch_posts(question_ids, answer_ids, comment_ids)
+
+        # Delete all Notifications related to them
+        notifications = Notification.objects.filter(
+            Q(aid__in=answer_ids) | Q(cid__in=comment_ids))
+        uids = set(notifications.values_list('uid', flat=True))
+        notifications.delete()
+        reset_notification_count(*uids)
+
+        messages.success(
+            request, "{0} posts deactivated as Spam!".format(count))
+        return HttpResponseRedirect('/moderator/')
+
+    context = {
+        'fingerprint': fingerprint,
+        'questions': questions.select_related('user'),
+        'answers': answers.select_related('question'),
+        'comments': comments.select_related('answer'),
+    }
+    return render(
+        request,
+        'website/templates/moderator/fingerprint.html',
+        context)
+
+
+@login_required
+@user_passes_test(is_moderator)
+def moderator_review(request):
+    """
+    Display the latest active spam (or non-spam) posts of the Moderator's
+    Categories, and approve, mark as spam or delete the selected ones at once.
+    """
+    if not request.session.get('MODERATOR_ACTIVATED', False):
+        return HttpResponseRedirect('/')
+
+    if get_permissions(request.user).is_super_moderator:
+        categories = FossCategory.objects.filter(hidden=False)
+    else:
+        categories = moderated_categories(request.user)
+    questions = Question.objects.filter(
+        is_active=True, category__in=categories, category__disabled=False)
+    answers = Answer.objects.filter(
+        is_active=True, question__category__in=categories,
+        question__category__disabled=False)
+    comments = AnswerComment.objects.filter(
+        is_active=True, answer__question__category__in=categories,
+        answer__question__category__disabled=False)
+
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action not in REVIEW_ACTIONS:
+            messages.error(request, "Unknown action!")
+            return HttpResponseRedirect(request.get_full_path())
+
+        def selected(name):
+            return [id for id in request.POST.getlist(name) if id.isdigit()]
+
+        count = review_posts(
+            request.user, action,
+            questions.filter(id__in=selected('question')),
+            answers.filter(id__in=selected('answer')),
+            comments.filter(id__in=selected('comment')))
+        messages.success(request, "{0} posts {1}!".format(
+            count, REVIEW_ACTIONS[action]))
+        return HttpResponseRedirect(request.get_full_path())
+
+    is_spam = 'non-spam' not in request.GET
+    size = settings.REVIEW_QUEUE_SIZE
+    context = {
+        'is_spam': is_spam,
+        'questions': questions.filter(is_spam=is_spam).select_related(
+            'user', 'category').order_by('-date_created')[:size],
+        'answers': answers.filter(is_spam=is_spam).select_related(
+            'question').order_by('-date_created')[:size],
+        'comments': comments.filter(is_spam=is_spam).select_related(
+            'answer').order_by('-date_created')[:size],
+    }
+    return render(
+        request,
+        'website/templates/moderator/review.html',
+        context)
+
+
+@login_required
+@user_passes_test(is_moderator)
+@require_POST
 def train_spam_filter(request):
-    """Re-train the Spam Filter."""
+    """Start re-training the Spam Filter in the background."""
+    job = start_training(request.user)
+    if request.is_ajax():
+        return JsonResponse(training_status(job))
+
     next = request.GET.get('next', '')
-    train()
     try:
         resolve(next)
         return HttpResponseRedirect(next)
@@ -1286,6 +1673,25 @@ def train_spam_filter(request):
         return HttpResponseRedirect('/moderator/')
 
 
+@login_required
+@user_passes_test(is_moderator)
+def train_spam_filter_status(request):
+    """Return the progress of the latest Spam Filter training as JSON."""
+    job = SpamFilterTraining.objects.order_by('-id').first()
+    return JsonResponse(training_status(job))
+
+
+def export_metrics(request):
+    """
+    Return the metrics of all the processes in the text format of
+    Prometheus, to the addresses of settings.METRICS_ALLOWED_IPS.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(metrics.registry.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # AJAX SECTION
 
 @csrf_exempt
@@ -1322,6 +1728,7 @@ def ajax_notification_remove(request):
             notification = get_object_or_404(Notification, pk=nid)
             if (notification.uid == request.user.id):
                 notification.delete()
+                decr_notification_count(notification.uid)
                 return HttpResponse('removed')
             else:
                 return HttpResponse('Unauthorized user.')
@@ -1351,7 +1758,7 @@ def ajax_keyword_search(request):
             )
         ).distinct().order_by('-date_created')
         context = {
-            'questions': questions
+            'questions': question_rows(questions)
         }
         return render(
             request,
@@ -1525,8 +1932,7 @@ def send_question_notification(
         # Getting emails of everyone in Question Thread and appending in 'to'
         if question.user != user:
             mail_uids = to_uids(question)
-            for uid in mail_uids:
-                to.append(get_user_email(uid))
+            to.extend(get_user_emails(mail_uids))
 
         send_email_as_to(subject, plain_message, html_message, from_email, to)
     # Question Deleted Recently
@@ -1550,8 +1956,7 @@ def send_question_notification(
             to = [question.user.email]
         else:
             mail_uids = to_uids(question)
-            for uid in mail_uids:
-                to.append(get_user_email(uid))
+            to.extend(get_user_emails(mail_uids))
 
         send_email_as_to(subject, plain_message, html_message, from_email, to)
 
@@ -1582,12 +1987,13 @@ def send_answer_notification(user, answer, delete_reason=None):
             notification = Notification(
                 uid=question.user.id, qid=question.id, aid=answer.id)
             notification.save()
+            incr_notification_count(notification.uid)
 
             subject = "FOSSEE Forums - {0} - Your question has been Answered"\
                 .format(
                     question.category)
-            to = [question.user.email]
-            send_email(subject, plain_message, html_message, from_email, to)
+            send_email(subject, plain_message, html_message, from_email, [],
+                       digest_uids=[question.user.id])
 
             not_to_notify.append(question.user.id)
 
@@ -1595,24 +2001,24 @@ def send_answer_notification(user, answer, delete_reason=None):
         mail_uids = to_uids(question)
         mail_uids.difference_update(set(not_to_notify))
 
+        notification_fanout.observe(len(mail_uids), post='answer')
+
         subject = "FOSSEE Forums - {0} - Question has been Answered".format(
             question.category)
-        to = []
+        Notification.objects.bulk_create([
+            Notification(uid=mail_uid, qid=question.id, aid=answer.id)
+            for mail_uid in mail_uids])
         for mail_uid in mail_uids:
-            notification = Notification(
-                uid=mail_uid, qid=question.id, aid=answer.id)
-            notification.save()
-            # Appending user email in 'to' list
-            to.append(get_user_email(mail_uid))
+            incr_notification_count(mail_uid)
 
-        # Sending Email to everyone in 'to' list individually
-        send_email_as_to(subject, plain_message, html_message, from_email, to)
+        # Sending Email to everyone in the thread individually
+        send_email_as_to(subject, plain_message, html_message, from_email, [],
+                         digest_uids=mail_uids)
     # Answer Edited Recently
     elif flag == 2:
         subject = "FOSSEE Forums - {0} - Answer Edited".format(
             question.category)
         from_email = settings.SENDER_EMAIL
-        to = []
 
         if answer.uid == user.id:
             # Answer edited by Answer Author
@@ -1626,13 +2032,13 @@ def send_answer_notification(user, answer, delete_reason=None):
                 })
             plain_message = strip_tags(html_message)
 
-            to.append(question.user.email)
             send_email_as_to(
                 subject,
                 plain_message,
                 html_message,
                 from_email,
-                to)
+                [],
+                digest_uids=[question.user.id])
         else:
             # Answer edited by a Moderator
             html_message = render_to_string(
@@ -1647,21 +2053,19 @@ def send_answer_notification(user, answer, delete_reason=None):
             plain_message = strip_tags(html_message)
 
             mail_uids = to_uids(question)
-            for uid in mail_uids:
-                to.append(get_user_email(uid))
 
             send_email_as_to(
                 subject,
                 plain_message,
                 html_message,
                 from_email,
-                to)
+                [],
+                digest_uids=mail_uids)
     # Answer deleted recently
     elif flag == 3:
         subject = "FOSSEE Forums - {0} - Answer Deleted".format(
             question.category)
         from_email = settings.SENDER_EMAIL
-        to = [question.user.email]
 
         if answer.uid == user.id:
             # Answer deleted by Answer Author
@@ -1677,13 +2081,13 @@ def send_answer_notification(user, answer, delete_reason=None):
                     })
                 plain_message = strip_tags(html_message)
 
-                to.append(question.category.email)
                 send_email_as_to(
                     subject,
                     plain_message,
                     html_message,
                     from_email,
-                    to)
+                    [question.category.email],
+                    digest_uids=[question.user.id])
         else:
             # Answer deleted by a Moderator
             html_message = render_to_string(
@@ -1701,20 +2105,20 @@ def send_answer_notification(user, answer, delete_reason=None):
             if answer.is_spam:
                 # Send mail to Answer Author only if spam answer deleted by
                 # moderator
-                to = [get_user_email(answer.uid)]
+                mail_uids = [answer.uid]
             else:
-                to.append(get_user_email(answer.uid))
-                for comment in AnswerComment.objects.filter(
-                        answer=answer, is_active=True):
-                    to.append(get_user_email(comment.uid))
-                to = list(set(to))   # Removing Duplicates
+                mail_uids = [question.user.id, answer.uid]
+                mail_uids.extend(AnswerComment.objects.filter(
+                    answer=answer, is_active=True).values_list(
+                    'uid', flat=True))
 
             send_email_as_to(
                 subject,
                 plain_message,
                 html_message,
                 from_email,
-                to)
+                [],
+                digest_uids=mail_uids)
 
     # Updating notif flag after sending mails according to the previous flag.
     answer.notif_flag = 0
@@ -1738,11 +2142,11 @@ def send_comment_notification(user, comment, delete_reason=None):
                 aid=answer.id,
                 cid=comment.id)
             notification.save()
+            incr_notification_count(notification.uid)
 
             subject = "FOSSEE Forums - {0} - New Comment under your Question"\
                 .format(
                     question.category)
-            to = [question.user.email]
             html_message = render_to_string(
                 'website/templates/emails/new_comment_email.html', {
                     'title': question.title,
@@ -1751,7 +2155,8 @@ def send_comment_notification(user, comment, delete_reason=None):
                     str(question.id) + "#comm" + str(comment.id),
                 })
             plain_message = strip_tags(html_message)
-            send_email(subject, plain_message, html_message, from_email, to)
+            send_email(subject, plain_message, html_message, from_email, [],
+                       digest_uids=[question.user.id])
 
             not_to_notify.append(question.user.id)
 
@@ -1763,10 +2168,10 @@ def send_comment_notification(user, comment, delete_reason=None):
                 aid=answer.id,
                 cid=comment.id)
             notification.save()
+            incr_notification_count(notification.uid)
 
             subject = "FOSSEE Forums - {0} - New Comment on your answer".format(
                 question.category)
-            to = [get_user_email(answer.uid)]
             html_message = render_to_string(
                 'website/templates/emails/new_comment_email.html', {
                     'title': question.title,
@@ -1776,7 +2181,8 @@ def send_comment_notification(user, comment, delete_reason=None):
                     str(question.id) + "#comm" + str(comment.id),
                 })
             plain_message = strip_tags(html_message)
-            send_email(subject, plain_message, html_message, from_email, to)
+            send_email(subject, plain_message, html_message, from_email, [],
+                       digest_uids=[answer.uid])
 
             not_to_notify.append(answer.uid)
 
@@ -1794,10 +2200,10 @@ def send_comment_notification(user, comment, delete_reason=None):
                 aid=answer.id,
                 cid=comment.id)
             notification.save()
+            incr_notification_count(notification.uid)
 
             subject = "FOSSEE Forums - {0} - Your Comment has a Reply".format(
                 question.category)
-            to = [get_user_email(last_comment.uid)]
             html_message = render_to_string(
                 'website/templates/emails/new_comment_email.html', {
                     'title': question.title,
@@ -1807,13 +2213,15 @@ def send_comment_notification(user, comment, delete_reason=None):
                     str(question.id) + "#comm" + str(comment.id),
                 })
             plain_message = strip_tags(html_message)
-            send_email(subject, plain_message, html_message, from_email, to)
+            send_email(subject, plain_message, html_message, from_email, [],
+                       digest_uids=[last_comment.uid])
 
             not_to_notify.append(last_comment.uid)
 
         # Notifying all other users in the thread
         mail_uids = to_uids(question)
         mail_uids.difference_update(set(not_to_notify))
+        notification_fanout.observe(len(mail_uids), post='comment')
 
         subject = "FOSSEE Forums - {0} - New Comment under the Question".format(
             question.category)
@@ -1827,25 +2235,21 @@ def send_comment_notification(user, comment, delete_reason=None):
             })
         plain_message = strip_tags(html_message)
 
-        to = []
+        Notification.objects.bulk_create([
+            Notification(uid=mail_uid, qid=question.id, aid=answer.id,
+                         cid=comment.id)
+            for mail_uid in mail_uids])
         for mail_uid in mail_uids:
-            notification = Notification(
-                uid=mail_uid,
-                qid=question.id,
-                aid=answer.id,
-                cid=comment.id)
-            notification.save()
-            # Appending user email in 'to' list
-            to.append(get_user_email(mail_uid))
+            incr_notification_count(mail_uid)
 
-        # Sending Email to everyone in 'to' list individually
-        send_email_as_to(subject, plain_message, html_message, from_email, to)
+        # Sending Email to everyone in the thread individually
+        send_email_as_to(subject, plain_message, html_message, from_email, [],
+                         digest_uids=mail_uids)
     # Comment Edited Recently
     if flag == 2:
         subject = "FOSSEE Forums - {0} - Comment Edited".format(
             question.category)
         from_email = settings.SENDER_EMAIL
-        to = []
 
         if comment.uid == user.id:
             # Comment edited by Comment Author
@@ -1859,13 +2263,13 @@ def send_comment_notification(user, comment, delete_reason=None):
                 })
             plain_message = strip_tags(html_message)
 
-            to.append(get_user_email(answer.uid))
             send_email_as_to(
                 subject,
                 plain_message,
                 html_message,
                 from_email,
-                to)
+                [],
+                digest_uids=[answer.uid])
         else:
             # Comment edited by a Moderator
             html_message = render_to_string(
@@ -1881,22 +2285,20 @@ def send_comment_notification(user, comment, delete_reason=None):
 
             mail_uids = to_uids(question)
             mail_uids.discard(user.id)
-            for uid in mail_uids:
-                to.append(get_user_email(uid))
 
             send_email_as_to(
                 subject,
                 plain_message,
                 html_message,
                 from_email,
-                to)
+                [],
+                digest_uids=mail_uids)
 
     # Comment Deleted Recently
     elif flag == 3:
         subject = "FOSSEE Forums - {0} - Comment Deleted".format(
             question.category)
         from_email = settings.SENDER_EMAIL
-        to = []
 
         if comment.uid == user.id:
             # Comment Deleted by Comment Author
@@ -1913,13 +2315,13 @@ def send_comment_notification(user, comment, delete_reason=None):
                     })
                 plain_message = strip_tags(html_message)
 
-                to.append(get_user_email(answer.uid))
                 send_email_as_to(
                     subject,
                     plain_message,
                     html_message,
                     from_email,
-                    to)
+                    [],
+                    digest_uids=[answer.uid])
 
         else:
             # Comment deleted by a Moderator
@@ -1939,18 +2341,17 @@ def send_comment_notification(user, comment, delete_reason=None):
             if comment.is_spam:
                 # Send mail to Comment Author only if spam comment deleted by
                 # moderator
-                to = [get_user_email(comment.uid)]
+                mail_uids = [comment.uid]
             else:
                 mail_uids = to_uids(question)
-                for uid in mail_uids:
-                    to.append(get_user_email(uid))
 
             send_email_as_to(
                 subject,
                 plain_message,
                 html_message,
                 from_email,
-                to)
+                [],
+                digest_uids=mail_uids)
 
     # Updating notif flag after sending mails according to the previous flag.
     comment.notif_flag = 0
@@ -1978,8 +2379,7 @@ def send_spam_question_notification(user, question):
         # (by the spamFilter), send notification to Moderators
         to = []
         uids = mod_uids(question)
-        for uid in uids:
-            to.append(get_user_email(uid))
+        to.extend(get_user_emails(uids))
 
     send_email_as_to(subject, plain_message, html_message, from_email, to)
 
@@ -2009,8 +2409,7 @@ def send_spam_answer_notification(user, answer):
         # (by the spamFilter), send notification to Moderators
         to = []
         uids = mod_uids(question)
-        for uid in uids:
-            to.append(get_user_email(uid))
+        to.extend(get_user_emails(uids))
 
     send_email_as_to(subject, plain_message, html_message, from_email, to)
 
@@ -2042,12 +2441,60 @@ def send_spam_comment_notification(user, comment):
         # (by the spamFilter), send notification to Moderators
         to = []
         uids = mod_uids(question)
-        for uid in uids:
-            to.append(get_user_email(uid))
+        to.extend(get_user_emails(uids))
 
     send_email_as_to(subject, plain_message, html_message, from_email, to)
 
 
+def send_review_notifications(user, action, question_ids, answer_ids,
+                              comment_ids):
+    """
+    Record the labels of the posts approved or marked as spam from the
+    review queue in DataSet, and send the emails of these actions, all over
+    a single connection. The posts deleted get the emails of the single
+    deletions, without a reason.
+    """
+    questions = list(Question.objects.filter(
+        id__in=question_ids).select_related('user', 'category'))
+    answers = list(Answer.objects.filter(
+        id__in=answer_ids).select_related('question__category'))
+    comments = list(AnswerComment.objects.filter(
+        id__in=comment_ids).select_related('answer__question__category'))
+
+    is_spam = action == 'spam'
+    if action != 'delete':
+        process_Spam_bulk([(post.body, is_spam)
+                           for posts in (questions, answers, comments)
+                           for post in posts])
+
+    with batch_emails():
+        for question in questions:
+            if action == 'delete':
+                send_question_notification(user, question)
+            elif is_spam:
+                send_spam_question_notification(user, question)
+            else:
+                send_question_approve_notification(question)
+                send_question_notification(question.user, question,
+                                           previous_title=question.title)
+        for answer in answers:
+            if action == 'delete':
+                send_answer_notification(user, answer)
+            elif is_spam:
+                send_spam_answer_notification(user, answer)
+            else:
+                send_answer_approve_notification(answer)
+                send_answer_notification(answer.user(), answer)
+        for comment in comments:
+            if action == 'delete':
+                send_comment_notification(user, comment)
+            elif is_spam:
+                send_spam_comment_notification(user, comment)
+            else:
+                send_comment_approve_notification(comment)
+                send_comment_notification(comment.user(), comment)
+
+
 def send_question_approve_notification(question):
     subject = "FOSSEE Forums - {0} - Question Approved".format(
         question.category)
@@ -2117,6 +2564,7 @@ def auto_clean_spam():
         Question.objects.filter(
                 id=x['id']).update(
                 is_active=False)
+        touch_posts(question_ids=[x['id']])
         question_count += 1
         print("Deleted 30 days old spam question")
     answers = Answer.objects.filter(
@@ -2127,6 +2575,7 @@ def auto_clean_spam():
         Answer.objects.filter(
                 id=y['id']).update(
                 is_active=False)
+        touch_posts(answer_ids=[y['id']])
         answer_count += 1
         print("Deleted 30 days old spam answers")
     answerscommnet = AnswerComment.objects.filter(
@@ -2137,6 +2586,7 @@ def auto_clean_spam():
         AnswerComment.objects.filter(
                 id=z['id']).update(
                 is_active=False)
+        touch_posts(comment_ids=[z['id']])
         commentcount = 0
         print("Deleted 30 days old spam answers comment")
 
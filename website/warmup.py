@@ -0,0 +1,99 @@
+"""
+Warm-up of the process serving the forum before its first request.
+
+By default every worker pays on its first request for importing the views,
+compiling the templates and training the spam filter. A pre-fork server
+loading the application in its master process (e.g. gunicorn --preload) can
+call warm_up() there instead: the workers are then forked with everything
+loaded and share that memory copy-on-write.
+"""
+import gc
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateSyntaxError, engines
+from django.urls import get_resolver
+
+from forums.local import TRAIN_SPAMFILTER
+
+logger = logging.getLogger(__name__)
+
+
+def load_urls():
+    """Import all the URL confs and views. Return the number of URL names."""
+    return len(get_resolver().reverse_dict)
+
+
+def template_names(directory):
+    """Yield the names of the templates found in a template directory."""
+    for root, _, files in os.walk(directory):
+        # The template directories also contain the collected static files,
+        # only the templates/ directories hold templates.
+        if '/templates' not in root[len(directory):]:
+            continue
+        for filename in files:
+            if filename.endswith(('.html', '.txt')):
+                yield os.path.relpath(os.path.join(root, filename), directory)
+
+
+def compile_templates():
+    """
+    Compile the templates of the Django template engines. This is only kept
+    for the following requests when the cached template loader is used.
+    Return the number of compiled templates.
+    """
+    count = 0
+    for engine in engines.all():
+        for directory in engine.engine.dirs:
+            for name in template_names(directory):
+                try:
+                    engine.get_template(name)
+                except TemplateSyntaxError:
+                    logger.warning('Template %s could not be compiled', name)
+                else:
+                    count += 1
+    return count
+
+
+def load_spam_filter():
+    """Import the text cleaning libraries and train the spam filter."""
+    from . import spamFilter
+    from .cleanText import clean_string
+
+    clean_string('warm up')
+    # The spam filter of the scoring server is used instead, if there is one
+    if TRAIN_SPAMFILTER is True and not settings.SPAM_SERVER_SOCKET:
+        spamFilter.get_trained()
+    return spamFilter.trained is not None
+
+
+WARM_UP_STEPS = [
+    ('urls', load_urls),
+    ('templates', compile_templates),
+    ('spam filter', load_spam_filter),
+]
+
+
+def warm_up():
+    """
+    Run all the warm-up steps. Return a list of (step, seconds, result).
+    """
+    report = []
+    for name, step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        result = step()
+        seconds = time.perf_counter() - start
+        logger.info('Warm-up %s: %r in %.3fs', name, result, seconds)
+        report.append((name, seconds, result))
+
+    # The database connections must not be shared by the forked workers.
+    connections.close_all()
+    # Keep the garbage collector of the workers from touching (and thus
+    # copying) the memory pages of the objects loaded so far.
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    return report